@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""Compare the CRC-8 table walk against the original byte-at-a-time one.
+
+Run from the repository root: python3 -m benchmarks.bench_crc8
+
+Both implementations are timed in alternation, REPEAT times per frame
+length, so drift of the machine hits both alike. The speedup is given for
+the best and the median run, and as the range over all frame lengths.
+"""
+
+import os
+import platform
+import timeit
+
+from nevermoremax.firmware import crc8
+
+# the frame lengths of the protocol, from a bare header to MAX_MSG_LEN
+FRAME_LENGTHS = [4, 8, 16, 32, 56, 64]
+NUMBER = 20000
+REPEAT = 25
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return (values[mid] + values[~mid]) / 2.0
+
+
+def time_ns(impls, data):
+    """Per implementation the ns per call of every repeat."""
+    runs = [[] for _ in impls]
+    for _ in range(REPEAT):
+        for idx, fn in enumerate(impls):
+            elapsed = timeit.timeit(lambda: fn(data), number=NUMBER)
+            runs[idx].append(elapsed / NUMBER * 1e9)
+    return runs
+
+
+def main():
+    reference = crc8.calc_crc8_reference
+    table = crc8.calc_crc8_table
+    print(
+        "{} {}, best and median of {} x {} calls".format(
+            platform.python_implementation(), platform.python_version(), REPEAT, NUMBER
+        )
+    )
+    print(
+        "{:>6} {:>12} {:>12} {:>9} {:>9}".format(
+            "bytes", "reference", "table", "best", "median"
+        )
+    )
+    best_speedups = []
+    for frame_len in FRAME_LENGTHS:
+        data = os.urandom(frame_len)
+        ref_runs, table_runs = time_ns([reference, table], data)
+        best = min(ref_runs) / min(table_runs)
+        typical = median(ref_runs) / median(table_runs)
+        best_speedups.append(best)
+        print(
+            "{:>6} {:>9.0f} ns {:>9.0f} ns {:>8.2f}x {:>8.2f}x".format(
+                frame_len, min(ref_runs), min(table_runs), best, typical
+            )
+        )
+    print(
+        "speedup over {}-{} bytes: {:.2f}x to {:.2f}x".format(
+            FRAME_LENGTHS[0], FRAME_LENGTHS[-1], min(best_speedups), max(best_speedups)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
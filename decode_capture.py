@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""Decode Nevermore Max wire captures (``capture_wire: True``) offline.
+
+    python3 decode_capture.py nevermore-max.cap [--out readings.npz] [--replay]
+
+Needs numpy.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from nevermoremax import wirecapture
+from nevermoremax.firmware import messagepacket
+from nevermoremax.firmware import messages
+
+
+def replay(path):
+    # feed the capture through the streaming parser, as Klipper did
+    parser = messagepacket.MessageParser()
+    frames = 0
+    for _, chunk in wirecapture.iter_chunks(path):
+        parser.append(chunk)
+        for _ in parser.parse_all():
+            frames += 1
+    return parser, frames
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="+")
+    parser.add_argument("--out", help="save the decoded readings to this .npz file")
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="also run the capture through MessageParser and compare",
+    )
+    args = parser.parse_args()
+
+    columns = []
+    for path in args.captures:
+        start = time.perf_counter()
+        data, starts, lengths, frame_times = wirecapture.capture_frames(path)
+        readings = wirecapture.decode_readings(data, starts, lengths, frame_times)
+        elapsed = time.perf_counter() - start
+        columns.append(readings)
+
+        print(f"{path}: {len(data)} bytes")
+        if len(frame_times):
+            print(f"  {frame_times[-1] - frame_times[0]:.0f} s of traffic")
+        print(f"  {len(starts)} frames, {len(readings['frame'])} readings")
+        print(f"  {len(data) - int(lengths.sum())} bytes outside frames")
+        msg_ids, counts = np.unique(data[starts + 2], return_counts=True)
+        for msg_id, count in zip(msg_ids.tolist(), counts.tolist()):
+            msg_type = messages.MESSAGE_TYPES.get(msg_id)
+            name = msg_type.__name__ if msg_type else f"0x{msg_id:02X}"
+            print(f"    {name}: {count}")
+        print(f"  decoded in {elapsed:.3f} s")
+
+        if args.replay:
+            start = time.perf_counter()
+            stream, frames = replay(path)
+            print(
+                f"  MessageParser: {frames} frames, {stream.crc_errors} crc errors, "
+                f"{stream.length_errors} length errors, {stream.resyncs} resyncs "
+                f"in {time.perf_counter() - start:.3f} s"
+            )
+            if frames != len(starts):
+                print("  frame counts differ!")
+
+    if args.out:
+        np.savez(
+            args.out,
+            **{name: np.concatenate([c[name] for c in columns]) for name in columns[0]},
+        )
+
+
+if __name__ == "__main__":
+    main()
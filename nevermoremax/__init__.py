@@ -1,17 +1,26 @@
 import logging
 import serial
-import threading
-import csv
 import time
-import os.path
-
-try:
-    import queue
-except ImportError:
-    import Queue as queue
+import os
 
 from .firmware import messagepacket
 from .firmware import messages
+from .clocksync import ClockSync, DEVICE_MS_WRAP
+from .pending import PendingRequests
+from .serialwriter import SerialWriter
+from .csvlog import CsvLogger
+from . import binlog
+from .wirecapture import WireCapture
+from .history import History, HistorySubscription, check_fields
+
+RESPONSE_MSG_IDS = frozenset(messages.RESPONSE_IDS.values())
+
+# TimeSyncRequest interval while the clock fit fills up, and after
+TIME_SYNC_FAST_INTERVAL = 1.
+TIME_SYNC_INTERVAL = 10.
+# a reading mapped further than this past its receive time means the clock
+# fit is off, seconds
+MAX_SAMPLE_LEAD = 1.
 
 class NevermoreTemperature:
     def __init__(self, config, setup_source_callback_name):
@@ -63,11 +72,68 @@ class NevermoreMaxController:
         serial_port = config.get("serial")
         serial_baud = config.get("baud", default=115200)
         self.log_to_file = config.getboolean("log_to_file", False)
-        self.log_queue = queue.Queue()
+        # binary logs every field of a reading, see binlog.py
+        self.log_format = config.getchoice(
+            "log_format", {"csv": "csv", "binary": "binary"}, "csv")
+        # append every received byte to nevermore-max.cap, see wirecapture.py
+        self.capture_wire = config.getboolean("capture_wire", False)
+        self.latest_reading_only = config.getboolean("latest_reading_only", True)
+        self.reading_format = config.getint(
+            "reading_format", messages.READING_FORMAT_V2,
+            minval=messages.READING_FORMAT_V1, maxval=messages.READING_FORMAT_STATS)
+        self.field_mask = self._parse_report_fields(config)
+        self.report_policy = self._parse_report_policy(config)
+        self.sample_rate = config.getfloat("sample_rate", None, minval=0.001, maxval=20.)
+        # SET_NEVERMORE_MAX_STATE sends at most one state per window, the latest
+        self.state_coalesce_time = config.getfloat(
+            "state_coalesce_time", 0.1, minval=0., maxval=10.)
+        self.requested_state = None
+        self.sent_state = None
+        self.acknowledged_state = None
+        self.state_in_flight = False
+        self.state_next_send = 0.
+        self.firmware_version = None
+        self.scheduler_stats = {}
+        self.clock_sync = ClockSync()
+        self.time_sync_seq = 0
+        self.time_sync_sent = None
+        self.last_reading_ms = None
+        self.csv_logger = None
+        self.wire_capture = None
         self.serial = serial.Serial(serial_port, serial_baud, timeout=0, write_timeout=0)
-        self.serial_parser = messagepacket.MessageParser()
+        self.serial_parser = messagepacket.MessageParser(frame_lengths=messages.FRAME_LENGTHS)
+        self.skipped_readings = 0
+        # (reading, sample_time) waiting for the end of the serial wakeup
+        self.newest_reading = None
+        self.serial_fd = self.serial.fileno()
+        self.writer = SerialWriter(lambda data: os.write(self.serial_fd, data))
+        self.pending = PendingRequests(self.writer.send)
+        self.dispatcher = messages.Dispatcher()
+        self.dispatcher.register(messages.SensorReading, self._handle_sensor_reading)
+        self.dispatcher.register(messages.SensorReadingV2, self._handle_sensor_reading)
+        self.dispatcher.register(messages.SensorReadingMasked, self._handle_sensor_reading)
+        self.dispatcher.register(messages.SensorReadingStats, self._handle_sensor_reading)
+        self.dispatcher.register(messages.SensorReadingBatch, self._handle_sensor_reading_batch)
+        self.dispatcher.register(messages.VersionResponse, self._handle_version_response)
+        self.dispatcher.register(messages.StateChangeResponse, self._handle_state_change_response)
+        self.dispatcher.register(messages.ReadingFormatResponse, self._handle_reading_format_response)
+        self.dispatcher.register(messages.FieldMaskResponse, self._handle_field_mask_response)
+        self.dispatcher.register(messages.ReportPolicyResponse, self._handle_report_policy_response)
+        self.dispatcher.register(messages.SampleRateResponse, self._handle_sample_rate_response)
+        self.dispatcher.register(messages.SchedulerDiagnostics, self._handle_scheduler_diagnostics)
+        self.dispatcher.register(messages.TimeSyncResponse, self._handle_time_sync_response)
         self.printer = config.get_printer()
-        self.printer.get_reactor().register_fd(self.serial.fileno(), self._serial_data_ready)
+        self.printer.register_event_handler("klippy:ready", self._handle_ready)
+        self.reactor = self.printer.get_reactor()
+        self.link_start_time = self.reactor.monotonic()
+        self.serial_fd_handle = self.reactor.register_fd(
+            self.serial_fd, self._serial_data_ready, self._serial_writable)
+        self.writer.wants_write = lambda waiting: self.reactor.set_fd_wake(
+            self.serial_fd_handle, True, waiting)
+        self.writer.link_lost = self._serial_link_lost
+        self.time_sync_timer = self.reactor.register_timer(self._time_sync_event)
+        self.request_timer = self.reactor.register_timer(self._request_timeout_event)
+        self.state_timer = self.reactor.register_timer(self._flush_state)
         self.intake_temperature_cb = lambda time, val: None
         self.exhaust_temperature_cb = lambda time, val: None
         self.gcode = self.printer.lookup_object('gcode')
@@ -83,37 +149,104 @@ class NevermoreMaxController:
             desc="Print Detailed Nevermore Max Controller Sensor Measurement")
 
 
+        self.gcode.register_command(
+            'GET_NEVERMORE_MAX_LINK_STATS',
+            self._get_link_stats,
+            desc="Print Nevermore Max Controller Serial Link Statistics")
+
         self.gcode.register_command(
             'SET_NEVERMORE_MAX_STATE',
             self._set_state,
             desc="Set Nevermore Max Controller State")
 
+        self.gcode.register_command(
+            'SET_NEVERMORE_MAX_SAMPLE_RATE',
+            self._set_sample_rate,
+            desc="Set Nevermore Max Controller Sensor Sample Rate")
+
         self.measurement = {}
+        # every field at several resolutions, for charts
+        self.history = History()
+        self.history_subscriptions = []
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("nevermore_max/history", self._handle_history_request)
 
         if self.log_to_file:
-            threading.Thread(target=self._logging_worker).start()
+            self.csv_logger = self._create_csv_logger(config)
+            self.csv_logger.start()
+            self.printer.register_event_handler("klippy:disconnect", self.csv_logger.stop)
+
+        if self.capture_wire:
+            capture_file = os.path.join(self._log_dir(), 'nevermore-max.cap')
+            logging.info("NevermoreMaxController: Capturing Serial Data to '{}'".format(
+                capture_file))
+            self.wire_capture = WireCapture(capture_file, **self._log_rotation(config))
+            self.wire_capture.start()
+            self.printer.register_event_handler("klippy:disconnect", self.wire_capture.stop)
+
+    @staticmethod
+    def _parse_report_fields(config):
+        # comma separated SensorReading attributes and/or intake/exhaust,
+        # empty means complete readings
+        names = [name.strip() for name in config.get("report_fields", "").split(",")]
+        names = [name for name in names if name]
+        if not names:
+            return None
+        try:
+            mask = messages.field_mask(names)
+        except ValueError as e:
+            raise config.error("nevermoremax: report_fields: {}".format(e))
+        # the temperature callbacks always need the bme temperatures
+        return mask | messages.field_mask(["in_bme_temp_C", "out_bme_temp_C"])
+
+    @staticmethod
+    def _parse_report_policy(config):
+        # report on change when report_max_silence (seconds) is set, with
+        # report_deadbands as comma separated field=deadband overrides
+        max_silence = config.getfloat("report_max_silence", 0., minval=0., maxval=3600.)
+        if not max_silence:
+            return None
+        overrides = {}
+        for item in config.get("report_deadbands", "").split(","):
+            if not item.strip():
+                continue
+            name, _, value = item.partition("=")
+            try:
+                overrides[name.strip()] = float(value)
+            except ValueError:
+                raise config.error(
+                    "nevermoremax: report_deadbands: invalid entry '{}'".format(item.strip()))
+        try:
+            deadbands = messages.report_deadbands(overrides)
+        except ValueError as e:
+            raise config.error("nevermoremax: report_deadbands: {}".format(e))
+        return messages.ReportPolicyRequest(int(max_silence * 1000), deadbands)
 
-    def _logging_worker(self):
+    def _log_dir(self):
         try:
             log_file = self.printer.get_start_args()['log_file']
-            log_dir = os.path.dirname(log_file)
+            return os.path.dirname(log_file)
         except KeyError:
-            log_dir = '/tmp'
-
+            return '/tmp'
+
+    @staticmethod
+    def _log_rotation(config):
+        # rotated to <file>.1 ... by size (MiB) or age (hours)
+        return dict(
+            max_bytes=int(config.getfloat("log_rotate_size", 10., minval=0.) * 1024 * 1024),
+            max_age=config.getfloat("log_rotate_age", 24., minval=0.) * 3600.,
+            backup_count=config.getint("log_backup_count", 5, minval=0))
+
+    def _create_csv_logger(self, config):
+        log_dir = self._log_dir()
+        rotation = self._log_rotation(config)
+        if self.log_format == 'binary':
+            log_file = os.path.join(log_dir, 'nevermore-max.bin')
+            logging.info("NevermoreMaxController: Opening Log File '{}'".format(log_file))
+            return binlog.BinaryLogger(log_file, **rotation)
         log_file = os.path.join(log_dir, 'nevermore-max.csv')
         logging.info("NevermoreMaxController: Opening Log File '{}'".format(log_file))
-
-        with open(log_file, 'w') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(['time', 'in_temp_C', 'out_temp_C'])
-
-            while True:
-                item = self.log_queue.get()
-                #logging.info('Working on {}'.format(item))
-                csvwriter.writerow([time.time(), item.in_bme_temp_C, item.out_bme_temp_C])
-                csvfile.flush()
-                self.log_queue.task_done()
-
+        return CsvLogger(log_file, ['time', 'in_temp_C', 'out_temp_C'], **rotation)
 
     def setup_intake_temperature_callback(self, callback):
         self.intake_temperature_cb = callback
@@ -122,62 +255,370 @@ class NevermoreMaxController:
         self.exhaust_temperature_cb = callback
 
     def get_status(self, eventtime):
-        return self.measurement
+        status = dict(self.measurement)
+        status['state'] = self.acknowledged_state
+        status['requested_state'] = self.requested_state
+        status['link'] = self.get_link_stats(eventtime)
+        status['scheduler'] = dict(self.scheduler_stats)
+        if self.csv_logger is not None:
+            status['log'] = self.csv_logger.get_stats()
+        if self.wire_capture is not None:
+            status['capture'] = self.wire_capture.get_stats()
+        return status
+
+    def get_link_stats(self, eventtime):
+        parser = self.serial_parser
+        elapsed = eventtime - self.link_start_time
+        stats = {
+            'bytes_received': parser.bytes_received,
+            'rx_bytes_per_s': round(parser.bytes_received / elapsed, 1) if elapsed > 0. else 0.,
+            'frames_received': parser.frames,
+            'crc_errors': parser.crc_errors,
+            'length_errors': parser.length_errors,
+            'resyncs': parser.resyncs,
+            'discarded_bytes': parser.discarded_bytes,
+            'decode_errors': self.dispatcher.decode_error_count,
+            'unknown_frames': self.dispatcher.unknown_count,
+            'skipped_readings': self.skipped_readings,
+            'frames_by_type': dict(
+                (messages.MESSAGE_TYPES[msg_id].__name__, count)
+                for msg_id, count in self.dispatcher.counts.items()),
+            'request_retries': self.pending.retry_count,
+            'request_timeouts': self.pending.timeout_count,
+        }
+        stats.update(self.writer.get_stats())
+        if self.clock_sync.is_synced():
+            stats['clock_error_ms'] = round(self.clock_sync.error * 1000., 3)
+            stats['clock_drift_ppm'] = round(self.clock_sync.drift_ppm(), 1)
+        return stats
 
     def _serial_data_ready(self, eventtime):
         data = self.serial.read(self.serial.in_waiting)
+        if self.wire_capture is not None and data:
+            self.wire_capture.capture(time.time(), data)
 
         self.serial_parser.append(data)
-        msg, _ = self.serial_parser.parse()
-        if msg:
-            self._received_message(msg, eventtime)
+        for msg in self.serial_parser.parse_all():
+            decoded = self.dispatcher.dispatch(msg, eventtime)
+            if decoded is not None and msg.msg_id in RESPONSE_MSG_IDS:
+                self.pending.complete(decoded, eventtime)
+
+        # every reading is logged, but when several arrive in one wakeup only
+        # the newest updates the temperatures, so a backlog never delays them
+        if self.newest_reading is not None:
+            reading, sample_time = self.newest_reading
+            self.newest_reading = None
+            self._update_measurement(reading, sample_time)
+        self._update_request_timer()
+
+    def _serial_writable(self, eventtime):
+        self.writer.flush()
+
+    def _serial_link_lost(self, error):
+        logging.error("Nevermore Max serial write failed: {}".format(error))
+        self.gcode.respond_info("Nevermore Max serial link down: {}".format(error))
+
+    def _send_request(self, request, callback=None):
+        # sent now or once fewer requests are in flight, retried until answered
+        self.pending.submit(request, self.reactor.monotonic(), callback or self._request_done)
+        self._update_request_timer()
+
+    def _update_request_timer(self):
+        deadline = self.pending.next_deadline()
+        self.reactor.update_timer(
+            self.request_timer, self.reactor.NEVER if deadline is None else deadline)
+
+    def _request_timeout_event(self, eventtime):
+        deadline = self.pending.check_timeouts(eventtime)
+        return self.reactor.NEVER if deadline is None else deadline
+
+    def _request_done(self, request, response):
+        if response is None:
+            logging.warning("Nevermore Max did not answer {}".format(request))
+            self.gcode.respond_info("Nevermore Max did not answer {}".format(request))
+
+    def _handle_ready(self):
+        # the version response selects the reading format the firmware supports
+        self._send_request(messages.VersionRequest())
 
     def _request_version(self, gcmd):
-        self.serial.write(messages.VersionRequest().serialize())
+        self._send_request(messages.VersionRequest())
         logging.info("Requesting Nevermore Max Firmware Version")
 
     def _set_state(self, gcmd):
         state = gcmd.get_int('STATE', default=None, minval=0, maxval=255)
         if state is not None:
-            self.serial.write(messages.StateChangeRequest(state).serialize())
+            self.requested_state = state
+            self.reactor.update_timer(
+                self.state_timer, self._flush_state(self.reactor.monotonic()))
         else:
             gcmd.respond_info("STATE is required")
 
+    def _flush_state(self, eventtime):
+        # send the latest requested state once the previous state change is
+        # answered and state_coalesce_time passed, returns the next wake time
+        if self.state_in_flight or self.requested_state == self.sent_state:
+            return self.reactor.NEVER
+        if eventtime < self.state_next_send:
+            return self.state_next_send
+        self.sent_state = self.requested_state
+        self.state_in_flight = True
+        self.state_next_send = eventtime + self.state_coalesce_time
+        self._send_request(messages.StateChangeRequest(self.sent_state), self._state_done)
+        return self.reactor.NEVER
+
+    def _state_done(self, request, response):
+        self.state_in_flight = False
+        if response is None:
+            self._request_done(request, response)
+            # unknown if it arrived, the next SET_NEVERMORE_MAX_STATE sends again
+            self.sent_state = None
+            if self.requested_state == request.state:
+                return
+        self.reactor.update_timer(
+            self.state_timer, self._flush_state(self.reactor.monotonic()))
+
+    def _set_sample_rate(self, gcmd):
+        rate = gcmd.get_float('RATE', minval=0.001, maxval=20.)
+        if (self.firmware_version is not None
+                and self.firmware_version < messages.SAMPLE_RATE_MIN_VERSION):
+            raise gcmd.error("Nevermore Max firmware does not support SET_NEVERMORE_MAX_SAMPLE_RATE")
+        self.sample_rate = rate
+        self._send_request(messages.SampleRateRequest(messages.sample_period_ms(rate)))
+
+    def _get_link_stats(self, gcmd):
+        stats = self.get_link_stats(self.reactor.monotonic())
+        lines = ["Nevermore Max Link:"]
+        for name in sorted(stats):
+            lines.append("  {}: {}".format(name, stats[name]))
+        gcmd.respond_info("\n".join(lines))
+
     def _get_measurement(self, gcmd):
         self.gcode.respond_info("Nevermore Max Measurement: {}".format(self.measurement))
 
-    def _received_message(self, msg, eventtime):
-        #logging.info("Received NMC Msg: {}".format(msg))
-        if msg.msg_id == messages.SensorReading.MsgId:
-            reading = messages.SensorReading.from_message(msg)
-            #logging.info("Received: {}".format(reading))
-            self.intake_temperature_cb(eventtime, {
-                'temperature': reading.in_bme_temp_C,
-                'tvoc': reading.in_sgp_TVOC
+    def _sample_time(self, reading, eventtime):
+        # reactor time the reading was sampled, the receive time for firmware
+        # without timestamps
+        device_ms = reading.timestamp_ms
+        if device_ms is None or not self.clock_sync.is_synced():
+            return eventtime
+        last_ms, self.last_reading_ms = self.last_reading_ms, device_ms
+        backwards = (last_ms is not None and (device_ms - last_ms)
+                     % DEVICE_MS_WRAP >= DEVICE_MS_WRAP // 2)
+        sample_time = self.clock_sync.host_time(device_ms)
+        if backwards or sample_time > eventtime + MAX_SAMPLE_LEAD:
+            # the device restarted between two sync samples or the fit is
+            # off, fit the clock again
+            logging.info("Nevermore Max clock fit reset, device clock jumped")
+            self._restart_clock_sync()
+            return eventtime
+        return min(sample_time, eventtime)
+
+    def _log_reading(self, reading, sample_time):
+        # the log has wall clock time
+        wall_time = time.time() - self.reactor.monotonic() + sample_time
+        if self.log_format == 'binary':
+            self.csv_logger.log(binlog.encode_record(wall_time, reading))
+        else:
+            self.csv_logger.log([wall_time, reading.in_bme_temp_C, reading.out_bme_temp_C])
+
+    def _handle_history_request(self, web_request):
+        # fields: list of SENSOR_FIELDS names, default all
+        # start/end: reactor time, or duration: seconds back from now
+        # resolution: bucket seconds (0 = raw), or max_points to pick one
+        # subscribe: push the changes of the chosen resolution as they come
+        now = self.reactor.monotonic()
+        fields = web_request.get('fields', None)
+        start = web_request.get_float('start', None)
+        duration = web_request.get_float('duration', None)
+        if duration is not None:
+            start = now - duration
+        try:
+            fields = check_fields(fields)
+            result = self.history.query(
+                fields, start, web_request.get_float('end', None),
+                web_request.get_float('resolution', None),
+                web_request.get_int('max_points', None))
+        except (ValueError, TypeError) as e:
+            raise web_request.error("nevermore_max/history: {}".format(e))
+        result['eventtime'] = now
+        # add to a time to get the wall clock time
+        result['wall_offset'] = time.time() - now
+        if web_request.get('subscribe', False):
+            self._subscribe_history(web_request, fields, result['resolution'])
+        web_request.send(result)
+
+    def _subscribe_history(self, web_request, fields, resolution):
+        cconn = web_request.get_client_connection()
+        template = web_request.get_dict('response_template', {})
+
+        def send(columns):
+            if cconn.is_closed():
+                return False
+            msg = dict(template)
+            msg['params'] = columns
+            cconn.send(msg)
+            return True
+        self.history_subscriptions.append(
+            HistorySubscription(self.history.tier(resolution), fields, send))
+
+    def _update_measurement(self, reading, sample_time):
+        self.intake_temperature_cb(sample_time, {
+            'temperature': reading.in_bme_temp_C,
+            'tvoc': reading.in_sgp_TVOC
+        })
+        self.exhaust_temperature_cb(sample_time, {
+            'temperature': reading.out_bme_temp_C,
+            'tvoc': reading.out_sgp_TVOC
+        })
+        self.measurement = {
+            'intake': {
+                'temp_C': reading.in_bme_temp_C
+            },
+            'exhaust': {
+                'temp_C': reading.out_bme_temp_C
+            }
+        }
+        if isinstance(reading, messages.SensorReadingStats):
+            # spread of the oversampled values since the previous report
+            self.measurement['samples'] = reading.count
+            self.measurement['intake'].update({
+                'temp_C_min': reading.minimum.in_bme_temp_C,
+                'temp_C_max': reading.maximum.in_bme_temp_C,
+                'tvoc_max': reading.maximum.in_sgp_TVOC,
             })
-            self.exhaust_temperature_cb(eventtime, {
-                'temperature': reading.out_bme_temp_C,
-                'tvoc': reading.out_sgp_TVOC
+            self.measurement['exhaust'].update({
+                'temp_C_min': reading.minimum.out_bme_temp_C,
+                'temp_C_max': reading.maximum.out_bme_temp_C,
+                'tvoc_max': reading.maximum.out_sgp_TVOC,
             })
-            self.measurement = {
-                'intake': {
-                    'temp_C': reading.in_bme_temp_C
-                },
-                'exhaust': {
-                    'temp_C': reading.out_bme_temp_C
-                }
+
+    def _record_reading(self, reading, eventtime):
+        # history and log get every reading, returns its sample time
+        sample_time = self._sample_time(reading, eventtime)
+        self.history.add(sample_time, reading)
+        if self.log_to_file:
+            self._log_reading(reading, sample_time)
+        return sample_time
+
+    def _newer_reading(self, reading, sample_time):
+        if not self.latest_reading_only:
+            self._update_measurement(reading, sample_time)
+            return
+        if self.newest_reading is not None:
+            self.skipped_readings += 1
+        self.newest_reading = (reading, sample_time)
+
+    def _push_history(self, eventtime):
+        if self.history_subscriptions:
+            self.history_subscriptions = [
+                sub for sub in self.history_subscriptions if sub.push(eventtime)]
+
+    def _handle_sensor_reading(self, reading, eventtime):
+        #logging.info("Received: {}".format(reading))
+        sample_time = self._record_reading(reading, eventtime)
+        self._newer_reading(reading, sample_time)
+        self._push_history(eventtime)
+
+    def _handle_sensor_reading_batch(self, batch, eventtime):
+        if not batch.readings:
+            return
+        for reading in batch.readings:
+            sample_time = self._record_reading(reading, eventtime)
+        # the earlier readings of a batch are a backlog, only the last counts
+        self._newer_reading(batch.readings[-1], sample_time)
+        self._push_history(eventtime)
+
+    def _handle_version_response(self, version, eventtime):
+        logging.info("Nevermore Max Firmware Version: {}".format(version.version))
+        self.gcode.respond_info("Nevermore Max Firmware Version: {}".format(version.version))
+        # older firmware only sends SensorReading and ignores these requests
+        firmware_version = self.firmware_version = messages.version_tuple(version.version)
+        # the device may have restarted, start the clock fit over
+        self.pending.use_seq = firmware_version >= messages.SEQUENCE_MIN_VERSION
+        if firmware_version >= messages.TIME_SYNC_MIN_VERSION:
+            self._restart_clock_sync()
+        else:
+            self.clock_sync.reset()
+        if (self.field_mask is not None
+                and firmware_version >= messages.FIELD_MASK_MIN_VERSION):
+            self._send_request(messages.FieldMaskRequest(self.field_mask))
+        elif (self.reading_format != messages.READING_FORMAT_V1
+                and firmware_version >= messages.READING_FORMAT_MIN_VERSION):
+            reading_format = self.reading_format
+            if (reading_format == messages.READING_FORMAT_STATS
+                    and firmware_version < messages.READING_FORMAT_STATS_MIN_VERSION):
+                reading_format = messages.READING_FORMAT_V2
+            self._send_request(messages.ReadingFormatRequest(reading_format))
+        if (self.report_policy is not None
+                and firmware_version >= messages.REPORT_POLICY_MIN_VERSION):
+            self._send_request(self.report_policy)
+        if (self.sample_rate is not None
+                and firmware_version >= messages.SAMPLE_RATE_MIN_VERSION):
+            self._send_request(
+                messages.SampleRateRequest(messages.sample_period_ms(self.sample_rate)))
+
+    def _handle_reading_format_response(self, response, eventtime):
+        logging.info("Nevermore Max Reading Format: {}".format(response.reading_format))
+
+    def _handle_field_mask_response(self, response, eventtime):
+        logging.info("Nevermore Max Field Mask: 0x{:04X}".format(response.field_mask))
+
+    def _handle_report_policy_response(self, response, eventtime):
+        logging.info("Nevermore Max Report Policy: {}".format(response))
+
+    def _handle_scheduler_diagnostics(self, diagnostics, eventtime):
+        for task in diagnostics.tasks:
+            name = messages.SCHEDULER_TASK_NAMES.get(task.task_id, str(task.task_id))
+            previous = self.scheduler_stats.get(name)
+            if previous is not None and task.overruns > previous['overruns']:
+                logging.warning("Nevermore Max task '{}' overran {} times, {} periods missed".format(
+                    name, task.overruns - previous['overruns'], task.missed - previous['missed']))
+            self.scheduler_stats[name] = {
+                'runs': task.runs,
+                'overruns': task.overruns,
+                'missed': task.missed,
+                'late_max_ms': task.late_max_ms,
+                'late_mean_ms': task.late_mean_ms,
             }
-            if self.log_to_file:
-                self.log_queue.put_nowait(reading)
-
-        elif msg.msg_id == messages.VersionResponse.MsgId:
-            version = messages.VersionResponse.from_message(msg)
-            logging.info("Nevermore Max Firmware Version: {}".format(version.version))
-            self.gcode.respond_info("Nevermore Max Firmware Version: {}".format(version.version))
-        elif msg.msg_id == messages.StateChangeResponse.MsgId:
-            state = messages.StateChangeResponse.from_message(msg)
-            logging.info("Nevermore Max State: {}".format(state.state))
-            self.gcode.respond_info("Nevermore Max State: {}".format(state.state))
+
+    def _handle_sample_rate_response(self, response, eventtime):
+        logging.info("Nevermore Max Sample Period: {} ms".format(response.period_ms))
+        msg = "Nevermore Max Sample Rate: {:.3f} Hz".format(1000. / response.period_ms)
+        if response.period_ms < messages.SENSOR_REFRESH_PERIOD_MS:
+            msg += ", faster than the sensors refresh, readings repeat values"
+        self.gcode.respond_info(msg)
+
+    def _restart_clock_sync(self):
+        self.clock_sync.reset()
+        self.last_reading_ms = None
+        self.time_sync_sent = None
+        self.reactor.update_timer(self.time_sync_timer, self.reactor.NOW)
+
+    def _time_sync_event(self, eventtime):
+        self.time_sync_seq = (self.time_sync_seq + 1) & 0xFFFF
+        self.time_sync_sent = (self.time_sync_seq, self.reactor.monotonic())
+        self.writer.send(messages.TimeSyncRequest(self.time_sync_seq).serialize(),
+                         key=messages.TimeSyncRequest.MsgId)
+        if len(self.clock_sync.samples) < self.clock_sync.window:
+            return eventtime + TIME_SYNC_FAST_INTERVAL
+        return eventtime + TIME_SYNC_INTERVAL
+
+    def _handle_time_sync_response(self, response, eventtime):
+        # only the latest request counts, late answers have a useless rtt
+        if self.time_sync_sent is None or response.seq != self.time_sync_sent[0]:
+            return
+        send_time = self.time_sync_sent[1]
+        self.time_sync_sent = None
+        self.clock_sync.add_sample(send_time, eventtime, response.device_ms)
+        if len(self.clock_sync.samples) == 1:
+            # a new fit, earlier reading timestamps are from another boot
+            self.last_reading_ms = None
+
+    def _handle_state_change_response(self, state, eventtime):
+        self.acknowledged_state = state.state
+        logging.info("Nevermore Max State: {}".format(state.state))
+        self.gcode.respond_info("Nevermore Max State: {}".format(state.state))
 
 
 def load_config(config):
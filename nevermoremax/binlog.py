@@ -0,0 +1,143 @@
+# Binary log of Nevermore Max readings
+#
+# Every reading is one fixed-size record: the wall clock time, the mask of
+# the fields that were present and all SENSOR_FIELDS in the fixed point
+# encoding of SensorReadingV2, 46 bytes against ~150 for a CSV row with the
+# same data. The file starts with a short header and is only ever appended
+# to. A record cut short by a crash is ignored by the reader and cut off
+# before the writer appends again, so the records after it stay aligned.
+#
+# The reader memory-maps the file as a NumPy structured array. NumPy is
+# only needed for reading, Klipper writes the log without it.
+
+import os
+import struct
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .firmware import messages
+from .csvlog import CsvLogger
+
+MAGIC = b"NMXBIN"
+VERSION = 1
+FILE_HEADER = struct.Struct("<6sHH6x")  # magic, version, record size
+RECORD_STRUCT = struct.Struct(
+    "<dH" + "".join(code for _, code, _ in messages.SENSOR_FIELDS))
+
+# struct codes of the record to NumPy type codes
+_NUMPY_CODES = {
+    "d": "<f8",
+    "f": "<f4",
+    "B": "<u1",
+    "h": "<i2",
+    "H": "<u2",
+    "I": "<u4",
+}
+
+
+def file_header():
+    return FILE_HEADER.pack(MAGIC, VERSION, RECORD_STRUCT.size)
+
+
+def encode_record(wall_time, reading):
+    mask, values = messages.fixed_point_fields(reading)
+    return RECORD_STRUCT.pack(wall_time, mask, *values)
+
+
+class BinaryLogger(CsvLogger):
+    """CsvLogger queueing, group commit and rotation, writing records from
+    encode_record() instead of CSV rows."""
+
+    def __init__(self, path, **kwargs):
+        CsvLogger.__init__(self, path, file_header(), **kwargs)
+
+    def _open(self):
+        # append, a restart must not lose the previous log
+        self._file = open(self.path, 'ab')
+        self._opened_at = time.time()
+        size = self._file.tell()
+        if size and not self._header_matches():
+            # another format or version, or cut short while writing the
+            # header: keep the file aside and start a new one
+            self._file.close()
+            os.rename(self.path, self.path + ".bad")
+            self._file = open(self.path, 'ab')
+            size = 0
+        if not size:
+            self._file.write(self.header)
+            return
+        whole = self._whole_length(size)
+        if whole < size:
+            self._file.truncate(whole)
+        self._opened_at = self._first_row_time(self._opened_at)
+
+    def _header_matches(self):
+        with open(self.path, 'rb') as f:
+            return f.read(len(self.header)) == self.header
+
+    def _whole_length(self, size):
+        # length of the file up to the end of the last whole record
+        return size - (size - len(self.header)) % RECORD_STRUCT.size
+
+    def _write_rows(self, rows):
+        self._file.write(b"".join(rows))
+
+    def _first_row_time(self, default):
+        # the age of a log is the time of its first record
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(FILE_HEADER.size)
+                return struct.unpack("<d", f.read(8))[0]
+        except (IOError, OSError, struct.error):
+            return default
+
+
+def struct_dtype(names, fmt):
+    """NumPy dtype matching the little endian struct format ``fmt``, one
+    field per code named from ``names``."""
+    if np is None:
+        raise ImportError("reading binary logs needs numpy")
+    codes = fmt if isinstance(fmt, str) else fmt.decode()
+    return np.dtype([(name, _NUMPY_CODES[code])
+                     for name, code in zip(names, codes.lstrip("<"))])
+
+
+def record_dtype():
+    """NumPy dtype of one record, field names as in SENSOR_FIELDS."""
+    names = ["time", "field_mask"] + [
+        name for name, _, _ in messages.SENSOR_FIELDS]
+    return struct_dtype(names, RECORD_STRUCT.format)
+
+
+def read_log(path):
+    """Memory-map the log at ``path`` as a structured array of records."""
+    dtype = record_dtype()
+    with open(path, 'rb') as f:
+        header = f.read(FILE_HEADER.size)
+        f.seek(0, 2)
+        size = f.tell()
+    if len(header) < FILE_HEADER.size:
+        raise ValueError("{}: not a Nevermore Max binary log".format(path))
+    magic, version, record_size = FILE_HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or record_size != dtype.itemsize:
+        raise ValueError("{}: unsupported binary log".format(path))
+    count = (size - FILE_HEADER.size) // record_size
+    if not count:
+        return np.zeros(0, dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=FILE_HEADER.size,
+                     shape=(count,))
+
+
+def scaled(records):
+    """Dict of SENSOR_FIELDS name -> float array in engineering units, NaN
+    where a reading did not carry the field, plus 'time'."""
+    columns = {'time': np.asarray(records['time'])}
+    for bit, (name, _, scale) in enumerate(messages.SENSOR_FIELDS):
+        values = records[name] / float(scale)
+        values[(records['field_mask'] & (1 << bit)) == 0] = np.nan
+        columns[name] = values
+    return columns
@@ -0,0 +1,85 @@
+# Mapping of the Nevermore Max device clock to Klipper reactor time
+#
+# The firmware answers a TimeSyncRequest with its millisecond clock. The
+# device read its clock somewhere between sending the request and receiving
+# the response, so taking the midpoint of the round trip is off by at most
+# half the round trip time. A least squares line through the recent
+# samples gives the offset and the drift between the two clocks.
+
+DEVICE_MS_WRAP = 1 << 32
+
+# samples used for the fit
+DEFAULT_WINDOW = 16
+# round trips this much longer than the best one are mostly queueing delay
+RTT_SLACK = 0.002
+# a sample further off the fit than this means the device restarted
+RESYNC_THRESHOLD = 1.0
+# shortest device time span over which drift is estimated
+MIN_DRIFT_SPAN = 5.0
+
+
+class ClockSync:
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.samples = []  # (device_s, host_mid, rtt)
+        self.last_device_ms = None
+        self.rate = 1.0  # host seconds per device second
+        self.error = None  # bound of host_time() at the sampled points, seconds
+        self._device_mean = self._host_mean = 0.
+
+    def is_synced(self):
+        return bool(self.samples)
+
+    def drift_ppm(self):
+        return (self.rate - 1.0) * 1e6
+
+    def _unwrap(self, device_ms):
+        # the device clock is a wrapping uint32, take the value closest to
+        # the last sample
+        if self.last_device_ms is None:
+            return device_ms
+        delta = (device_ms - self.last_device_ms) % DEVICE_MS_WRAP
+        if delta >= DEVICE_MS_WRAP // 2:
+            delta -= DEVICE_MS_WRAP
+        return self.last_device_ms + delta
+
+    def add_sample(self, send_time, recv_time, device_ms):
+        """Add a round trip sent at ``send_time`` and answered at
+        ``recv_time`` (reactor time) with the device clock ``device_ms``."""
+        rtt = recv_time - send_time
+        if rtt < 0.:
+            return
+        host_mid = send_time + rtt / 2.
+        if (self.samples and abs(self.host_time(device_ms) - host_mid)
+                > RESYNC_THRESHOLD + rtt):
+            self.reset()
+        device_ms = self._unwrap(device_ms)
+        self.last_device_ms = device_ms
+        self.samples.append((device_ms / 1000., host_mid, rtt))
+        del self.samples[:-self.window]
+        self._fit()
+
+    def _fit(self):
+        best_rtt = min(rtt for _, _, rtt in self.samples)
+        good = [s for s in self.samples if s[2] <= 2. * best_rtt + RTT_SLACK]
+        count = float(len(good))
+        device_mean = sum(s[0] for s in good) / count
+        host_mean = sum(s[1] for s in good) / count
+        var = sum((s[0] - device_mean) ** 2 for s in good)
+        rate = 1.0
+        if good[-1][0] - good[0][0] >= MIN_DRIFT_SPAN and var > 0.:
+            rate = sum((s[0] - device_mean) * (s[1] - host_mean) for s in good) / var
+        self.rate = rate
+        self._device_mean = device_mean
+        self._host_mean = host_mean
+        self.error = max(
+            abs(host_mean + (d - device_mean) * rate - h) + rtt / 2.
+            for d, h, rtt in good)
+
+    def host_time(self, device_ms):
+        """Reactor time of the device clock value ``device_ms``."""
+        device_s = self._unwrap(device_ms) / 1000.
+        return self._host_mean + (device_s - self._device_mean) * self.rate
@@ -0,0 +1,144 @@
+# CSV log of Nevermore Max readings
+#
+# Rows are handed over from the reactor thread through a bounded queue
+# that drops the oldest rows when the writer falls behind, so logging can
+# never hold up Klipper. The writer thread commits rows in groups, flushing
+# after ``batch_rows`` rows or ``flush_interval`` seconds, whichever comes
+# first. The file is appended to across restarts and rotated to
+# ``<name>.1`` ... ``<name>.<backup_count>`` by size or age.
+
+import collections
+import csv
+import logging
+import os
+import threading
+import time
+
+DEFAULT_QUEUE_SIZE = 1024
+DEFAULT_BATCH_ROWS = 64
+DEFAULT_FLUSH_INTERVAL = 5.
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 60 * 60.
+DEFAULT_BACKUP_COUNT = 5
+
+
+class CsvLogger:
+    def __init__(self, path, header, queue_size=DEFAULT_QUEUE_SIZE,
+                 batch_rows=DEFAULT_BATCH_ROWS, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE,
+                 backup_count=DEFAULT_BACKUP_COUNT):
+        self.path = path
+        self.header = header
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backup_count = backup_count
+        self.rows = collections.deque(maxlen=queue_size)
+        self.dropped_rows = 0
+        self.written_rows = 0
+        self.rotations = 0
+        self._lock = threading.Condition()
+        self._stopping = False
+        self._file = None
+        self._writer = None
+        self._opened_at = 0.
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="nevermore-csv")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def log(self, row):
+        """Queue ``row``, dropping the oldest queued row when full."""
+        with self._lock:
+            if len(self.rows) == self.rows.maxlen:
+                self.dropped_rows += 1
+            self.rows.append(row)
+            if len(self.rows) >= self.batch_rows:
+                self._lock.notify()
+
+    def stop(self, timeout=2.):
+        """Write the queued rows and close the file."""
+        if self._thread is None:
+            return
+        with self._lock:
+            self._stopping = True
+            self._lock.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def get_stats(self):
+        return {
+            'queued_rows': len(self.rows),
+            'written_rows': self.written_rows,
+            'dropped_rows': self.dropped_rows,
+            'rotations': self.rotations,
+        }
+
+    def _take_rows(self):
+        with self._lock:
+            if not self._stopping and len(self.rows) < self.batch_rows:
+                self._lock.wait(self.flush_interval)
+            rows = list(self.rows)
+            self.rows.clear()
+            return rows, self._stopping
+
+    def _run(self):
+        try:
+            self._open()
+            stopping = False
+            while not stopping:
+                rows, stopping = self._take_rows()
+                if rows:
+                    self._write_rows(rows)
+                    self._file.flush()
+                    self.written_rows += len(rows)
+                self._maybe_rotate()
+        except (IOError, OSError) as e:
+            logging.exception("NevermoreMaxController: CSV log failed: {}".format(e))
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self):
+        # append, a restart must not lose the previous log
+        self._file = open(self.path, 'a')
+        self._writer = csv.writer(self._file)
+        self._opened_at = time.time()
+        if self._file.tell() == 0:
+            self._writer.writerow(self.header)
+        else:
+            self._opened_at = self._first_row_time(self._opened_at)
+
+    def _write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def _first_row_time(self, default):
+        # the age of a log is the time of its first row
+        try:
+            with open(self.path) as f:
+                f.readline()
+                return float(next(csv.reader([f.readline()]))[0])
+        except (IOError, OSError, ValueError, IndexError, StopIteration):
+            return default
+
+    def _maybe_rotate(self):
+        too_big = self.max_bytes and self._file.tell() >= self.max_bytes
+        too_old = self.max_age and time.time() - self._opened_at >= self.max_age
+        if not (too_big or too_old):
+            return
+        self._file.close()
+        self._file = None
+        if self.backup_count:
+            for idx in range(self.backup_count - 1, 0, -1):
+                src = "{}.{}".format(self.path, idx)
+                if os.path.exists(src):
+                    os.rename(src, "{}.{}".format(self.path, idx + 1))
+            os.rename(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+        self._open()
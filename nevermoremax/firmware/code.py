@@ -7,16 +7,31 @@ import usb_cdc
 
 # from sensors import Sensors
 from sensorssim import SimSensors as Sensors
-from messagepacket import MessageParser, MessagePacket
+from messagepacket import FrameWriter, MessageParser
+from scheduler import Backoff, Scheduler, SKIP
 import messages
 
-VERSION_STRING = "0.0.2"
+VERSION_STRING = "0.0.10"
+
+SAMPLE_PERIOD_MS = 1000  # until the host sends a SampleRateRequest
+LED_PERIOD_MS = 500
+DIAGNOSTICS_PERIOD_MS = 10000
+# USB poll interval while idle, doubling from MIN to MAX. MAX bounds the
+# extra latency of a command that arrives after a quiet period.
+USB_POLL_MIN_MS = 1
+USB_POLL_MAX_MS = 16
+# print every sent reading to the console, allocates a string per reading
+LOG_READINGS = False
 
 t0 = time.monotonic()
 led = digitalio.DigitalInOut(board.LED)
 led.direction = digitalio.Direction.OUTPUT
 
 
+# all frames to the host go through one preallocated buffer
+tx = FrameWriter(usb_cdc.data)
+
+
 def print_ttag(val: str):
     print(f"{time.monotonic() - t0:8.3f}: {val}")
 
@@ -25,65 +40,216 @@ def toggle_led():
     led.value = not led.value
 
 
-def schedule_task(fn, duration_s: float, *args):
-    async def task(fn, duration_s: float, *args):
-        next = time.monotonic()
-        while True:
-            fn(*args[0])
-            next += duration_s
-            now = time.monotonic()
-            sleep_for = next - now
-            # TODO: better handle missed loop timing
-            await asyncio.sleep(sleep_for)
+def handle_version_request(req: messages.VersionRequest):
+    print_ttag(f"Received: {req}")
+    tx.write(messages.VersionResponse(VERSION_STRING))
 
-    return asyncio.create_task(task(fn, duration_s, args))
 
+def handle_state_change_request(req: messages.StateChangeRequest):
+    print_ttag(f"Received: {req}")
+    tx.write(messages.StateChangeResponse(req.state, seq=req.seq))
 
-def received_msg(msg: MessagePacket):
-    uart = usb_cdc.data
 
-    try:
-        if msg.msg_id == messages.VersionRequest.MsgId:
-            _req = messages.VersionRequest.from_message(msg)
-            print_ttag(f"Received: {_req}")
-            uart.write(messages.VersionResponse(VERSION_STRING).serialize())
-        elif msg.msg_id == messages.StateChangeRequest.MsgId:
-            _req = messages.StateChangeRequest.from_message(msg)
-            print_ttag(f"Received: {_req}")
-            uart.write(messages.StateChangeResponse(_req.state).serialize())
-        else:
-            print_ttag(f"ERROR: unhandled message - {msg}")
-    except messages.MessageParseError as e:
-        print_ttag(f"Failed to parse msg - {e}")
+reading_format = messages.READING_FORMAT_V1
+
+
+def handle_reading_format_request(req: messages.ReadingFormatRequest):
+    global reading_format
+    print_ttag(f"Received: {req}")
+    if req.reading_format in messages.READING_FORMATS:
+        reading_format = req.reading_format
+    update_read_periods()
+    tx.write(messages.ReadingFormatResponse(reading_format, seq=req.seq))
+
+
+# fields selected by the host, None sends complete readings
+field_mask = None
+
+
+def handle_field_mask_request(req: messages.FieldMaskRequest):
+    global field_mask
+    print_ttag(f"Received: {req}")
+    field_mask = req.field_mask & messages.FIELDS_ALL
+    update_read_periods()
+    tx.write(messages.FieldMaskResponse(field_mask, seq=req.seq))
+
+
+report_filter = messages.ReportFilter()
+
+
+def handle_report_policy_request(req: messages.ReportPolicyRequest):
+    print_ttag(f"Received: {req}")
+    report_filter.set_policy(req)
+    tx.write(
+        messages.ReportPolicyResponse(req.max_silence_ms, req.deadbands, seq=req.seq)
+    )
+
+
+scheduler = Scheduler()
+sensors = None
+sensor_task = None
+
+
+def oversampling():
+    return field_mask is None and reading_format == messages.READING_FORMAT_STATS
+
+
+def update_read_periods():
+    # stats take every value the sensors deliver between reports, the other
+    # formats need no reads faster than the samples are sent
+    read_period_ms = 0 if oversampling() else sensor_task.period_ms
+    sensors.set_sample_period(read_period_ms, scheduler.clock())
+
+
+def handle_sample_rate_request(req: messages.SampleRateRequest):
+    print_ttag(f"Received: {req}")
+    period_ms = min(
+        max(req.period_ms, messages.MIN_SAMPLE_PERIOD_MS),
+        messages.MAX_SAMPLE_PERIOD_MS,
+    )
+    # a faster rate starts now, not after the old period ran out
+    sensor_task.set_period(period_ms, scheduler.clock())
+    update_read_periods()
+    # batching keeps the frame rate low when the sample period is short
+    batcher.size = messages.batch_size(period_ms)
+    tx.write(messages.SampleRateResponse(period_ms, seq=req.seq))
+
+
+timestamps = False
+
+
+def handle_time_sync_request(req: messages.TimeSyncRequest):
+    global timestamps
+    # hosts that sync the clock also parse the reading timestamps, older
+    # hosts would take the trailer for a bad frame
+    timestamps = True
+    tx.write(messages.TimeSyncResponse(req.seq, time.monotonic_ns() // 1000000))
+
+
+dispatcher = messages.Dispatcher()
+dispatcher.register(messages.VersionRequest, handle_version_request)
+dispatcher.register(messages.StateChangeRequest, handle_state_change_request)
+dispatcher.register(messages.ReadingFormatRequest, handle_reading_format_request)
+dispatcher.register(messages.FieldMaskRequest, handle_field_mask_request)
+dispatcher.register(messages.ReportPolicyRequest, handle_report_policy_request)
+dispatcher.register(messages.SampleRateRequest, handle_sample_rate_request)
+dispatcher.register(messages.TimeSyncRequest, handle_time_sync_request)
+
+
+usb_loop_wakeups = 0
 
 
 async def usb_read_loop():
+    """Parse and dispatch host requests.
+
+    The parser only runs when bytes arrived and then drains every complete
+    frame. A request waits at most USB_POLL_MAX_MS plus the longest single
+    scheduler task (the scheduler runs one task per pass) before dispatch.
+    """
+    global usb_loop_wakeups
     uart = usb_cdc.data
-    parser = MessageParser()
+    # fixed receive buffer, read into directly
+    parser = MessageParser(frame_lengths=messages.FRAME_LENGTHS)
+    backoff = Backoff(USB_POLL_MIN_MS, USB_POLL_MAX_MS)
     while True:
-        if uart.in_waiting > 0:
-            parser.append(uart.read(uart.in_waiting))
-        msg, _ = parser.parse()
-        if msg:
-            received_msg(msg)
-        await asyncio.sleep(0)
+        usb_loop_wakeups += 1
+        waiting = uart.in_waiting
+        if waiting:
+            # more can be waiting than the parser has room for
+            while waiting:
+                parser.readinto(uart, waiting)
+                for msg in parser.parse_all():
+                    dispatcher.dispatch(msg)
+                waiting = uart.in_waiting
+            # a request often comes with more right behind it
+            backoff.reset()
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(backoff.next() / 1000)
 
 
-def collect_sensor_data(sensors: Sensors):
-    uart = usb_cdc.data
+# one reading per frame until the host sets a short sample period
+batcher = messages.ReadingBatcher(1, messages.BATCH_INTERVAL_MS)
+aggregator = messages.ReadingAggregator()
+
+
+def sensor_read(fields: int):
+    # in READING_FORMAT_STATS every fresh value is aggregated until the
+    # next report, values only repeated from the cache are not
+    if oversampling():
+        aggregator.add(messages.SensorReading(*sensors.sample().data()), fields)
 
+
+def collect_sensor_data(sensors: Sensors):
     sensor_data = sensors.sample()
 
-    msg = messages.SensorReading(*sensor_data.data())
-    uart.write(msg.serialize())
-    print_ttag(f"Sending: {msg}")
+    if field_mask is not None:
+        msg = messages.SensorReadingMasked(field_mask, *sensor_data.data())
+    elif reading_format == messages.READING_FORMAT_STATS:
+        msg = aggregator.peek()
+        if msg is None:
+            # nothing was read since the last report
+            return
+    else:
+        msg = messages.READING_FORMATS[reading_format](*sensor_data.data())
+    now_ms = time.monotonic_ns() // 1000000
+    if timestamps:
+        msg.timestamp_ms = now_ms
+    reported = report_filter.should_report(msg, now_ms)
+    if reported and isinstance(msg, messages.SensorReadingStats):
+        # the stats only restart once they are sent, the values of a
+        # dropped report go into the next one
+        aggregator.clear()
+    if not reported:
+        # a pending batch still goes out within its latency
+        msg = batcher.poll(now_ms)
+    elif (
+        batcher.size > 1
+        and field_mask is None
+        and reading_format != messages.READING_FORMAT_STATS
+    ):
+        # batches carry complete readings, never masked ones or stats
+        msg = batcher.add(msg, now_ms)
+    elif len(batcher):
+        # batching just stopped, the readings before this one go first
+        tx.write(batcher.flush())
+    if msg is None:
+        return
+    tx.write(msg)
+    if LOG_READINGS:
+        print_ttag(f"Sending: {msg}")
+
+
+def send_diagnostics():
+    global usb_loop_wakeups
+    print_ttag(f"usb read loop: {usb_loop_wakeups} wakeups")
+    usb_loop_wakeups = 0
+    tx.write(
+        messages.SchedulerDiagnostics(
+            [messages.TaskStats(*task.take_stats()) for task in scheduler.tasks]
+        )
+    )
+
+
+async def scheduler_loop():
+    # one task per pass, so other coroutines run between tasks
+    while True:
+        await asyncio.sleep(scheduler.run_pending(1) / 1000)
 
 
 async def main():
+    global sensors, sensor_task
     sensors = Sensors()
+    # added in the order of messages.SCHEDULER_TASK_NAMES
+    sensor_task = scheduler.add(
+        collect_sensor_data, SAMPLE_PERIOD_MS, sensors, priority=2, policy=SKIP
+    )
+    scheduler.add(toggle_led, LED_PERIOD_MS, priority=0, policy=SKIP)
+    scheduler.add(send_diagnostics, DIAGNOSTICS_PERIOD_MS, priority=1, policy=SKIP)
+    # per sensor reads filling the cache that collect_sensor_data snapshots
+    sensors.schedule(scheduler, SAMPLE_PERIOD_MS, sensor_read)
     await asyncio.gather(
-        schedule_task(collect_sensor_data, 1.0, sensors),
-        schedule_task(toggle_led, 0.5),
+        scheduler_loop(),
         usb_read_loop(),
     )
 
@@ -1,9 +1,32 @@
 import struct
+from collections import namedtuple
 
 try:
-    from messagepacket import MessagePacket
+    from struct import Struct
 except ImportError:
-    from .messagepacket import MessagePacket
+    # CircuitPython's struct module has no Struct class
+    class Struct:
+        def __init__(self, format):
+            self.format = format
+            self.size = struct.calcsize(format)
+
+        def pack(self, *values):
+            return struct.pack(self.format, *values)
+
+        def pack_into(self, buffer, offset, *values):
+            struct.pack_into(self.format, buffer, offset, *values)
+
+        def unpack(self, buffer):
+            return struct.unpack(self.format, buffer)
+
+        def unpack_from(self, buffer, offset=0):
+            return struct.unpack_from(self.format, buffer, offset)
+
+
+try:
+    from messagepacket import HEADER_LEN, META_LEN, MAX_MSG_LEN, seal_frame
+except ImportError:
+    from .messagepacket import HEADER_LEN, META_LEN, MAX_MSG_LEN, seal_frame
 
 
 class MessageParseError(Exception):
@@ -18,7 +41,113 @@ class PayloadLengthError(MessageParseError):
     pass
 
 
-class VersionRequest:
+# what a decode() of a malformed payload can raise: a bad version string
+# raises UnicodeDecodeError, a ValueError. CircuitPython's struct module
+# raises ValueError and has no struct.error.
+DECODE_ERRORS = (MessageParseError, ValueError, getattr(struct, "error", ValueError))
+
+
+_UINT8_STRUCT = Struct("<B")
+_UINT16_STRUCT = Struct("<H")
+_UINT32_STRUCT = Struct("<I")
+
+# msg_id -> message class
+MESSAGE_TYPES = {}
+
+
+def message_type(cls):
+    """Class decorator adding a message class to MESSAGE_TYPES."""
+    if cls.MsgId in MESSAGE_TYPES:
+        raise ValueError("duplicate msg_id 0x{:02X}".format(cls.MsgId))
+    MESSAGE_TYPES[cls.MsgId] = cls
+    return cls
+
+
+class Dispatcher:
+    """Routes parsed packets to per-type handlers with one dict lookup.
+
+    Handlers are called as ``handler(decoded_msg, *args)``. Packets with no
+    registered handler and packets that fail to decode are counted instead
+    of raising, decoded packets are counted per msg_id in ``counts``.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self.counts = {}
+        self.unknown_count = 0
+        self.decode_error_count = 0
+
+    def register(self, msg_cls, handler):
+        self._handlers[msg_cls.MsgId] = (msg_cls.decode, handler)
+
+    def dispatch(self, msg, *args):
+        entry = self._handlers.get(msg.msg_id)
+        if entry is None:
+            self.unknown_count += 1
+            return None
+        decode, handler = entry
+        try:
+            decoded = decode(msg.payload)
+        except DECODE_ERRORS:
+            self.decode_error_count += 1
+            return None
+        self.counts[msg.msg_id] = self.counts.get(msg.msg_id, 0) + 1
+        handler(decoded, *args)
+        return decoded
+
+
+class Message(object):
+    """Base for all messages.
+
+    Subclasses implement ``serialize_into(buffer, offset)``, which writes the
+    complete frame into ``buffer`` and returns its length.
+    """
+
+    __slots__ = ()
+
+    def frame_length(self):
+        return self.PayloadLength + META_LEN
+
+    def serialize(self):
+        out = bytearray(self.frame_length())
+        self.serialize_into(out, 0)
+        return out
+
+
+# first firmware version that echoes the sequence number of a request
+SEQUENCE_MIN_VERSION = (0, 0, 10)
+
+
+class SequencedMessage(Message):
+    """Request or response that may carry a uint8 sequence number ``seq``
+    after its payload. Firmware SEQUENCE_MIN_VERSION+ echoes the ``seq`` of
+    a request in its response; ``seq`` is None when it was not sent."""
+
+    __slots__ = ("seq",)
+
+    def frame_length(self):
+        return self.PayloadLength + (0 if self.seq is None else 1) + META_LEN
+
+
+def _payload_seq(payload, length):
+    if len(payload) == length:
+        return None
+    if len(payload) == length + 1:
+        return _UINT8_STRUCT.unpack_from(payload, length)[0]
+    raise PayloadLengthError()
+
+
+def _seal_sequenced(msg, buffer, offset, payload_len):
+    if msg.seq is not None:
+        buffer[offset + HEADER_LEN + payload_len] = msg.seq & 0xFF
+        payload_len += 1
+    return seal_frame(buffer, offset, msg.MsgId, payload_len)
+
+
+@message_type
+class VersionRequest(Message):
+    __slots__ = ()
+
     MsgId = 0x00
     PayloadLength = 0
 
@@ -29,17 +158,25 @@ class VersionRequest:
     def from_message(msg):
         if msg.msg_id != VersionRequest.MsgId:
             raise MessageIdError()
-        if len(msg.payload) != VersionRequest.PayloadLength:
+        return VersionRequest.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        if len(payload) != VersionRequest.PayloadLength:
             raise PayloadLengthError()
         return VersionRequest()
 
-    def serialize(self):
-        return MessagePacket(self.MsgId, b"").serialize()
+    def serialize_into(self, buffer, offset=0):
+        return seal_frame(buffer, offset, self.MsgId, 0)
+
 
+@message_type
+class VersionResponse(Message):
+    __slots__ = ("version",)
 
-class VersionResponse:
     MsgId = 0x80
     MaxPayloadLength = 60
+    MaxFrameLength = MaxPayloadLength + META_LEN
 
     def __init__(self, version):
         if len(version) > self.MaxPayloadLength:
@@ -53,20 +190,34 @@ class VersionResponse:
     def from_message(msg):
         if msg.msg_id != VersionResponse.MsgId:
             raise MessageIdError()
-        if len(msg.payload) > VersionResponse.MaxPayloadLength:
+        return VersionResponse.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        if len(payload) > VersionResponse.MaxPayloadLength:
             raise PayloadLengthError()
-        return VersionResponse(msg.payload.decode())
+        return VersionResponse(bytearray(payload).decode())
 
-    def serialize(self):
-        return MessagePacket(self.MsgId, str.encode(self.version)).serialize()
+    def frame_length(self):
+        return len(self.version) + META_LEN
 
+    def serialize_into(self, buffer, offset=0):
+        payload = str.encode(self.version)
+        start = offset + HEADER_LEN
+        buffer[start : start + len(payload)] = payload
+        return seal_frame(buffer, offset, self.MsgId, len(payload))
+
+
+@message_type
+class StateChangeRequest(SequencedMessage):
+    __slots__ = ("state",)
 
-class StateChangeRequest:
     MsgId = 0x01
-    PayloadLength = 1
+    PayloadLength = _UINT8_STRUCT.size
 
-    def __init__(self, state):
+    def __init__(self, state, seq=None):
         self.state = state
+        self.seq = seq
 
     def __repr__(self):
         return "StateChangeRequest(state=0x{:02X})".format(self.state)
@@ -75,21 +226,28 @@ class StateChangeRequest:
     def from_message(msg):
         if msg.msg_id != StateChangeRequest.MsgId:
             raise MessageIdError()
-        if len(msg.payload) != StateChangeRequest.PayloadLength:
-            raise PayloadLengthError()
-        data = struct.unpack("B", msg.payload)
-        return StateChangeRequest(data[0])
+        return StateChangeRequest.decode(msg.payload)
 
-    def serialize(self):
-        return MessagePacket(self.MsgId, struct.pack("<B", self.state)).serialize()
+    @staticmethod
+    def decode(payload):
+        seq = _payload_seq(payload, StateChangeRequest.PayloadLength)
+        return StateChangeRequest(_UINT8_STRUCT.unpack_from(payload)[0], seq=seq)
+
+    def serialize_into(self, buffer, offset=0):
+        _UINT8_STRUCT.pack_into(buffer, offset + HEADER_LEN, self.state)
+        return _seal_sequenced(self, buffer, offset, self.PayloadLength)
 
 
-class StateChangeResponse:
+@message_type
+class StateChangeResponse(SequencedMessage):
+    __slots__ = ("state",)
+
     MsgId = 0x81
-    PayloadLength = 1
+    PayloadLength = _UINT8_STRUCT.size
 
-    def __init__(self, state):
+    def __init__(self, state, seq=None):
         self.state = state
+        self.seq = seq
 
     def __repr__(self):
         return "StateChangeResponse(state=0x{:02X})".format(self.state)
@@ -98,20 +256,131 @@ class StateChangeResponse:
     def from_message(msg):
         if msg.msg_id != StateChangeResponse.MsgId:
             raise MessageIdError()
-        if len(msg.payload) != StateChangeResponse.PayloadLength:
-            raise PayloadLengthError()
-        data = struct.unpack("B", msg.payload)
-        return StateChangeResponse(data[0])
+        return StateChangeResponse.decode(msg.payload)
 
-    def serialize(self):
-        return MessagePacket(self.MsgId, struct.pack("<B", self.state)).serialize()
+    @staticmethod
+    def decode(payload):
+        seq = _payload_seq(payload, StateChangeResponse.PayloadLength)
+        return StateChangeResponse(_UINT8_STRUCT.unpack_from(payload)[0], seq=seq)
+
+    def serialize_into(self, buffer, offset=0):
+        _UINT8_STRUCT.pack_into(buffer, offset + HEADER_LEN, self.state)
+        return _seal_sequenced(self, buffer, offset, self.PayloadLength)
+
+
+READING_FORMAT_V1 = 1  # SensorReading
+READING_FORMAT_V2 = 2  # SensorReadingV2
+READING_FORMAT_STATS = 3  # SensorReadingStats
+
+# first firmware version that understands ReadingFormatRequest
+READING_FORMAT_MIN_VERSION = (0, 0, 3)
+# first firmware version that sends SensorReadingStats
+READING_FORMAT_STATS_MIN_VERSION = (0, 0, 8)
+
+
+def version_tuple(version):
+    """'0.0.3-sim' -> (0, 0, 3); unparsable parts become 0."""
+    numbers = []
+    for part in version.split("-")[0].split("."):
+        try:
+            numbers.append(int(part))
+        except ValueError:
+            numbers.append(0)
+    return tuple(numbers)
+
+
+@message_type
+class ReadingFormatRequest(SequencedMessage):
+    __slots__ = ("reading_format",)
+
+    MsgId = 0x02
+    PayloadLength = _UINT8_STRUCT.size
+
+    def __init__(self, reading_format, seq=None):
+        self.reading_format = reading_format
+        self.seq = seq
+
+    def __repr__(self):
+        return "ReadingFormatRequest(reading_format={})".format(self.reading_format)
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != ReadingFormatRequest.MsgId:
+            raise MessageIdError()
+        return ReadingFormatRequest.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        seq = _payload_seq(payload, ReadingFormatRequest.PayloadLength)
+        return ReadingFormatRequest(_UINT8_STRUCT.unpack_from(payload)[0], seq=seq)
+
+    def serialize_into(self, buffer, offset=0):
+        _UINT8_STRUCT.pack_into(buffer, offset + HEADER_LEN, self.reading_format)
+        return _seal_sequenced(self, buffer, offset, self.PayloadLength)
+
+
+@message_type
+class ReadingFormatResponse(SequencedMessage):
+    __slots__ = ("reading_format",)
+
+    MsgId = 0x84
+    PayloadLength = _UINT8_STRUCT.size
 
+    def __init__(self, reading_format, seq=None):
+        self.reading_format = reading_format
+        self.seq = seq
+
+    def __repr__(self):
+        return "ReadingFormatResponse(reading_format={})".format(self.reading_format)
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != ReadingFormatResponse.MsgId:
+            raise MessageIdError()
+        return ReadingFormatResponse.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        seq = _payload_seq(payload, ReadingFormatResponse.PayloadLength)
+        return ReadingFormatResponse(_UINT8_STRUCT.unpack_from(payload)[0], seq=seq)
+
+    def serialize_into(self, buffer, offset=0):
+        _UINT8_STRUCT.pack_into(buffer, offset + HEADER_LEN, self.reading_format)
+        return _seal_sequenced(self, buffer, offset, self.PayloadLength)
+
+
+_SENSOR_READING_STRUCT = Struct("<HHHHfffffHHHHfffff")
+
+
+@message_type
+class SensorReading(Message):
+    __slots__ = (
+        "in_dht_temp_C",
+        "in_dht_humidity_rh",
+        "in_sgp_eCO2",
+        "in_sgp_TVOC",
+        "in_bme_temp_C",
+        "in_bme_gas",
+        "in_bme_humidity_rh",
+        "in_bme_pressure_hPa",
+        "in_bme_altitude_m",
+        "out_dht_temp_C",
+        "out_dht_humidity_rh",
+        "out_sgp_eCO2",
+        "out_sgp_TVOC",
+        "out_bme_temp_C",
+        "out_bme_gas",
+        "out_bme_humidity_rh",
+        "out_bme_pressure_hPa",
+        "out_bme_altitude_m",
+        "timestamp_ms",
+    )
 
-class SensorReading:
     MsgId = 0x82
 
-    StructFormat = "<HHHHfffffHHHHfffff"  # should match payload length
-    PayloadLength = struct.calcsize(StructFormat)
+    StructFormat = _SENSOR_READING_STRUCT.format  # should match payload length
+    PayloadLength = _SENSOR_READING_STRUCT.size
+    ValueCount = 18  # constructor arguments
 
     def __init__(
         self,
@@ -152,6 +421,8 @@ class SensorReading:
         self.out_bme_humidity_rh = out_bme_humidity_rh
         self.out_bme_pressure_hPa = out_bme_pressure_hPa
         self.out_bme_altitude_m = out_bme_altitude_m
+        # device time of the sample, sent by firmware TIME_SYNC_MIN_VERSION+
+        self.timestamp_ms = None
 
     def __repr__(self):
         return "SensorReading(in{{tempC={:.1f}, RH={:.1f}, hPa={:.1f}, eCO2={:.1f}, TVOC={:.1f}}}, out{{tempC={:.1f}, RH={:.1f}, hPa={:.1f}, eCO2={:.1f}, TVOC={:.1f}}}".format(
@@ -171,33 +442,1137 @@ class SensorReading:
     def from_message(msg):
         if msg.msg_id != SensorReading.MsgId:
             raise MessageIdError()
-        if len(msg.payload) != SensorReading.PayloadLength:
+        return SensorReading.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        timestamp_ms = _reading_timestamp(payload, SensorReading.PayloadLength)
+        reading = SensorReading(*_SENSOR_READING_STRUCT.unpack_from(payload))
+        reading.timestamp_ms = timestamp_ms
+        return reading
+
+    def frame_length(self):
+        return self.PayloadLength + _timestamp_length(self) + META_LEN
+
+    def serialize_into(self, buffer, offset=0):
+        _SENSOR_READING_STRUCT.pack_into(
+            buffer,
+            offset + HEADER_LEN,
+            int(self.in_dht_temp_C),
+            int(self.in_dht_humidity_rh),
+            int(self.in_sgp_eCO2),
+            int(self.in_sgp_TVOC),
+            self.in_bme_temp_C,
+            self.in_bme_gas,
+            self.in_bme_humidity_rh,
+            self.in_bme_pressure_hPa,
+            self.in_bme_altitude_m,
+            int(self.out_dht_temp_C),
+            int(self.out_dht_humidity_rh),
+            int(self.out_sgp_eCO2),
+            int(self.out_sgp_TVOC),
+            self.out_bme_temp_C,
+            self.out_bme_gas,
+            self.out_bme_humidity_rh,
+            self.out_bme_pressure_hPa,
+            self.out_bme_altitude_m,
+        )
+        return _seal_reading(self, buffer, offset, self.PayloadLength)
+
+
+def _reading_timestamp(payload, length):
+    # readings of firmware TIME_SYNC_MIN_VERSION+ end in the uint32 device
+    # time of the sample
+    if len(payload) == length:
+        return None
+    if len(payload) == length + _UINT32_STRUCT.size:
+        return _UINT32_STRUCT.unpack_from(payload, length)[0]
+    raise PayloadLengthError()
+
+
+def _timestamp_length(reading):
+    return 0 if reading.timestamp_ms is None else _UINT32_STRUCT.size
+
+
+def _seal_reading(reading, buffer, offset, payload_len):
+    if reading.timestamp_ms is not None:
+        _UINT32_STRUCT.pack_into(
+            buffer,
+            offset + HEADER_LEN + payload_len,
+            reading.timestamp_ms & 0xFFFFFFFF,
+        )
+        payload_len += _UINT32_STRUCT.size
+    return seal_frame(buffer, offset, reading.MsgId, payload_len)
+
+
+def _to_fixed(value, scale, lo, hi):
+    value = int(round(value * scale))
+    if value < lo:
+        return lo
+    if value > hi:
+        return hi
+    return value
+
+
+def altitude_m(pressure_hPa, sea_level_hPa=1013.25):
+    # same formula as adafruit_bme680
+    return 44330.0 * (1.0 - (pressure_hPa / sea_level_hPa) ** 0.1903)
+
+
+# One sensor group in fixed point, sized to the sensors' resolution:
+#   dht temp 0.1 C, dht humidity 0.1 %, sgp eCO2 ppm, sgp TVOC ppb,
+#   bme temp 0.01 C, bme gas ohm, bme humidity 0.01 %, bme pressure 0.02 hPa.
+# Altitude is not sent, it is derived from pressure.
+# (SensorReading attribute without in_/out_ prefix, struct code, scale)
+_GROUP_FIELDS = (
+    ("dht_temp_C", "h", 10),
+    ("dht_humidity_rh", "h", 10),
+    ("sgp_eCO2", "H", 1),
+    ("sgp_TVOC", "H", 1),
+    ("bme_temp_C", "h", 100),
+    ("bme_gas", "I", 1),
+    ("bme_humidity_rh", "h", 100),
+    ("bme_pressure_hPa", "H", 50),
+)
+_SENSOR_GROUP_FORMAT = "".join(code for _, code, _ in _GROUP_FIELDS)
+_FIXED_LIMITS = {
+    "h": (-32768, 32767),
+    "H": (0, 65535),
+    "I": (0, 4294967295),
+}
+_SENSOR_SAMPLE_FORMAT = "H" + 2 * _SENSOR_GROUP_FORMAT  # time offset + in + out
+
+
+def _encode_group(
+    dht_temp_C,
+    dht_humidity_rh,
+    sgp_eCO2,
+    sgp_TVOC,
+    bme_temp_C,
+    bme_gas,
+    bme_humidity_rh,
+    bme_pressure_hPa,
+):
+    return (
+        _to_fixed(dht_temp_C, 10, -32768, 32767),
+        _to_fixed(dht_humidity_rh, 10, -32768, 32767),
+        _to_fixed(sgp_eCO2, 1, 0, 65535),
+        _to_fixed(sgp_TVOC, 1, 0, 65535),
+        _to_fixed(bme_temp_C, 100, -32768, 32767),
+        _to_fixed(bme_gas, 1, 0, 4294967295),
+        _to_fixed(bme_humidity_rh, 100, -32768, 32767),
+        _to_fixed(bme_pressure_hPa, 50, 0, 65535),
+    )
+
+
+def _decode_group(values, idx):
+    bme_pressure_hPa = values[idx + 7] / 50.0
+    return (
+        values[idx] / 10.0,
+        values[idx + 1] / 10.0,
+        values[idx + 2],
+        values[idx + 3],
+        values[idx + 4] / 100.0,
+        values[idx + 5],
+        values[idx + 6] / 100.0,
+        bme_pressure_hPa,
+        altitude_m(bme_pressure_hPa),
+    )
+
+
+def _encode_reading(r):
+    return _encode_group(
+        r.in_dht_temp_C,
+        r.in_dht_humidity_rh,
+        r.in_sgp_eCO2,
+        r.in_sgp_TVOC,
+        r.in_bme_temp_C,
+        r.in_bme_gas,
+        r.in_bme_humidity_rh,
+        r.in_bme_pressure_hPa,
+    ) + _encode_group(
+        r.out_dht_temp_C,
+        r.out_dht_humidity_rh,
+        r.out_sgp_eCO2,
+        r.out_sgp_TVOC,
+        r.out_bme_temp_C,
+        r.out_bme_gas,
+        r.out_bme_humidity_rh,
+        r.out_bme_pressure_hPa,
+    )
+
+
+_SENSOR_READING_V2_STRUCT = Struct("<" + 2 * _SENSOR_GROUP_FORMAT)
+
+
+@message_type
+class SensorReadingV2(SensorReading):
+    """SensorReading in the fixed point layout of ``_SENSOR_GROUP_FORMAT``.
+
+    Sent instead of SensorReading once the host selects READING_FORMAT_V2
+    with a ReadingFormatRequest.
+    """
+
+    __slots__ = ()
+
+    MsgId = 0x85
+    PayloadLength = _SENSOR_READING_V2_STRUCT.size
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != SensorReadingV2.MsgId:
+            raise MessageIdError()
+        return SensorReadingV2.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        timestamp_ms = _reading_timestamp(payload, SensorReadingV2.PayloadLength)
+        values = _SENSOR_READING_V2_STRUCT.unpack_from(payload)
+        reading = SensorReadingV2(
+            *(
+                _decode_group(values, 0)
+                + _decode_group(values, len(_SENSOR_GROUP_FORMAT))
+            )
+        )
+        reading.timestamp_ms = timestamp_ms
+        return reading
+
+    def serialize_into(self, buffer, offset=0):
+        _SENSOR_READING_V2_STRUCT.pack_into(
+            buffer, offset + HEADER_LEN, *_encode_reading(self)
+        )
+        return _seal_reading(self, buffer, offset, self.PayloadLength)
+
+
+# count + mean, min and max of every group field
+_SENSOR_READING_STATS_STRUCT = Struct("<H" + 6 * _SENSOR_GROUP_FORMAT)
+
+
+@message_type
+class SensorReadingStats(SensorReading):
+    """Mean, min and max of the samples taken since the previous report.
+
+    The reading attributes hold the means, ``minimum`` and ``maximum`` are
+    SensorReadings and ``count`` is the number of samples. Values are sent
+    in the fixed point layout of ``_SENSOR_GROUP_FORMAT``.
+    """
+
+    __slots__ = ("count", "minimum", "maximum")
+
+    MsgId = 0x8B
+    PayloadLength = _SENSOR_READING_STATS_STRUCT.size
+
+    def __init__(self, count, minimum, maximum, *means):
+        SensorReading.__init__(self, *means)
+        self.count = count
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def __repr__(self):
+        return "SensorReadingStats(count={}, mean={})".format(
+            self.count, SensorReading.__repr__(self)
+        )
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != SensorReadingStats.MsgId:
+            raise MessageIdError()
+        return SensorReadingStats.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        timestamp_ms = _reading_timestamp(payload, SensorReadingStats.PayloadLength)
+        values = _SENSOR_READING_STATS_STRUCT.unpack_from(payload)
+        group_len = len(_SENSOR_GROUP_FORMAT)
+        readings = [
+            _decode_group(values, idx) + _decode_group(values, idx + group_len)
+            for idx in range(1, 1 + 6 * group_len, 2 * group_len)
+        ]
+        stats = SensorReadingStats(
+            values[0],
+            SensorReading(*readings[1]),
+            SensorReading(*readings[2]),
+            *readings[0]
+        )
+        stats.timestamp_ms = timestamp_ms
+        return stats
+
+    def serialize_into(self, buffer, offset=0):
+        _SENSOR_READING_STATS_STRUCT.pack_into(
+            buffer,
+            offset + HEADER_LEN,
+            min(self.count, 65535),
+            *(
+                _encode_reading(self)
+                + _encode_reading(self.minimum)
+                + _encode_reading(self.maximum)
+            )
+        )
+        return _seal_reading(self, buffer, offset, self.PayloadLength)
+
+
+class ReadingAggregator:
+    """Accumulates SensorReadings into a SensorReadingStats.
+
+    Sums, minima and maxima are kept in fixed point, the same resolution
+    the stats are sent with. Each field has its own sample count, so a
+    reading can add only the fields that were freshly read. A field that
+    got no value since the last report repeats its last value.
+
+    peek() builds the stats and clear() starts the next window, so values
+    of a report that is not sent end up in the next one.
+    """
+
+    def __init__(self):
+        field_count = 2 * len(_GROUP_FIELDS)
+        self._count = [0] * field_count
+        self._sum = [0] * field_count
+        self._min = [0] * field_count
+        self._max = [0] * field_count
+        self._last = [0] * field_count
+
+    def add(self, reading, fields=None):
+        """Add the ``fields`` (field mask, None for all) of ``reading``."""
+        for idx, value in enumerate(_encode_reading(reading)):
+            if fields is not None and not fields & (1 << idx):
+                continue
+            self._last[idx] = value
+            if not self._count[idx]:
+                self._sum[idx] = self._min[idx] = self._max[idx] = value
+            else:
+                self._sum[idx] += value
+                if value < self._min[idx]:
+                    self._min[idx] = value
+                elif value > self._max[idx]:
+                    self._max[idx] = value
+            self._count[idx] += 1
+
+    def peek(self):
+        """Stats of the readings added since the last clear(), None if there
+        were none. The count is that of the least often added field among
+        the fields that were added at all."""
+        if not any(self._count):
+            return None
+        count = min(c for c in self._count if c)
+        mean = []
+        for idx, field_count in enumerate(self._count):
+            if field_count:
+                mean.append(self._sum[idx] / float(field_count))
+            else:
+                self._min[idx] = self._max[idx] = self._last[idx]
+                mean.append(self._last[idx])
+        group_len = len(_GROUP_FIELDS)
+        return SensorReadingStats(
+            count,
+            SensorReading(
+                *(_decode_group(self._min, 0) + _decode_group(self._min, group_len))
+            ),
+            SensorReading(
+                *(_decode_group(self._max, 0) + _decode_group(self._max, group_len))
+            ),
+            *(_decode_group(mean, 0) + _decode_group(mean, group_len))
+        )
+
+    def clear(self):
+        self._count = [0] * len(self._count)
+
+    def take(self):
+        """peek() and clear() in one."""
+        stats = self.peek()
+        self.clear()
+        return stats
+
+
+READING_FORMATS = {
+    READING_FORMAT_V1: SensorReading,
+    READING_FORMAT_V2: SensorReadingV2,
+    READING_FORMAT_STATS: SensorReadingStats,
+}
+
+
+@message_type
+class SensorReadingBatch(Message):
+    """Several SensorReadings in one frame.
+
+    Sample ``i`` was taken ``offsets_ms[i]`` milliseconds after the device
+    time ``timestamp_ms``. Values are sent in fixed point (see
+    ``_SENSOR_GROUP_FORMAT``), so decoded readings are rounded to the
+    resolution of each sensor.
+    """
+
+    __slots__ = ("timestamp_ms", "offsets_ms", "readings")
+
+    MsgId = 0x83
+
+    HeaderStruct = Struct("<IB")  # timestamp_ms, sample count
+    SampleLength = struct.calcsize("<" + _SENSOR_SAMPLE_FORMAT)
+    MaxSamples = (MAX_MSG_LEN - META_LEN - HeaderStruct.size) // SampleLength
+    MaxFrameLength = HeaderStruct.size + MaxSamples * SampleLength + META_LEN
+
+    _sample_structs = {}
+
+    def __init__(self, timestamp_ms, offsets_ms, readings):
+        if len(readings) > self.MaxSamples or len(readings) != len(offsets_ms):
+            raise MessageParseError()
+        self.timestamp_ms = timestamp_ms
+        self.offsets_ms = offsets_ms
+        self.readings = readings
+
+    def __repr__(self):
+        return "SensorReadingBatch(timestamp_ms={}, samples={})".format(
+            self.timestamp_ms, len(self.readings)
+        )
+
+    @staticmethod
+    def _samples_struct(count):
+        samples_struct = SensorReadingBatch._sample_structs.get(count)
+        if samples_struct is None:
+            samples_struct = Struct("<" + count * _SENSOR_SAMPLE_FORMAT)
+            SensorReadingBatch._sample_structs[count] = samples_struct
+        return samples_struct
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != SensorReadingBatch.MsgId:
+            raise MessageIdError()
+        return SensorReadingBatch.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        header = SensorReadingBatch.HeaderStruct
+        if len(payload) < header.size:
+            raise PayloadLengthError()
+        timestamp_ms, count = header.unpack_from(payload)
+        if (
+            count > SensorReadingBatch.MaxSamples
+            or len(payload) != header.size + count * SensorReadingBatch.SampleLength
+        ):
             raise PayloadLengthError()
-        data = struct.unpack(SensorReading.StructFormat, msg.payload)
-        return SensorReading(*data)
 
-    def serialize(self):
-        return MessagePacket(
+        values = SensorReadingBatch._samples_struct(count).unpack_from(
+            payload, header.size
+        )
+        step = len(_SENSOR_SAMPLE_FORMAT)
+        group_len = len(_SENSOR_GROUP_FORMAT)
+        offsets_ms = []
+        readings = []
+        for idx in range(0, count * step, step):
+            offsets_ms.append(values[idx])
+            reading = SensorReading(
+                *(
+                    _decode_group(values, idx + 1)
+                    + _decode_group(values, idx + 1 + group_len)
+                )
+            )
+            reading.timestamp_ms = (timestamp_ms + values[idx]) & 0xFFFFFFFF
+            readings.append(reading)
+        return SensorReadingBatch(timestamp_ms, offsets_ms, readings)
+
+    def frame_length(self):
+        return (
+            self.HeaderStruct.size + len(self.readings) * self.SampleLength + META_LEN
+        )
+
+    def serialize_into(self, buffer, offset=0):
+        start = offset + HEADER_LEN
+        count = len(self.readings)
+        self.HeaderStruct.pack_into(buffer, start, self.timestamp_ms, count)
+        values = []
+        for offset_ms, r in zip(self.offsets_ms, self.readings):
+            values.append(offset_ms)
+            values.extend(_encode_reading(r))
+        self._samples_struct(count).pack_into(
+            buffer, start + self.HeaderStruct.size, *values
+        )
+        return seal_frame(
+            buffer,
+            offset,
             self.MsgId,
-            struct.pack(
-                self.StructFormat,
-                int(self.in_dht_temp_C),
-                int(self.in_dht_humidity_rh),
-                int(self.in_sgp_eCO2),
-                int(self.in_sgp_TVOC),
-                self.in_bme_temp_C,
-                self.in_bme_gas,
-                self.in_bme_humidity_rh,
-                self.in_bme_pressure_hPa,
-                self.in_bme_altitude_m,
-                int(self.out_dht_temp_C),
-                int(self.out_dht_humidity_rh),
-                int(self.out_sgp_eCO2),
-                int(self.out_sgp_TVOC),
-                self.out_bme_temp_C,
-                self.out_bme_gas,
-                self.out_bme_humidity_rh,
-                self.out_bme_pressure_hPa,
-                self.out_bme_altitude_m,
+            self.HeaderStruct.size + count * self.SampleLength,
+        )
+
+
+# batch offsets are uint16 milliseconds
+MAX_BATCH_SPAN_MS = 0xFFFF
+# longest a reading waits in an unfinished batch
+DEFAULT_BATCH_LATENCY_MS = 1000
+
+
+class ReadingBatcher:
+    """Collects SensorReadings until a SensorReadingBatch is complete: it
+    has ``size`` readings or its first reading waited ``max_latency_ms``."""
+
+    def __init__(
+        self,
+        size=SensorReadingBatch.MaxSamples,
+        max_latency_ms=DEFAULT_BATCH_LATENCY_MS,
+    ):
+        self.size = min(size, SensorReadingBatch.MaxSamples)
+        self.max_latency_ms = min(max_latency_ms, MAX_BATCH_SPAN_MS)
+        self._start_ms = 0
+        self._offsets_ms = []
+        self._readings = []
+
+    def __len__(self):
+        return len(self._readings)
+
+    def add(self, reading, now_ms):
+        """Add a reading taken at device time ``now_ms``. Returns a batch
+        when one is complete, otherwise None. A reading too late for the
+        offsets of the pending batch completes that batch and starts the
+        next one."""
+        batch = None
+        if self._readings and now_ms - self._start_ms > MAX_BATCH_SPAN_MS:
+            batch = self.flush()
+        if not self._readings:
+            self._start_ms = now_ms
+        self._offsets_ms.append(now_ms - self._start_ms)
+        self._readings.append(reading)
+        return batch if batch is not None else self.poll(now_ms)
+
+    def poll(self, now_ms):
+        """The pending batch if it is complete at ``now_ms``, otherwise
+        None. Call it when no reading is added, so a sparse batch is not
+        held back."""
+        if len(self._readings) >= self.size or (
+            self._readings and now_ms - self._start_ms >= self.max_latency_ms
+        ):
+            return self.flush()
+        return None
+
+    def flush(self):
+        """The pending readings as a batch, None without any."""
+        if not self._readings:
+            return None
+        batch = SensorReadingBatch(
+            self._start_ms & 0xFFFFFFFF, self._offsets_ms, self._readings
+        )
+        self._offsets_ms = []
+        self._readings = []
+        return batch
+
+
+# bit i of a field mask selects SENSOR_FIELDS[i]
+SENSOR_FIELDS = tuple(
+    (prefix + name, code, scale)
+    for prefix in ("in_", "out_")
+    for name, code, scale in _GROUP_FIELDS
+)
+FIELDS_INTAKE = (1 << len(_GROUP_FIELDS)) - 1
+FIELDS_EXHAUST = FIELDS_INTAKE << len(_GROUP_FIELDS)
+FIELDS_ALL = FIELDS_INTAKE | FIELDS_EXHAUST
+
+# first firmware version that understands FieldMaskRequest
+FIELD_MASK_MIN_VERSION = (0, 0, 4)
+
+
+def field_mask(names):
+    """Field mask from SensorReading attribute names and the group names
+    ``intake`` / ``exhaust``. Raises ValueError for unknown names."""
+    mask = 0
+    for name in names:
+        if name == "intake":
+            mask |= FIELDS_INTAKE
+        elif name == "exhaust":
+            mask |= FIELDS_EXHAUST
+        else:
+            for bit, (field_name, _, _) in enumerate(SENSOR_FIELDS):
+                if field_name == name:
+                    mask |= 1 << bit
+                    break
+            else:
+                raise ValueError("unknown sensor field '{}'".format(name))
+    return mask
+
+
+def fixed_point_fields(reading):
+    """(field mask, values) of ``reading`` in the fixed point encoding of
+    SENSOR_FIELDS. Fields that are None encode as 0 and are left out of the
+    mask."""
+    mask = 0
+    values = []
+    for bit, (name, code, scale) in enumerate(SENSOR_FIELDS):
+        value = getattr(reading, name)
+        if value is None:
+            values.append(0)
+            continue
+        lo, hi = _FIXED_LIMITS[code]
+        values.append(_to_fixed(value, scale, lo, hi))
+        mask |= 1 << bit
+    return mask, values
+
+
+@message_type
+class FieldMaskRequest(SequencedMessage):
+    __slots__ = ("field_mask",)
+
+    MsgId = 0x03
+    PayloadLength = _UINT16_STRUCT.size
+
+    def __init__(self, field_mask, seq=None):
+        self.field_mask = field_mask
+        self.seq = seq
+
+    def __repr__(self):
+        return "FieldMaskRequest(field_mask=0x{:04X})".format(self.field_mask)
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != FieldMaskRequest.MsgId:
+            raise MessageIdError()
+        return FieldMaskRequest.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        seq = _payload_seq(payload, FieldMaskRequest.PayloadLength)
+        return FieldMaskRequest(_UINT16_STRUCT.unpack_from(payload)[0], seq=seq)
+
+    def serialize_into(self, buffer, offset=0):
+        _UINT16_STRUCT.pack_into(buffer, offset + HEADER_LEN, self.field_mask)
+        return _seal_sequenced(self, buffer, offset, self.PayloadLength)
+
+
+@message_type
+class FieldMaskResponse(SequencedMessage):
+    __slots__ = ("field_mask",)
+
+    MsgId = 0x86
+    PayloadLength = _UINT16_STRUCT.size
+
+    def __init__(self, field_mask, seq=None):
+        self.field_mask = field_mask
+        self.seq = seq
+
+    def __repr__(self):
+        return "FieldMaskResponse(field_mask=0x{:04X})".format(self.field_mask)
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != FieldMaskResponse.MsgId:
+            raise MessageIdError()
+        return FieldMaskResponse.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        seq = _payload_seq(payload, FieldMaskResponse.PayloadLength)
+        return FieldMaskResponse(_UINT16_STRUCT.unpack_from(payload)[0], seq=seq)
+
+    def serialize_into(self, buffer, offset=0):
+        _UINT16_STRUCT.pack_into(buffer, offset + HEADER_LEN, self.field_mask)
+        return _seal_sequenced(self, buffer, offset, self.PayloadLength)
+
+
+_masked_layouts = {}
+
+
+def _masked_layout(mask):
+    # (selected SENSOR_FIELDS entries, Struct for mask + selected fields)
+    layout = _masked_layouts.get(mask)
+    if layout is None:
+        fields = tuple(
+            field for bit, field in enumerate(SENSOR_FIELDS) if mask & (1 << bit)
+        )
+        layout = (fields, Struct("<H" + "".join(code for _, code, _ in fields)))
+        _masked_layouts[mask] = layout
+    return layout
+
+
+@message_type
+class SensorReadingMasked(SensorReading):
+    """SensorReading carrying only the fields selected by ``field_mask``.
+
+    The payload is the 16-bit mask followed by the selected fields in bit
+    order, in the fixed point encoding of SensorReadingV2. Fields that
+    were not sent decode as None.
+    """
+
+    __slots__ = ("field_mask",)
+
+    MsgId = 0x87
+    MaxFrameLength = _masked_layout(FIELDS_ALL)[1].size + _UINT32_STRUCT.size + META_LEN
+
+    def __init__(self, field_mask, *values):
+        SensorReading.__init__(self, *values)
+        self.field_mask = field_mask
+
+    def __repr__(self):
+        return "SensorReadingMasked(field_mask=0x{:04X}, {})".format(
+            self.field_mask,
+            ", ".join(
+                "{}={}".format(name, getattr(self, name))
+                for name, _, _ in _masked_layout(self.field_mask)[0]
             ),
-        ).serialize()
+        )
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != SensorReadingMasked.MsgId:
+            raise MessageIdError()
+        return SensorReadingMasked.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        if len(payload) < _UINT16_STRUCT.size:
+            raise PayloadLengthError()
+        mask = _UINT16_STRUCT.unpack_from(payload)[0]
+        fields, layout = _masked_layout(mask)
+        timestamp_ms = _reading_timestamp(payload, layout.size)
+        values = layout.unpack_from(payload)
+
+        reading = SensorReadingMasked(mask, *([None] * SensorReading.ValueCount))
+        reading.timestamp_ms = timestamp_ms
+        for idx, (name, _, scale) in enumerate(fields):
+            value = values[idx + 1]
+            setattr(reading, name, value / float(scale) if scale != 1 else value)
+        if reading.in_bme_pressure_hPa is not None:
+            reading.in_bme_altitude_m = altitude_m(reading.in_bme_pressure_hPa)
+        if reading.out_bme_pressure_hPa is not None:
+            reading.out_bme_altitude_m = altitude_m(reading.out_bme_pressure_hPa)
+        return reading
+
+    def frame_length(self):
+        return (
+            _masked_layout(self.field_mask)[1].size + _timestamp_length(self) + META_LEN
+        )
+
+    def serialize_into(self, buffer, offset=0):
+        fields, layout = _masked_layout(self.field_mask)
+        values = [self.field_mask]
+        for name, code, scale in fields:
+            lo, hi = _FIXED_LIMITS[code]
+            values.append(_to_fixed(getattr(self, name), scale, lo, hi))
+        layout.pack_into(buffer, offset + HEADER_LEN, *values)
+        return _seal_reading(self, buffer, offset, layout.size)
+
+
+# deadbands used for fields not named in report_deadbands(), in engineering
+# units, keyed by SensorReading attribute without the in_/out_ prefix
+DEFAULT_DEADBANDS = {
+    "dht_temp_C": 0.2,
+    "dht_humidity_rh": 1.0,
+    "sgp_eCO2": 10,
+    "sgp_TVOC": 5,
+    "bme_temp_C": 0.1,
+    "bme_gas": 2000,
+    "bme_humidity_rh": 1.0,
+    "bme_pressure_hPa": 0.5,
+}
+
+# first firmware version that understands ReportPolicyRequest
+REPORT_POLICY_MIN_VERSION = (0, 0, 5)
+
+_REPORT_POLICY_STRUCT = Struct("<I{}H".format(len(SENSOR_FIELDS)))
+
+
+def report_deadbands(overrides=None):
+    """Per field deadbands in fixed point units for a ReportPolicyRequest.
+
+    ``overrides`` maps field names to deadbands in engineering units. A name
+    without in_/out_ prefix applies to both sensor groups. Raises ValueError
+    for unknown names.
+    """
+    deadbands = dict(
+        (prefix + name, value)
+        for prefix in ("in_", "out_")
+        for name, value in DEFAULT_DEADBANDS.items()
+    )
+    for name, value in (overrides or {}).items():
+        if name in DEFAULT_DEADBANDS:
+            deadbands["in_" + name] = value
+            deadbands["out_" + name] = value
+        elif name in deadbands:
+            deadbands[name] = value
+        else:
+            raise ValueError("unknown sensor field '{}'".format(name))
+    return tuple(
+        _to_fixed(deadbands[name], scale, 0, 65535) for name, _, scale in SENSOR_FIELDS
+    )
+
+
+@message_type
+class ReportPolicyRequest(SequencedMessage):
+    """Report on change: a reading is sent when a field moved more than its
+    deadband since the last sent reading, or after ``max_silence_ms``
+    without one. ``max_silence_ms`` of 0 sends every reading."""
+
+    __slots__ = ("max_silence_ms", "deadbands")
+
+    MsgId = 0x04
+    PayloadLength = _REPORT_POLICY_STRUCT.size
+
+    def __init__(self, max_silence_ms, deadbands, seq=None):
+        if len(deadbands) != len(SENSOR_FIELDS):
+            raise MessageParseError()
+        self.max_silence_ms = max_silence_ms
+        self.deadbands = tuple(deadbands)
+        self.seq = seq
+
+    def __repr__(self):
+        return "ReportPolicyRequest(max_silence_ms={}, deadbands={})".format(
+            self.max_silence_ms, self.deadbands
+        )
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != ReportPolicyRequest.MsgId:
+            raise MessageIdError()
+        return ReportPolicyRequest.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        seq = _payload_seq(payload, ReportPolicyRequest.PayloadLength)
+        values = _REPORT_POLICY_STRUCT.unpack_from(payload)
+        return ReportPolicyRequest(values[0], values[1:], seq=seq)
+
+    def serialize_into(self, buffer, offset=0):
+        _REPORT_POLICY_STRUCT.pack_into(
+            buffer, offset + HEADER_LEN, self.max_silence_ms, *self.deadbands
+        )
+        return _seal_sequenced(self, buffer, offset, self.PayloadLength)
+
+
+@message_type
+class ReportPolicyResponse(SequencedMessage):
+    __slots__ = ("max_silence_ms", "deadbands")
+
+    MsgId = 0x88
+    PayloadLength = _REPORT_POLICY_STRUCT.size
+
+    def __init__(self, max_silence_ms, deadbands, seq=None):
+        if len(deadbands) != len(SENSOR_FIELDS):
+            raise MessageParseError()
+        self.max_silence_ms = max_silence_ms
+        self.deadbands = tuple(deadbands)
+        self.seq = seq
+
+    def __repr__(self):
+        return "ReportPolicyResponse(max_silence_ms={}, deadbands={})".format(
+            self.max_silence_ms, self.deadbands
+        )
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != ReportPolicyResponse.MsgId:
+            raise MessageIdError()
+        return ReportPolicyResponse.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        seq = _payload_seq(payload, ReportPolicyResponse.PayloadLength)
+        values = _REPORT_POLICY_STRUCT.unpack_from(payload)
+        return ReportPolicyResponse(values[0], values[1:], seq=seq)
+
+    def serialize_into(self, buffer, offset=0):
+        _REPORT_POLICY_STRUCT.pack_into(
+            buffer, offset + HEADER_LEN, self.max_silence_ms, *self.deadbands
+        )
+        return _seal_sequenced(self, buffer, offset, self.PayloadLength)
+
+
+class ReportFilter:
+    """Applies a ReportPolicyRequest to the readings taken on the device."""
+
+    def __init__(self):
+        self.max_silence_ms = 0
+        self.deadbands = None
+        self._last_values = None
+        self._last_ms = 0
+
+    def set_policy(self, policy):
+        self.max_silence_ms = policy.max_silence_ms
+        self.deadbands = policy.deadbands
+        self._last_values = None
+
+    def should_report(self, reading, now_ms):
+        if not self.max_silence_ms:
+            return True
+        values = _encode_reading(reading)
+        last_values = self._last_values
+        report = (
+            last_values is None
+            or now_ms - self._last_ms >= self.max_silence_ms
+            or any(
+                abs(value - last) > deadband
+                for value, last, deadband in zip(values, last_values, self.deadbands)
+            )
+        )
+        if report:
+            self._last_values = values
+            self._last_ms = now_ms
+        return report
+
+
+# first firmware version that understands SampleRateRequest
+SAMPLE_RATE_MIN_VERSION = (0, 0, 6)
+MIN_SAMPLE_PERIOD_MS = 50
+MAX_SAMPLE_PERIOD_MS = 3600000
+# the sensors refresh at most this often (the DHT22 every 2 s), shorter
+# sample periods repeat cached values
+SENSOR_REFRESH_PERIOD_MS = 1000
+
+
+def sample_period_ms(rate_hz):
+    """Sample period for a rate in Hz, limited to what the firmware accepts."""
+    period_ms = int(round(1000.0 / rate_hz))
+    return min(max(period_ms, MIN_SAMPLE_PERIOD_MS), MAX_SAMPLE_PERIOD_MS)
+
+
+# at short sample periods the readings of this many ms share one frame
+BATCH_INTERVAL_MS = 500
+
+
+def batch_size(period_ms):
+    """Readings per SensorReadingBatch at the sample period ``period_ms``,
+    1 sends every reading in its own frame. The firmware batches once the
+    host negotiated the sample rate, hosts that do understand batches."""
+    return max(1, min(BATCH_INTERVAL_MS // period_ms, SensorReadingBatch.MaxSamples))
+
+
+@message_type
+class SampleRateRequest(SequencedMessage):
+    __slots__ = ("period_ms",)
+
+    MsgId = 0x05
+    PayloadLength = _UINT32_STRUCT.size
+
+    def __init__(self, period_ms, seq=None):
+        self.period_ms = period_ms
+        self.seq = seq
+
+    def __repr__(self):
+        return "SampleRateRequest(period_ms={})".format(self.period_ms)
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != SampleRateRequest.MsgId:
+            raise MessageIdError()
+        return SampleRateRequest.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        seq = _payload_seq(payload, SampleRateRequest.PayloadLength)
+        return SampleRateRequest(_UINT32_STRUCT.unpack_from(payload)[0], seq=seq)
+
+    def serialize_into(self, buffer, offset=0):
+        _UINT32_STRUCT.pack_into(buffer, offset + HEADER_LEN, self.period_ms)
+        return _seal_sequenced(self, buffer, offset, self.PayloadLength)
+
+
+@message_type
+class SampleRateResponse(SequencedMessage):
+    __slots__ = ("period_ms",)
+
+    MsgId = 0x89
+    PayloadLength = _UINT32_STRUCT.size
+
+    def __init__(self, period_ms, seq=None):
+        self.period_ms = period_ms
+        self.seq = seq
+
+    def __repr__(self):
+        return "SampleRateResponse(period_ms={})".format(self.period_ms)
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != SampleRateResponse.MsgId:
+            raise MessageIdError()
+        return SampleRateResponse.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        seq = _payload_seq(payload, SampleRateResponse.PayloadLength)
+        return SampleRateResponse(_UINT32_STRUCT.unpack_from(payload)[0], seq=seq)
+
+    def serialize_into(self, buffer, offset=0):
+        _UINT32_STRUCT.pack_into(buffer, offset + HEADER_LEN, self.period_ms)
+        return _seal_sequenced(self, buffer, offset, self.PayloadLength)
+
+
+# task ids used by the firmware scheduler
+SCHEDULER_TASK_NAMES = {
+    0: "sensors",
+    1: "led",
+    2: "diagnostics",
+    3: "in_dht22",
+    4: "in_sgp30",
+    5: "in_bme680",
+    6: "out_dht22",
+    7: "out_sgp30",
+    8: "out_bme680",
+}
+
+TaskStats = namedtuple(
+    "TaskStats",
+    ["task_id", "runs", "overruns", "missed", "late_max_ms", "late_mean_ms"],
+)
+
+_TASK_STATS_STRUCT = Struct("<BIIIHH")
+
+
+@message_type
+class SchedulerDiagnostics(Message):
+    """Periodic task timing reported by the firmware.
+
+    ``runs``, ``overruns`` (runs that ended past the next deadline) and
+    ``missed`` (periods skipped or coalesced) count from boot; the start
+    lateness figures cover the time since the previous report.
+    """
+
+    __slots__ = ("tasks",)
+
+    MsgId = 0x8A
+    MaxTasks = (MAX_MSG_LEN - META_LEN) // _TASK_STATS_STRUCT.size
+    MaxFrameLength = MaxTasks * _TASK_STATS_STRUCT.size + META_LEN
+
+    def __init__(self, tasks):
+        if len(tasks) > self.MaxTasks:
+            raise MessageParseError()
+        self.tasks = tasks
+
+    def __repr__(self):
+        return "SchedulerDiagnostics(tasks={})".format(self.tasks)
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != SchedulerDiagnostics.MsgId:
+            raise MessageIdError()
+        return SchedulerDiagnostics.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        size = _TASK_STATS_STRUCT.size
+        if len(payload) % size or len(payload) // size > SchedulerDiagnostics.MaxTasks:
+            raise PayloadLengthError()
+        return SchedulerDiagnostics(
+            [
+                TaskStats(*_TASK_STATS_STRUCT.unpack_from(payload, offset))
+                for offset in range(0, len(payload), size)
+            ]
+        )
+
+    def frame_length(self):
+        return len(self.tasks) * _TASK_STATS_STRUCT.size + META_LEN
+
+    def serialize_into(self, buffer, offset=0):
+        start = offset + HEADER_LEN
+        for idx, task in enumerate(self.tasks):
+            _TASK_STATS_STRUCT.pack_into(
+                buffer,
+                start + idx * _TASK_STATS_STRUCT.size,
+                task.task_id,
+                task.runs,
+                task.overruns,
+                task.missed,
+                min(task.late_max_ms, 65535),
+                min(task.late_mean_ms, 65535),
+            )
+        return seal_frame(
+            buffer, offset, self.MsgId, len(self.tasks) * _TASK_STATS_STRUCT.size
+        )
+
+
+# first firmware version that answers TimeSyncRequest and timestamps readings
+TIME_SYNC_MIN_VERSION = (0, 0, 9)
+
+
+@message_type
+class TimeSyncRequest(Message):
+    """Clock ping, answered with the device time in a TimeSyncResponse."""
+
+    __slots__ = ("seq",)
+
+    MsgId = 0x06
+    PayloadLength = _UINT16_STRUCT.size
+
+    def __init__(self, seq):
+        self.seq = seq
+
+    def __repr__(self):
+        return "TimeSyncRequest(seq={})".format(self.seq)
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != TimeSyncRequest.MsgId:
+            raise MessageIdError()
+        return TimeSyncRequest.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        if len(payload) != TimeSyncRequest.PayloadLength:
+            raise PayloadLengthError()
+        return TimeSyncRequest(_UINT16_STRUCT.unpack_from(payload)[0])
+
+    def serialize_into(self, buffer, offset=0):
+        _UINT16_STRUCT.pack_into(buffer, offset + HEADER_LEN, self.seq & 0xFFFF)
+        return seal_frame(buffer, offset, self.MsgId, self.PayloadLength)
+
+
+_TIME_SYNC_RESPONSE_STRUCT = Struct("<HI")
+
+
+@message_type
+class TimeSyncResponse(Message):
+    """Device time in ms (wrapping uint32) when the request was handled."""
+
+    __slots__ = ("seq", "device_ms")
+
+    MsgId = 0x8C
+    PayloadLength = _TIME_SYNC_RESPONSE_STRUCT.size
+
+    def __init__(self, seq, device_ms):
+        self.seq = seq
+        self.device_ms = device_ms
+
+    def __repr__(self):
+        return "TimeSyncResponse(seq={}, device_ms={})".format(self.seq, self.device_ms)
+
+    @staticmethod
+    def from_message(msg):
+        if msg.msg_id != TimeSyncResponse.MsgId:
+            raise MessageIdError()
+        return TimeSyncResponse.decode(msg.payload)
+
+    @staticmethod
+    def decode(payload):
+        if len(payload) != TimeSyncResponse.PayloadLength:
+            raise PayloadLengthError()
+        return TimeSyncResponse(*_TIME_SYNC_RESPONSE_STRUCT.unpack_from(payload))
+
+    def serialize_into(self, buffer, offset=0):
+        _TIME_SYNC_RESPONSE_STRUCT.pack_into(
+            buffer, offset + HEADER_LEN, self.seq & 0xFFFF, self.device_ms & 0xFFFFFFFF
+        )
+        return seal_frame(buffer, offset, self.MsgId, self.PayloadLength)
+
+
+def max_frame_length(cls):
+    """Longest frame of message class ``cls``, with all optional trailers."""
+    length = getattr(cls, "MaxFrameLength", None)
+    if length is not None:
+        return length
+    length = cls.PayloadLength + META_LEN
+    if issubclass(cls, SequencedMessage):
+        length += _UINT8_STRUCT.size
+    elif issubclass(cls, SensorReading):
+        length += _UINT32_STRUCT.size
+    return length
+
+
+# msg_id -> longest valid frame, 0 for unknown msg_ids. Handed to
+# MessageParser, so a stray start byte with a large length byte is
+# rejected at once instead of stalling the parser until that many bytes
+# arrived.
+FRAME_LENGTHS = bytearray(256)
+for _cls in MESSAGE_TYPES.values():
+    FRAME_LENGTHS[_cls.MsgId] = max_frame_length(_cls)
+
+# request msg_id -> msg_id of the response the firmware answers it with
+RESPONSE_IDS = {
+    VersionRequest.MsgId: VersionResponse.MsgId,
+    StateChangeRequest.MsgId: StateChangeResponse.MsgId,
+    ReadingFormatRequest.MsgId: ReadingFormatResponse.MsgId,
+    FieldMaskRequest.MsgId: FieldMaskResponse.MsgId,
+    ReportPolicyRequest.MsgId: ReportPolicyResponse.MsgId,
+    SampleRateRequest.MsgId: SampleRateResponse.MsgId,
+    TimeSyncRequest.MsgId: TimeSyncResponse.MsgId,
+}
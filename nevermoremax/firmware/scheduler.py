@@ -0,0 +1,162 @@
+import time
+
+try:
+    from adafruit_ticks import ticks_ms, ticks_add, ticks_diff
+except ImportError:
+
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+
+# what to do when a task falls one or more periods behind
+SKIP = 0  # drop the missed periods and wait for the next one on the grid
+COALESCE = 1  # run once right away for all missed periods, then stay on the grid
+
+
+class Backoff:
+    """Idle delay for a polling loop, doubling from ``min_ms`` up to
+    ``max_ms`` while nothing happens."""
+
+    def __init__(self, min_ms, max_ms):
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.delay_ms = min_ms
+
+    def reset(self):
+        self.delay_ms = self.min_ms
+
+    def next(self):
+        delay_ms = self.delay_ms
+        self.delay_ms = min(delay_ms * 2, self.max_ms)
+        return delay_ms
+
+
+class PeriodicTask:
+    """A function called every ``period_ms`` on a fixed grid of deadlines.
+
+    Deadlines advance by exactly one period per run, so the schedule does
+    not drift with the time the function takes. Change the period with
+    set_period().
+    """
+
+    def __init__(self, task_id, fn, period_ms, args, priority, policy, deadline):
+        self.task_id = task_id
+        self.fn = fn
+        self.period_ms = period_ms
+        self.args = args
+        self.priority = priority
+        self.policy = policy
+        self.deadline = deadline
+
+        self.runs = 0
+        self.overruns = 0
+        self.missed = 0
+        # start lateness since the last take_stats()
+        self.late_max_ms = 0
+        self.late_sum_ms = 0
+        self.late_count = 0
+
+    def set_period(self, period_ms, now):
+        """Run every ``period_ms`` from now on. A shorter period also pulls
+        a deadline further out than that in to ``now + period_ms``, so a
+        switch from a slow to a fast rate does not wait out the old period."""
+        self.period_ms = period_ms
+        deadline = ticks_add(now, period_ms)
+        if ticks_diff(deadline, self.deadline) < 0:
+            self.deadline = deadline
+
+    def run(self, now, clock):
+        late_ms = ticks_diff(now, self.deadline)
+        self.runs += 1
+        self.late_sum_ms += late_ms
+        self.late_count += 1
+        if late_ms > self.late_max_ms:
+            self.late_max_ms = late_ms
+
+        self.fn(*self.args)
+
+        period_ms = self.period_ms
+        next_deadline = ticks_add(self.deadline, period_ms)
+        behind_ms = ticks_diff(clock(), next_deadline)
+        if behind_ms >= 0:
+            missed = behind_ms // period_ms + 1
+            self.overruns += 1
+            if self.policy == COALESCE:
+                # the latest missed deadline, which is already due
+                missed -= 1
+            next_deadline = ticks_add(next_deadline, missed * period_ms)
+            self.missed += missed
+        self.deadline = next_deadline
+
+    def take_stats(self):
+        """(task_id, runs, overruns, missed, late_max_ms, late_mean_ms), the
+        lateness figures cover the time since the previous call."""
+        late_mean_ms = self.late_sum_ms // self.late_count if self.late_count else 0
+        stats = (
+            self.task_id,
+            self.runs,
+            self.overruns,
+            self.missed,
+            self.late_max_ms,
+            late_mean_ms,
+        )
+        self.late_max_ms = 0
+        self.late_sum_ms = 0
+        self.late_count = 0
+        return stats
+
+
+class Scheduler:
+    """Runs periodic tasks from one loop. When several tasks are due, the
+    one with the highest priority runs first."""
+
+    def __init__(self, clock=ticks_ms):
+        self.clock = clock
+        self.tasks = []
+
+    def add(self, fn, period_ms, *args, **kwargs):
+        """Call ``fn(*args)`` every ``period_ms``, first after ``start_ms``.
+
+        Keyword arguments: ``priority`` (default 0), ``policy`` (SKIP) and
+        ``start_ms`` (0).
+        """
+        # no keyword-only arguments, the host tests run on Python 2
+        priority = kwargs.pop("priority", 0)
+        policy = kwargs.pop("policy", SKIP)
+        start_ms = kwargs.pop("start_ms", 0)
+        if kwargs:
+            raise TypeError("unexpected arguments {}".format(", ".join(kwargs)))
+        task = PeriodicTask(
+            len(self.tasks),
+            fn,
+            period_ms,
+            args,
+            priority,
+            policy,
+            ticks_add(self.clock(), start_ms),
+        )
+        self.tasks.append(task)
+        self.tasks.sort(key=lambda t: -t.priority)
+        return task
+
+    def run_pending(self, max_tasks=None):
+        """Run due tasks, at most ``max_tasks`` of them. Returns the ms until
+        the next deadline, 0 if a task is still due."""
+        ran = 0
+        for task in self.tasks:
+            if max_tasks is not None and ran >= max_tasks:
+                break
+            now = self.clock()
+            if ticks_diff(now, task.deadline) >= 0:
+                task.run(now, self.clock)
+                ran += 1
+
+        now = self.clock()
+        wait_ms = min(ticks_diff(task.deadline, now) for task in self.tasks)
+        return wait_ms if wait_ms > 0 else 0
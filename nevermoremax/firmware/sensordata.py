@@ -1,5 +1,22 @@
 from collections import namedtuple
 
+try:
+    from messages import field_mask
+    from scheduler import SKIP
+except ImportError:
+    from .messages import field_mask
+    from .scheduler import SKIP
+
+# shortest read period of each sensor, longer when the sample period is
+DHT22_MIN_PERIOD_MS = 2000  # the DHT22 cannot be read more often
+BME680_MIN_PERIOD_MS = 1000  # the gas heater runs for every measurement
+# the SGP30 baseline algorithm expects exactly 1 Hz
+SGP30_PERIOD_MS = 1000
+# offset of the exhaust group reads against the intake group reads
+GROUP_STAGGER_MS = 500
+
+SENSOR_READ_PRIORITY = 1
+
 SensorGroupData = namedtuple(
     "SensorGroupData",
     [
@@ -23,3 +40,79 @@ class SensorData:
 
     def data(self):
         return self.data_in + self.data_out
+
+
+class GroupReads:
+    """Read tasks of one sensor group, fields named with ``prefix``.
+
+    Each read function returns whether it got fresh values, and then
+    ``on_read(fields)`` gets the field mask (see messages.field_mask) of
+    the values it refreshed.
+    """
+
+    def __init__(self, prefix):
+        self.dht22_fields = field_mask(
+            [prefix + "dht_temp_C", prefix + "dht_humidity_rh"]
+        )
+        self.sgp30_fields = field_mask([prefix + "sgp_eCO2", prefix + "sgp_TVOC"])
+        self.bme680_fields = field_mask(
+            [
+                prefix + "bme_temp_C",
+                prefix + "bme_gas",
+                prefix + "bme_humidity_rh",
+                prefix + "bme_pressure_hPa",
+            ]
+        )
+        self.on_read = None
+        self.dht22_task = None
+        self.bme680_task = None
+
+    def _read(self, read, fields):
+        if read() and self.on_read is not None:
+            self.on_read(fields)
+
+    def schedule(
+        self,
+        scheduler,
+        sample_period_ms,
+        start_ms,
+        on_read,
+        read_dht22,
+        read_sgp30,
+        read_bme680,
+    ):
+        # spread the reads of the group over its fastest period
+        self.on_read = on_read
+        self.dht22_task = scheduler.add(
+            self._read,
+            max(DHT22_MIN_PERIOD_MS, sample_period_ms),
+            read_dht22,
+            self.dht22_fields,
+            priority=SENSOR_READ_PRIORITY,
+            policy=SKIP,
+            start_ms=start_ms,
+        )
+        scheduler.add(
+            self._read,
+            SGP30_PERIOD_MS,
+            read_sgp30,
+            self.sgp30_fields,
+            priority=SENSOR_READ_PRIORITY,
+            policy=SKIP,
+            start_ms=start_ms + 100,
+        )
+        self.bme680_task = scheduler.add(
+            self._read,
+            max(BME680_MIN_PERIOD_MS, sample_period_ms),
+            read_bme680,
+            self.bme680_fields,
+            priority=SENSOR_READ_PRIORITY,
+            policy=SKIP,
+            start_ms=start_ms + 200,
+        )
+
+    def set_sample_period(self, sample_period_ms, now):
+        # a slow sample rate needs no faster reads, 0 reads every sensor as
+        # often as it allows
+        self.dht22_task.set_period(max(DHT22_MIN_PERIOD_MS, sample_period_ms), now)
+        self.bme680_task.set_period(max(BME680_MIN_PERIOD_MS, sample_period_ms), now)
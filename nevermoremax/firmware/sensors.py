@@ -1,4 +1,4 @@
-from sensordata import SensorData, SensorGroupData
+from sensordata import GROUP_STAGGER_MS, GroupReads, SensorData, SensorGroupData
 
 import board
 import busio
@@ -7,6 +7,16 @@ import adafruit_bme680
 import adafruit_sgp30
 import adafruit_dht
 
+from messages import altitude_m
+
+# Every read blocks the loop for its bus transaction: the DHT22 bit-bangs
+# its answer, the SGP30 waits out its measurement command and a BME680 read
+# runs a forced measurement, gas heater included. The drivers have no way
+# to start a measurement and collect it later, so the sensors are read no
+# more often than the sample period needs (see sensordata.GroupReads), and
+# the BME680 gas resistance comes from the same forced measurement as
+# temperature and pressure.
+
 
 class Sensors:
     def __init__(self):
@@ -37,59 +47,115 @@ class Sensors:
         self.bme_temperature_offset_C_in = 5
         self.bme_temperature_offset_C_out = 5
 
-    def sample(self):
-        data_in = sample_group(
+        self.group_in = SensorGroup(
+            "in_",
             self.dht22_in,
             self.sgp30_in,
             self.bme680_in,
             self.bme_temperature_offset_C_in,
         )
-
-        data_out = sample_group(
+        self.group_out = SensorGroup(
+            "out_",
             self.dht22_out,
             self.sgp30_out,
             self.bme680_out,
             self.bme_temperature_offset_C_out,
         )
 
-        return SensorData(data_in, data_out)
-
-
-def sample_group(
-    dht22: adafruit_dht.DHT22,
-    sgp30: adafruit_sgp30.Adafruit_SGP30,
-    bme680: adafruit_bme680.Adafruit_BME680_I2C,
-    bme_temp_offset_C: float,
-) -> SensorGroupData:
-
-    # Measure DHT22a
-    dht_temp_C = -1
-    dht_humidity = -1
-    try:
-        dht_temp_C = dht22.temperature
-        dht_humidity = dht22.humidity
-    except RuntimeError:
-        pass
-    except Exception as err:
-        print(f"DHT22 Error: {err}")
-
-    sgp30_eC02 = sgp30.eCO2
-    sgp30_TCOV = sgp30.TVOC
-
-    gme_temp_C = bme680.temperature + bme_temp_offset_C
-    gme_gas = bme680.gas
-    gme_humidity = bme680.relative_humidity
-    gme_pres_hPa = bme680.pressure
-    gme_alt_m = bme680.altitude
-
-    return SensorGroupData(
-        dht_temp_C,
-        dht_humidity,
-        sgp30_eC02,
-        sgp30_TCOV,
-        gme_temp_C,
-        gme_gas,
-        gme_humidity,
-        gme_pres_hPa,
-        gme_alt_m,
-    )
+    def schedule(self, scheduler, sample_period_ms, on_read):
+        """Add one read task per sensor, in the order of
+        messages.SCHEDULER_TASK_NAMES. ``on_read(fields)`` follows every
+        read that got fresh values."""
+        self.group_in.schedule(scheduler, sample_period_ms, 0, on_read)
+        self.group_out.schedule(scheduler, sample_period_ms, GROUP_STAGGER_MS, on_read)
+
+    def set_sample_period(self, sample_period_ms, now):
+        self.group_in.set_sample_period(sample_period_ms, now)
+        self.group_out.set_sample_period(sample_period_ms, now)
+
+    def sample(self):
+        # latest cached values, no sensor I/O
+        return SensorData(self.group_in.data(), self.group_out.data())
+
+
+class SensorGroup:
+    """Latest values of one sensor group, each sensor refreshed by its own
+    scheduler task."""
+
+    def __init__(
+        self,
+        prefix: str,
+        dht22: adafruit_dht.DHT22,
+        sgp30: adafruit_sgp30.Adafruit_SGP30,
+        bme680: adafruit_bme680.Adafruit_BME680_I2C,
+        bme_temp_offset_C: float,
+    ):
+        self.dht22 = dht22
+        self.sgp30 = sgp30
+        self.bme680 = bme680
+        self.bme_temp_offset_C = bme_temp_offset_C
+
+        self.dht_temp_C = -1
+        self.dht_humidity = -1
+        self.sgp30_eC02 = 0
+        self.sgp30_TCOV = 0
+        self.gme_temp_C = 0
+        self.gme_gas = 0
+        self.gme_humidity = 0
+        self.gme_pres_hPa = 0
+        self.gme_alt_m = 0
+
+        self.reads = GroupReads(prefix)
+
+    def schedule(self, scheduler, sample_period_ms, start_ms, on_read):
+        self.reads.schedule(
+            scheduler,
+            sample_period_ms,
+            start_ms,
+            on_read,
+            self.read_dht22,
+            self.read_sgp30,
+            self.read_bme680,
+        )
+
+    def set_sample_period(self, sample_period_ms, now):
+        self.reads.set_sample_period(sample_period_ms, now)
+
+    def read_dht22(self):
+        try:
+            self.dht_temp_C = self.dht22.temperature
+            self.dht_humidity = self.dht22.humidity
+        except RuntimeError:
+            # checksum and timing errors are common, keep the last values
+            return False
+        except Exception as err:
+            print(f"DHT22 Error: {err}")
+            return False
+        return True
+
+    def read_sgp30(self):
+        self.sgp30_eC02 = self.sgp30.eCO2
+        self.sgp30_TCOV = self.sgp30.TVOC
+        return True
+
+    def read_bme680(self):
+        self.gme_temp_C = self.bme680.temperature + self.bme_temp_offset_C
+        self.gme_humidity = self.bme680.relative_humidity
+        self.gme_pres_hPa = self.bme680.pressure
+        self.gme_alt_m = altitude_m(self.gme_pres_hPa, self.bme680.sea_level_pressure)
+        # from the measurement above, the driver reuses it for 1/refresh_rate
+        self.gme_gas = self.bme680.gas
+        return True
+
+    def data(self) -> SensorGroupData:
+        return SensorGroupData(
+            self.dht_temp_C,
+            self.dht_humidity,
+            self.sgp30_eC02,
+            self.sgp30_TCOV,
+            self.gme_temp_C,
+            self.gme_gas,
+            self.gme_humidity,
+            self.gme_pres_hPa,
+            self.gme_alt_m,
+        )
@@ -3,9 +3,9 @@ import random
 import math
 
 try:
-    from sensordata import SensorData, SensorGroupData
+    from sensordata import GROUP_STAGGER_MS, GroupReads, SensorData, SensorGroupData
 except ImportError:
-    from .sensordata import SensorData, SensorGroupData
+    from .sensordata import GROUP_STAGGER_MS, GroupReads, SensorData, SensorGroupData
 
 t0 = time.monotonic()
 
@@ -36,6 +36,32 @@ def simulate_group_data(base_t_offset_s: float):
     )
 
 
+def sim_read():
+    # simulated values are computed on demand, a read only marks them fresh
+    return True
+
+
 class SimSensors:
+    def __init__(self):
+        self.reads_in = GroupReads("in_")
+        self.reads_out = GroupReads("out_")
+
+    def schedule(self, scheduler, sample_period_ms, on_read):
+        # the read tasks of the real sensors, for the same diagnostics
+        for reads, start_ms in ((self.reads_in, 0), (self.reads_out, GROUP_STAGGER_MS)):
+            reads.schedule(
+                scheduler,
+                sample_period_ms,
+                start_ms,
+                on_read,
+                sim_read,
+                sim_read,
+                sim_read,
+            )
+
+    def set_sample_period(self, sample_period_ms, now):
+        self.reads_in.set_sample_period(sample_period_ms, now)
+        self.reads_out.set_sample_period(sample_period_ms, now)
+
     def sample(self):
         return SensorData(simulate_group_data(0), simulate_group_data(2))
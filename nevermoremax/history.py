@@ -0,0 +1,290 @@
+# In-memory history of Nevermore Max readings at several resolutions
+#
+# Every tier is a ring of fixed size in array.array storage, allocated once:
+# the raw tier keeps the latest readings, the others min/mean/max buckets
+# of 10 s, 1 min and 15 min. Buckets are updated as readings arrive, the
+# open bucket of a tier is returned by queries like the closed ones. A
+# range query picks one tier and bisects its ring by time, so a query for
+# the last day reads a few hundred 15 min buckets, not the raw readings.
+#
+# Times are reactor times. Values are stored as float32, NaN where a
+# reading did not carry the field, and returned as None.
+#
+# A HistorySubscription follows one tier and pushes what changed since its
+# last push: the new raw readings, or the bucket that was open at the last
+# push again with the buckets opened since. Clients replace a bucket they
+# already have by its time.
+
+import array
+import math
+
+from .firmware import messages
+
+NAN = float('nan')
+FIELDS = tuple(name for name, _, _ in messages.SENSOR_FIELDS)
+
+# (bucket seconds, buckets), 0 seconds keeps every reading
+DEFAULT_TIERS = (
+    (0., 600),  # 10 min at one reading per second
+    (10., 360),  # 1 hour
+    (60., 360),  # 6 hours
+    (900., 672),  # 7 days
+)
+
+
+def _value(value):
+    return NAN if value is None else value
+
+
+def _column(values, indices):
+    return [None if math.isnan(values[idx]) else values[idx] for idx in indices]
+
+
+def check_fields(fields):
+    """``fields`` as a list, all of FIELDS for None. Raises ValueError for
+    unknown fields."""
+    fields = list(FIELDS) if fields is None else list(fields)
+    for name in fields:
+        if name not in FIELDS:
+            raise ValueError("unknown sensor field '{}'".format(name))
+    return fields
+
+
+class _Ring:
+    def __init__(self, period, size):
+        self.period = period
+        self.size = size
+        self.times = array.array('d', [0.]) * size
+        self.start = 0  # slot of the oldest entry
+        self.length = 0
+        self.updates = 0  # readings added
+
+    def __len__(self):
+        return self.length
+
+    def _new_slot(self):
+        if self.length < self.size:
+            slot = (self.start + self.length) % self.size
+            self.length += 1
+        else:
+            slot = self.start
+            self.start = (self.start + 1) % self.size
+        return slot
+
+    def oldest(self):
+        return self.times[self.start] if self.length else None
+
+    def newest(self):
+        if not self.length:
+            return None
+        return self.times[(self.start + self.length - 1) % self.size]
+
+    def bisect(self, time):
+        """Position of the first entry at or after ``time``."""
+        lo, hi = 0, self.length
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[(self.start + mid) % self.size] < time:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def slots(self, start=None, end=None):
+        """Slots of the entries from ``start`` up to, not including, ``end``,
+        oldest first."""
+        lo = 0 if start is None else self.bisect(start)
+        hi = self.length if end is None else self.bisect(end)
+        return [(self.start + pos) % self.size for pos in range(lo, hi)]
+
+    def count(self, start=None, end=None):
+        lo = 0 if start is None else self.bisect(start)
+        hi = self.length if end is None else self.bisect(end)
+        return max(hi - lo, 0)
+
+
+class RawTier(_Ring):
+    def __init__(self, size):
+        _Ring.__init__(self, 0., size)
+        self.values = dict((name, array.array('f', [NAN]) * size) for name in FIELDS)
+
+    def add(self, time, values, minimums, maximums, weight):
+        self.updates += 1
+        newest = self.newest()
+        slot = self._new_slot()
+        # keep the ring sorted for bisect
+        self.times[slot] = time if newest is None else max(time, newest)
+        for name, value in zip(FIELDS, values):
+            self.values[name][slot] = value
+
+    def query(self, fields, start=None, end=None):
+        return self._columns(fields, self.slots(start, end))
+
+    def latest(self, fields, count):
+        """The ``count`` newest readings."""
+        count = min(count, self.length)
+        return self._columns(fields, [
+            (self.start + pos) % self.size
+            for pos in range(self.length - count, self.length)])
+
+    def _columns(self, fields, slots):
+        return {
+            'resolution': self.period,
+            'time': [self.times[slot] for slot in slots],
+            'fields': dict((name, _column(self.values[name], slots)) for name in fields),
+        }
+
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in [self.times] + list(self.values.values()))
+
+
+class BucketTier(_Ring):
+    def __init__(self, period, size):
+        _Ring.__init__(self, period, size)
+        self.counts = array.array('I', [0]) * size
+        self.minimums = dict((name, array.array('f', [NAN]) * size) for name in FIELDS)
+        self.means = dict((name, array.array('f', [NAN]) * size) for name in FIELDS)
+        self.maximums = dict((name, array.array('f', [NAN]) * size) for name in FIELDS)
+        # the open bucket
+        self._slot = None
+        self._sums = [0.] * len(FIELDS)
+        self._weights = [0] * len(FIELDS)
+
+    def _open(self, bucket):
+        slot = self._slot = self._new_slot()
+        self.times[slot] = bucket
+        self.counts[slot] = 0
+        for name in FIELDS:
+            self.minimums[name][slot] = self.means[name][slot] = NAN
+            self.maximums[name][slot] = NAN
+        self._sums = [0.] * len(FIELDS)
+        self._weights = [0] * len(FIELDS)
+
+    def add(self, time, values, minimums, maximums, weight):
+        self.updates += 1
+        bucket = math.floor(time / self.period) * self.period
+        # a reading older than the open bucket is counted in it
+        if self._slot is None or bucket > self.times[self._slot]:
+            self._open(bucket)
+        slot = self._slot
+        self.counts[slot] += weight
+        for idx, name in enumerate(FIELDS):
+            value = values[idx]
+            if math.isnan(value):
+                continue
+            self._sums[idx] += value * weight
+            self._weights[idx] += weight
+            self.means[name][slot] = self._sums[idx] / self._weights[idx]
+            # comparisons with NaN are false, the first value always goes in
+            if not self.minimums[name][slot] <= minimums[idx]:
+                self.minimums[name][slot] = minimums[idx]
+            if not self.maximums[name][slot] >= maximums[idx]:
+                self.maximums[name][slot] = maximums[idx]
+
+    def query(self, fields, start=None, end=None):
+        # the bucket holding ``start`` is included
+        if start is not None:
+            start = math.floor(start / self.period) * self.period
+        slots = self.slots(start, end)
+        return {
+            'resolution': self.period,
+            'time': [self.times[slot] for slot in slots],
+            'count': [self.counts[slot] for slot in slots],
+            'fields': dict((name, {
+                'min': _column(self.minimums[name], slots),
+                'mean': _column(self.means[name], slots),
+                'max': _column(self.maximums[name], slots),
+            }) for name in fields),
+        }
+
+    def nbytes(self):
+        arrays = [self.times, self.counts]
+        for stat in (self.minimums, self.means, self.maximums):
+            arrays.extend(stat.values())
+        return sum(a.itemsize * len(a) for a in arrays)
+
+
+class History:
+    def __init__(self, tiers=DEFAULT_TIERS):
+        self.tiers = [RawTier(size) if not period else BucketTier(period, size)
+                      for period, size in sorted(tiers)]
+
+    def add(self, time, reading):
+        """Add ``reading`` sampled at reactor time ``time``. The spread and
+        sample count of a SensorReadingStats go into the buckets."""
+        values = [_value(getattr(reading, name)) for name in FIELDS]
+        minimums = maximums = values
+        weight = 1
+        if isinstance(reading, messages.SensorReadingStats):
+            minimums = [_value(getattr(reading.minimum, name)) for name in FIELDS]
+            maximums = [_value(getattr(reading.maximum, name)) for name in FIELDS]
+            weight = max(reading.count, 1)
+        for tier in self.tiers:
+            tier.add(time, values, minimums, maximums, weight)
+
+    def resolutions(self):
+        return [tier.period for tier in self.tiers]
+
+    def select(self, start=None, end=None, max_points=None):
+        """The finest tier that reaches back to ``start`` with at most
+        ``max_points`` entries in the range, else the coarsest one."""
+        for tier in self.tiers[:-1]:
+            oldest = tier.oldest()
+            if start is None or oldest is None or oldest > start:
+                continue
+            if max_points is not None and tier.count(start, end) > max_points:
+                continue
+            return tier
+        return self.tiers[-1]
+
+    def query(self, fields=None, start=None, end=None, resolution=None, max_points=None):
+        """Columns of ``fields`` (default all) from ``start`` up to ``end``.
+
+        Returns {'resolution', 'time', 'fields'}, plus 'count' for buckets.
+        Raw fields are lists of values, bucket fields dicts of 'min', 'mean'
+        and 'max' lists. ``resolution`` picks the tier by bucket seconds,
+        0 for raw readings, otherwise see select(). Raises ValueError for
+        unknown fields and resolutions."""
+        fields = check_fields(fields)
+        tier = self.tier(resolution) if resolution is not None else self.select(
+            start, end, max_points)
+        return tier.query(fields, start, end)
+
+    def tier(self, resolution):
+        for tier in self.tiers:
+            if tier.period == resolution:
+                return tier
+        raise ValueError("no history at resolution {}".format(resolution))
+
+    def nbytes(self):
+        return sum(tier.nbytes() for tier in self.tiers)
+
+
+class HistorySubscription:
+    """Pushes the changes to one tier of a History, at most once per bucket
+    period. ``send(columns)`` gets the columns of History.query() and
+    returns False once the client is gone."""
+
+    def __init__(self, tier, fields, send):
+        self.tier = tier
+        self.fields = fields
+        self.send = send
+        self.next_push = 0.
+        # state of the tier at the last push
+        self._updates = tier.updates
+        self._newest = tier.newest()
+
+    def push(self, now):
+        """Send what changed. Returns False when the client is gone."""
+        tier = self.tier
+        if now < self.next_push or tier.updates == self._updates:
+            return True
+        if tier.period:
+            # the bucket open at the last push may have changed since
+            columns = tier.query(self.fields, self._newest)
+        else:
+            columns = tier.latest(self.fields, tier.updates - self._updates)
+        self._updates = tier.updates
+        self._newest = tier.newest()
+        self.next_push = now + tier.period
+        return self.send(columns)
@@ -0,0 +1,116 @@
+# Requests to the Nevermore Max controller that wait for a response
+#
+# Firmware SEQUENCE_MIN_VERSION+ echoes the sequence number of a request in
+# its response, so several requests can be in flight and every response
+# finds its request. Without a sequence number the oldest request waiting
+# for that response type is completed. Requests that are not answered in
+# time are sent again, and given up after the last retry.
+
+from .firmware import messages
+
+DEFAULT_TIMEOUT = 0.25
+DEFAULT_RETRIES = 3
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+class PendingRequest:
+    def __init__(self, request, callback):
+        self.request = request
+        self.response_id = messages.RESPONSE_IDS[request.MsgId]
+        self.callback = callback
+        self.attempts = 0
+        self.deadline = None
+
+    def done(self, response):
+        if self.callback is not None:
+            self.callback(self.request, response)
+
+
+class PendingRequests:
+    # write(frame, key) queues a frame, see SerialWriter.send
+    def __init__(self, write, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.write = write
+        self.timeout = timeout
+        self.retries = retries
+        self.max_in_flight = min(max_in_flight, 255)
+        # number requests, only once the firmware echoes sequence numbers
+        self.use_seq = False
+        self.in_flight = []  # oldest first
+        self.backlog = []  # waiting for a free slot
+        self.retry_count = 0
+        self.timeout_count = 0
+        self._last_seq = 0
+
+    def submit(self, request, now, callback=None):
+        """Send ``request``, or queue it while max_in_flight requests are
+        outstanding. ``callback(request, response)`` gets the response, or
+        None when the last retry timed out."""
+        entry = PendingRequest(request, callback)
+        if len(self.in_flight) < self.max_in_flight:
+            self._send(entry, now)
+        else:
+            self.backlog.append(entry)
+        return entry
+
+    def _send(self, entry, now):
+        request = entry.request
+        if isinstance(request, messages.SequencedMessage):
+            request.seq = self._next_seq() if self.use_seq else None
+        self.in_flight.append(entry)
+        self._transmit(entry, now)
+
+    def _transmit(self, entry, now):
+        entry.attempts += 1
+        entry.deadline = now + self.timeout
+        # the entry is the queue key, a retry replaces an attempt still queued
+        self.write(entry.request.serialize(), entry)
+
+    def _next_seq(self):
+        in_use = set(getattr(e.request, 'seq', None) for e in self.in_flight)
+        seq = self._last_seq
+        while True:
+            seq = (seq + 1) & 0xFF
+            if seq not in in_use:
+                self._last_seq = seq
+                return seq
+
+    def _fill(self, now):
+        while self.backlog and len(self.in_flight) < self.max_in_flight:
+            self._send(self.backlog.pop(0), now)
+
+    def complete(self, response, now):
+        """Hand ``response`` to its request. Returns the completed request,
+        None if no request was waiting for it."""
+        seq = getattr(response, 'seq', None)
+        for idx, entry in enumerate(self.in_flight):
+            if entry.response_id != response.MsgId:
+                continue
+            if seq is not None and getattr(entry.request, 'seq', None) != seq:
+                continue
+            del self.in_flight[idx]
+            self._fill(now)
+            entry.done(response)
+            return entry.request
+        return None
+
+    def check_timeouts(self, now):
+        """Resend or give up expired requests. Returns the next deadline,
+        None when nothing is in flight."""
+        for entry in list(self.in_flight):
+            if entry.deadline > now:
+                continue
+            if entry.attempts > self.retries:
+                self.in_flight.remove(entry)
+                self.timeout_count += 1
+                entry.done(None)
+            else:
+                self.retry_count += 1
+                self._transmit(entry, now)
+        self._fill(now)
+        return self.next_deadline()
+
+    def next_deadline(self):
+        if not self.in_flight:
+            return None
+        return min(entry.deadline for entry in self.in_flight)
@@ -0,0 +1,124 @@
+# Outgoing frame queue for the Nevermore Max serial port
+#
+# Frames are written without blocking: whatever the port does not take is
+# kept, and the rest is written once the port is writable again. A frame
+# is never interleaved with another one, so a short write cannot corrupt
+# the stream. The queue is bounded; a frame queued with the key of a frame
+# that is still waiting replaces it, and when the queue is full the oldest
+# waiting frame is dropped. When the port fails for good the frame being
+# written is dropped and the rest wait for the next send instead of the
+# port becoming writable, which a dead port would signal without end.
+
+import errno
+import collections
+
+DEFAULT_MAX_FRAMES = 32
+DEFAULT_MAX_BYTES = 2048
+
+_RETRY_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+class SerialWriter:
+    def __init__(self, write, max_frames=DEFAULT_MAX_FRAMES,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        # write(data) -> bytes written, like os.write on a non-blocking fd
+        self.write = write
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        # called with True when frames are waiting for the port, False when
+        # the queue ran empty
+        self.wants_write = lambda waiting: None
+        # called with the error when a write fails for a reason other than
+        # a full port
+        self.link_lost = lambda error: None
+        self.link_down = False
+        self.queue = collections.deque()  # [key, frame], head may be partly written
+        self.queued_bytes = 0
+        self.offset = 0  # bytes of the head frame already written
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_merged = 0
+        self.frames_dropped = 0
+        self.partial_writes = 0
+        self.write_errors = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def send(self, frame, key=None):
+        """Queue ``frame`` and write as much as the port takes."""
+        if key is not None:
+            # the head frame may be partly written, it has to go out whole
+            for entry in list(self.queue)[1 if self.offset else 0:]:
+                if entry[0] == key:
+                    self.queued_bytes += len(frame) - len(entry[1])
+                    entry[1] = frame
+                    self.frames_merged += 1
+                    return self.flush()
+        self.queue.append([key, frame])
+        self.queued_bytes += len(frame)
+        while (len(self.queue) > 1 and (len(self.queue) > self.max_frames
+                                        or self.queued_bytes > self.max_bytes)):
+            self._drop_oldest()
+        return self.flush()
+
+    def _drop_oldest(self):
+        idx = 1 if self.offset else 0
+        frame = self.queue[idx][1]
+        del self.queue[idx]
+        self.queued_bytes -= len(frame)
+        self.frames_dropped += 1
+
+    def flush(self):
+        """Write queued frames until the port stops taking data. Returns
+        True when the queue is empty."""
+        was_waiting = bool(self.queue)
+        while self.queue:
+            frame = self.queue[0][1]
+            try:
+                written = self.write(memoryview(frame)[self.offset:])
+            except (OSError, IOError) as e:
+                if e.errno not in _RETRY_ERRNOS:
+                    self._write_failed(e)
+                    return False
+                written = 0
+            if not written:
+                break
+            self.link_down = False
+            self.bytes_sent += written
+            self.offset += written
+            if self.offset < len(frame):
+                self.partial_writes += 1
+                break
+            self.queue.popleft()
+            self.queued_bytes -= len(frame)
+            self.offset = 0
+            self.frames_sent += 1
+        if self.queue:
+            self.wants_write(True)
+        elif was_waiting:
+            self.wants_write(False)
+        return not self.queue
+
+    def _write_failed(self, error):
+        self.write_errors += 1
+        self.queued_bytes -= len(self.queue.popleft()[1])
+        self.offset = 0
+        self.frames_dropped += 1
+        self.wants_write(False)
+        if not self.link_down:
+            self.link_down = True
+            self.link_lost(error)
+
+    def get_stats(self):
+        return {
+            'queued_frames': len(self.queue),
+            'queued_bytes': self.queued_bytes,
+            'frames_sent': self.frames_sent,
+            'bytes_sent': self.bytes_sent,
+            'frames_merged': self.frames_merged,
+            'frames_dropped': self.frames_dropped,
+            'partial_writes': self.partial_writes,
+            'write_errors': self.write_errors,
+            'link_down': self.link_down,
+        }
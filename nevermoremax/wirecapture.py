@@ -0,0 +1,330 @@
+# Raw capture of the bytes received from the Nevermore Max controller
+#
+# Every chunk read from the serial port is appended as it arrived, after a
+# CHUNK_HEADER with the wall clock time and the chunk length, so a capture
+# can be replayed through MessageParser exactly as Klipper saw it. Capture
+# files use the header of binlog.py with record size 0 and are written
+# with the same queueing and rotation.
+#
+# The decoder below finds, checks and decodes the frames of a whole capture
+# in bulk with NumPy, without building a Python object per frame. Like the
+# binary log reader it is only needed offline.
+
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .firmware import messages
+from .firmware.crc8 import CRC_8_TABLE
+from .firmware.messagepacket import START_BYTE, META_LEN, HEADER_LEN
+from .csvlog import CsvLogger
+from . import binlog
+
+MAGIC = b"NMXCAP"
+VERSION = 1
+CHUNK_HEADER = struct.Struct("<dI")  # wall time, data length
+
+DEFAULT_QUEUE_SIZE = 4096
+
+
+class WireCapture(binlog.BinaryLogger):
+    def __init__(self, path, queue_size=DEFAULT_QUEUE_SIZE, **kwargs):
+        CsvLogger.__init__(self, path, binlog.FILE_HEADER.pack(MAGIC, VERSION, 0),
+                           queue_size=queue_size, **kwargs)
+
+    def capture(self, wall_time, data):
+        self.log(CHUNK_HEADER.pack(wall_time, len(data)) + bytes(data))
+
+    def _whole_length(self, size):
+        # length of the file up to the end of the last whole chunk
+        pos = len(self.header)
+        with open(self.path, 'rb') as f:
+            while pos + CHUNK_HEADER.size <= size:
+                f.seek(pos)
+                _, length = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+                if pos + CHUNK_HEADER.size + length > size:
+                    break
+                pos += CHUNK_HEADER.size + length
+        return pos
+
+
+def _check_header(path, header):
+    if len(header) < binlog.FILE_HEADER.size:
+        raise ValueError("{}: not a Nevermore Max capture".format(path))
+    magic, version, _ = binlog.FILE_HEADER.unpack_from(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("{}: unsupported capture".format(path))
+
+
+def iter_chunks(path):
+    """Yield (wall time, data) of every chunk in the capture at ``path``,
+    e.g. to replay it through a MessageParser."""
+    with open(path, 'rb') as f:
+        _check_header(path, f.read(binlog.FILE_HEADER.size))
+        while True:
+            header = f.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                return
+            wall_time, length = CHUNK_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return  # cut short by a crash
+            yield wall_time, data
+
+
+def read_capture(path):
+    """Load the capture at ``path``. Returns (data, chunk_ends, chunk_times):
+    all received bytes as one uint8 array, the offset in ``data`` just past
+    each chunk and the wall time the chunk was received."""
+    if np is None:
+        raise ImportError("decoding captures needs numpy")
+    raw = np.memmap(path, dtype=np.uint8, mode='r')
+    _check_header(path, raw[:binlog.FILE_HEADER.size].tobytes())
+    pos = binlog.FILE_HEADER.size
+    starts = []
+    lengths = []
+    times = []
+    while pos + CHUNK_HEADER.size <= len(raw):
+        wall_time, length = CHUNK_HEADER.unpack_from(raw, pos)
+        pos += CHUNK_HEADER.size
+        if pos + length > len(raw):
+            break  # cut short by a crash
+        starts.append(pos)
+        lengths.append(length)
+        times.append(wall_time)
+        pos += length
+    lengths = np.array(lengths, dtype=np.intp)
+    chunk_ends = np.cumsum(lengths)
+    # every data byte of the file, in order, without the chunk headers
+    offsets = np.repeat(np.array(starts, dtype=np.intp) - (chunk_ends - lengths), lengths)
+    data = raw[np.arange(len(offsets)) + offsets]
+    return data, chunk_ends, np.array(times, dtype=np.float64)
+
+
+def find_frames(data):
+    """Offsets and lengths of the valid frames in ``data``, the frames
+    MessageParser would return for the same bytes.
+
+    Every start byte is a candidate frame; the crcs of all candidates are
+    computed together, one byte position at a time."""
+    size = len(data)
+    starts = np.flatnonzero(data[:max(size - META_LEN + 1, 0)] == START_BYTE)
+    lengths = data[starts + 1].astype(np.intp)
+    ok = (lengths >= META_LEN) & (starts + lengths <= size)
+    starts = starts[ok]
+    lengths = lengths[ok]
+
+    # longest candidates first, the ones still running are a prefix
+    order = np.argsort(-lengths, kind='stable')
+    starts = starts[order]
+    lengths = lengths[order]
+    max_len = int(lengths[0]) if len(lengths) else 0
+    running = np.searchsorted(-lengths, -np.arange(max_len), side='left').tolist()
+    table = np.array(CRC_8_TABLE, dtype=np.uint8)
+    crc = np.zeros(len(starts), dtype=np.uint8)
+    for pos, count in enumerate(running):
+        crc[:count] = table[crc[:count] ^ data[starts[:count] + pos]]
+
+    valid = np.flatnonzero(crc == 0)
+    valid = valid[np.argsort(starts[valid])]
+    starts = starts[valid]
+    lengths = lengths[valid]
+    if not len(starts):
+        return starts, lengths
+
+    # the parser continues after a frame, so a frame starting inside an
+    # earlier one is only found when that one was not a frame itself
+    ends = starts + lengths
+    keep = np.ones(len(starts), dtype=bool)
+    keep[1:] = starts[1:] >= np.maximum.accumulate(ends)[:-1]
+    conflicts = np.flatnonzero(~keep)
+    if len(conflicts):
+        # last frame before each conflict that is kept in any case
+        last_clean = np.maximum.accumulate(
+            np.where(keep, np.arange(len(starts)), 0))[conflicts]
+        last = -1  # last kept conflicting frame
+        last_end = 0
+        for idx, clean, start in zip(conflicts.tolist(), last_clean.tolist(),
+                                     starts[conflicts].tolist()):
+            prior_end = last_end if last > clean else int(ends[clean])
+            if start >= prior_end:
+                keep[idx] = True
+                last = idx
+                last_end = int(ends[idx])
+        starts = starts[keep]
+        lengths = lengths[keep]
+    return starts, lengths
+
+
+def _field_layout(fields, payload_len):
+    """NumPy dtype of a payload of ``fields`` (name, code, scale), with the
+    optional timestamp trailer, None if ``payload_len`` matches neither."""
+    names = [name for name, _, _ in fields]
+    fmt = "<" + "".join(code for _, code, _ in fields)
+    size = struct.calcsize(fmt)
+    if payload_len == size + 4:
+        names.append("timestamp_ms")
+        fmt += "I"
+    elif payload_len != size:
+        return None
+    return binlog.struct_dtype(names, fmt)
+
+
+def _v1_fields():
+    codes = messages.SensorReading.StructFormat.lstrip("<")
+    names = messages.SensorReading.__slots__[:messages.SensorReading.ValueCount]
+    return [(name, code, 1) for name, code in zip(names, codes)]
+
+
+def _stats_fields():
+    fields = [("count", "H", 1)] + list(messages.SENSOR_FIELDS)
+    for prefix in ("min_", "max_"):
+        fields += [(prefix + name, code, scale)
+                   for name, code, scale in messages.SENSOR_FIELDS]
+    return fields
+
+
+def _masked_fields(mask):
+    return [("field_mask", "H", 1)] + [
+        field for bit, field in enumerate(messages.SENSOR_FIELDS) if mask & (1 << bit)]
+
+
+def _payloads(data, starts, length, dtype):
+    # payloads of equal length gathered into rows, viewed as records
+    rows = data[(starts + HEADER_LEN)[:, None] + np.arange(length)]
+    return rows.view(dtype).reshape(-1)
+
+
+def _columns(records, fields, frames, msg_id, frame_times):
+    columns = {
+        'frame': frames,
+        'msg_id': np.full(len(records), msg_id, dtype=np.uint8),
+        'time': frame_times[frames],
+        'timestamp_ms': np.full(len(records), np.nan),
+    }
+    if 'timestamp_ms' in records.dtype.names:
+        columns['timestamp_ms'] = records['timestamp_ms'].astype(np.float64)
+    for name, _, scale in fields:
+        if name in _SENSOR_FIELD_NAMES:
+            columns[name] = records[name] / float(scale)
+    return columns
+
+
+_SENSOR_FIELD_NAMES = set(name for name, _, _ in messages.SENSOR_FIELDS)
+
+
+def _decode_fixed(data, starts, payload_lens, frames, frame_times, msg_id, fields_of):
+    parts = []
+    for payload_len in np.unique(payload_lens).tolist():
+        group = payload_lens == payload_len
+        fields = fields_of(payload_len)
+        dtype = _field_layout(fields, payload_len)
+        if dtype is None:
+            continue
+        records = _payloads(data, starts[group], payload_len, dtype)
+        parts.append(_columns(records, fields, frames[group], msg_id, frame_times))
+    return parts
+
+
+def _decode_masked(data, starts, payload_lens, frames, frame_times):
+    parts = []
+    # too short for the mask, the rest of the payload cannot match it either
+    ok = payload_lens >= 2
+    starts, payload_lens, frames = starts[ok], payload_lens[ok], frames[ok]
+    masks = data[starts + HEADER_LEN].astype(np.uint16) | (
+        data[starts + HEADER_LEN + 1].astype(np.uint16) << 8)
+    for mask in np.unique(masks).tolist():
+        group = masks == mask
+        parts += _decode_fixed(
+            data, starts[group], payload_lens[group], frames[group], frame_times,
+            messages.SensorReadingMasked.MsgId, lambda _: _masked_fields(mask))
+    return parts
+
+
+def _decode_batches(data, starts, payload_lens, frames, frame_times):
+    parts = []
+    header = messages.SensorReadingBatch.HeaderStruct
+    sample_fields = [("offset_ms", "H", 1)] + list(messages.SENSOR_FIELDS)
+    sample_dtype = binlog.struct_dtype(
+        [name for name, _, _ in sample_fields],
+        "<" + "".join(code for _, code, _ in sample_fields))
+    ok = payload_lens >= header.size
+    starts, payload_lens, frames = starts[ok], payload_lens[ok], frames[ok]
+    counts = data[starts + HEADER_LEN + 4]
+    for count in np.unique(counts).tolist():
+        group = (counts == count) & (
+            payload_lens == header.size + count * sample_dtype.itemsize)
+        if not count or not group.any():
+            continue
+        dtype = np.dtype([("timestamp_ms", "<u4"), ("count", "u1"),
+                          ("samples", sample_dtype, (count,))])
+        batches = _payloads(data, starts[group], dtype.itemsize, dtype)
+        samples = batches['samples'].reshape(-1)
+        columns = _columns(samples, sample_fields, np.repeat(frames[group], count),
+                           messages.SensorReadingBatch.MsgId, frame_times)
+        columns['timestamp_ms'] = (
+            (batches['timestamp_ms'][:, None].astype(np.int64)
+             + batches['samples']['offset_ms']) & 0xFFFFFFFF
+        ).reshape(-1).astype(np.float64)
+        parts.append(columns)
+    return parts
+
+
+def decode_readings(data, starts, lengths, frame_times=None):
+    """Decode the sensor readings among the frames ``starts``/``lengths``
+    (see find_frames) in bulk.
+
+    Returns a dict of columns, one row per reading and batches expanded to
+    one row per sample, in wire order: 'frame' (index into ``starts``),
+    'msg_id', 'time' (from ``frame_times``, one per frame, NaN without),
+    'timestamp_ms' (device time, NaN where the firmware sent none) and every
+    SENSOR_FIELDS name in engineering units, NaN where the reading did not
+    carry the field. Stats readings give their means."""
+    if np is None:
+        raise ImportError("decoding captures needs numpy")
+    if frame_times is None:
+        frame_times = np.full(len(starts), np.nan)
+    msg_ids = data[starts + 2]
+    payload_lens = lengths - META_LEN
+    frames = np.arange(len(starts))
+
+    parts = []
+    for msg_id, fields_of in (
+            (messages.SensorReading.MsgId, lambda _: _v1_fields()),
+            (messages.SensorReadingV2.MsgId, lambda _: list(messages.SENSOR_FIELDS)),
+            (messages.SensorReadingStats.MsgId, lambda _: _stats_fields())):
+        sel = msg_ids == msg_id
+        parts += _decode_fixed(data, starts[sel], payload_lens[sel], frames[sel],
+                               frame_times, msg_id, fields_of)
+    sel = msg_ids == messages.SensorReadingMasked.MsgId
+    parts += _decode_masked(data, starts[sel], payload_lens[sel], frames[sel], frame_times)
+    sel = msg_ids == messages.SensorReadingBatch.MsgId
+    parts += _decode_batches(data, starts[sel], payload_lens[sel], frames[sel], frame_times)
+
+    names = ['frame', 'msg_id', 'time', 'timestamp_ms'] + [
+        name for name, _, _ in messages.SENSOR_FIELDS]
+    columns = {}
+    for name in names:
+        dtype = np.intp if name == 'frame' else np.uint8 if name == 'msg_id' else np.float64
+        columns[name] = np.concatenate(
+            [part.get(name, np.full(len(part['frame']), np.nan)).astype(dtype)
+             for part in parts] or [np.zeros(0, dtype)])
+    order = np.argsort(columns['frame'], kind='stable')
+    return dict((name, values[order]) for name, values in columns.items())
+
+
+def capture_frames(path):
+    """read_capture() and find_frames() in one go. Returns (data, starts,
+    lengths, frame_times), each frame timed by the chunk that completed it."""
+    data, chunk_ends, chunk_times = read_capture(path)
+    starts, lengths = find_frames(data)
+    chunks = np.searchsorted(chunk_ends, starts + lengths, side='left')
+    return data, starts, lengths, chunk_times[chunks]
+
+
+def decode_capture(path):
+    """The readings of the capture at ``path``, see decode_readings()."""
+    return decode_readings(*capture_frames(path))
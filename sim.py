@@ -11,38 +11,133 @@ from nevermoremax.firmware import messages
 from nevermoremax.firmware import sensorssim
 
 
-def received_msg(msg: messagepacket.MessagePacket, ser: serial.Serial):
-    try:
-        if msg.msg_id == messages.VersionRequest.MsgId:
-            _req = messages.VersionRequest.from_message(msg)
-            logging.info(f"Received: {_req}")
-            ser.write(messages.VersionResponse("0.0.1-sim").serialize())
-        elif msg.msg_id == messages.StateChangeRequest.MsgId:
-            _req = messages.StateChangeRequest.from_message(msg)
-            logging.info(f"Received: {_req}")
-            ser.write(messages.StateChangeResponse(_req.state).serialize())
-        else:
-            logging.info(f"ERROR: unhandled message - {msg}")
-    except messages.MessageParseError as e:
-        logging.error(f"Failed to parse msg - {e}")
+def handle_version_request(req: messages.VersionRequest, ser: serial.Serial):
+    logging.info(f"Received: {req}")
+    ser.write(messages.VersionResponse("0.0.10-sim").serialize())
+
+
+def handle_state_change_request(req: messages.StateChangeRequest, ser: serial.Serial):
+    logging.info(f"Received: {req}")
+    ser.write(messages.StateChangeResponse(req.state, seq=req.seq).serialize())
+
+
+reading_format = messages.READING_FORMAT_V1
+
+
+def handle_reading_format_request(
+    req: messages.ReadingFormatRequest, ser: serial.Serial
+):
+    global reading_format
+    logging.info(f"Received: {req}")
+    if req.reading_format in messages.READING_FORMATS:
+        reading_format = req.reading_format
+    ser.write(messages.ReadingFormatResponse(reading_format, seq=req.seq).serialize())
+
+
+field_mask = None
+
+
+def handle_field_mask_request(req: messages.FieldMaskRequest, ser: serial.Serial):
+    global field_mask
+    logging.info(f"Received: {req}")
+    field_mask = req.field_mask & messages.FIELDS_ALL
+    ser.write(messages.FieldMaskResponse(field_mask, seq=req.seq).serialize())
+
+
+report_filter = messages.ReportFilter()
+
+
+def handle_report_policy_request(req: messages.ReportPolicyRequest, ser: serial.Serial):
+    logging.info(f"Received: {req}")
+    report_filter.set_policy(req)
+    ser.write(
+        messages.ReportPolicyResponse(
+            req.max_silence_ms, req.deadbands, seq=req.seq
+        ).serialize()
+    )
+
+
+sample_period_s = 1.0
+
+
+def handle_sample_rate_request(req: messages.SampleRateRequest, ser: serial.Serial):
+    global sample_period_s
+    logging.info(f"Received: {req}")
+    period_ms = min(
+        max(req.period_ms, messages.MIN_SAMPLE_PERIOD_MS),
+        messages.MAX_SAMPLE_PERIOD_MS,
+    )
+    sample_period_s = period_ms / 1000
+    batcher.size = messages.batch_size(period_ms)
+    ser.write(messages.SampleRateResponse(period_ms, seq=req.seq).serialize())
+
+
+timestamps = False
+
+
+def handle_time_sync_request(req: messages.TimeSyncRequest, ser: serial.Serial):
+    global timestamps
+    # hosts that sync the clock also parse the reading timestamps
+    timestamps = True
+    ser.write(
+        messages.TimeSyncResponse(req.seq, int(time.monotonic() * 1000)).serialize()
+    )
+
+
+# one reading per frame until the host sets a short sample period
+batcher = messages.ReadingBatcher(1, messages.BATCH_INTERVAL_MS)
 
 
 def main(port):
     ser = serial.Serial(port, 115200, timeout=0.1)
     sensors = sensorssim.SimSensors()
-    parser = messagepacket.MessageParser()
+    parser = messagepacket.MessageParser(frame_lengths=messages.FRAME_LENGTHS)
+    dispatcher = messages.Dispatcher()
+    dispatcher.register(messages.VersionRequest, handle_version_request)
+    dispatcher.register(messages.StateChangeRequest, handle_state_change_request)
+    dispatcher.register(messages.ReadingFormatRequest, handle_reading_format_request)
+    dispatcher.register(messages.FieldMaskRequest, handle_field_mask_request)
+    dispatcher.register(messages.ReportPolicyRequest, handle_report_policy_request)
+    dispatcher.register(messages.SampleRateRequest, handle_sample_rate_request)
+    dispatcher.register(messages.TimeSyncRequest, handle_time_sync_request)
+
+    aggregator = messages.ReadingAggregator()
 
     t_last = time.monotonic()
     while True:
         parser.append(ser.read(1))
         now = time.monotonic()
-        if (now - t_last) > 1:
+        stats = field_mask is None and reading_format == messages.READING_FORMAT_STATS
+        if stats:
+            # oversample at the read timeout between reports
+            aggregator.add(messages.SensorReading(*sensors.sample().data()))
+        if (now - t_last) > sample_period_s:
             t_last = now
-            msg = messages.SensorReading(*sensors.sample().data())
-            ser.write(msg.serialize())
+            data = sensors.sample().data()
+            if field_mask is not None:
+                msg = messages.SensorReadingMasked(field_mask, *data)
+            elif stats:
+                msg = aggregator.peek()
+            else:
+                msg = messages.READING_FORMATS[reading_format](*data)
+            now_ms = int(now * 1000)
+            if timestamps:
+                msg.timestamp_ms = now_ms
+            reported = report_filter.should_report(msg, now_ms)
+            if reported and stats:
+                # a dropped report's values go into the next one
+                aggregator.clear()
+            if not reported:
+                msg = batcher.poll(now_ms)
+            elif batcher.size > 1 and field_mask is None and not stats:
+                msg = batcher.add(msg, now_ms)
+            elif len(batcher):
+                ser.write(batcher.flush().serialize())
+            if msg:
+                ser.write(msg.serialize())
         msg, _ = parser.parse()
         if msg:
-            received_msg(msg, ser)
+            dispatcher.dispatch(msg, ser)
 
 
 def setup_logging():
@@ -59,6 +154,10 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("serial_port")
+    parser.add_argument(
+        "--sample-period", type=float, default=1.0, help="seconds between samples"
+    )
     args = parser.parse_args()
 
+    sample_period_s = args.sample_period
     main(args.serial_port)
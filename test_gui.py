@@ -170,92 +170,102 @@ def plot_data(data: deque, val):
     return [list(x[0] for x in data), list(x[1] for x in data)]
 
 
-def received_msg(msg: messagepacket.MessagePacket):
-    try:
-        if msg.msg_id == messages.VersionResponse.MsgId:
-            resp = messages.VersionResponse.from_message(msg)
-            dpg.set_value(VERSION_TAG, resp.version)
-        elif msg.msg_id == messages.StateChangeResponse.MsgId:
-            resp = messages.StateChangeResponse.from_message(msg)
-            logging.info(f"Received: {resp}")
-        elif msg.msg_id == messages.SensorReading.MsgId:
-            sensor_data = messages.SensorReading.from_message(msg)
-            logging.info(f"GOT SENSOR: {sensor_data}")
-            global in_dht_temp_data, out_dht_temp_data, in_bme_temp_data, out_bme_temp_data, humidity_data
-            dpg.set_value(
-                IN_DHT_TEMP_SERIES_TAG,
-                plot_data(in_dht_temp_data, sensor_data.in_dht_temp_C),
-            )
-            dpg.set_value(
-                OUT_DHT_TEMP_SERIES_TAG,
-                plot_data(out_dht_temp_data, sensor_data.out_dht_temp_C),
-            )
-            dpg.set_value(
-                IN_BME_TEMP_SERIES_TAG,
-                plot_data(in_bme_temp_data, sensor_data.in_bme_temp_C),
-            )
-            dpg.set_value(
-                OUT_BME_TEMP_SERIES_TAG,
-                plot_data(out_bme_temp_data, sensor_data.out_bme_temp_C),
-            )
-            dpg.fit_axis_data(TEMPERATURE_TIME_TAG)
-            dpg.fit_axis_data(TEMPERATURE_VALUE_TAG)
+def handle_version_response(resp: messages.VersionResponse):
+    dpg.set_value(VERSION_TAG, resp.version)
 
-            dpg.set_value(
-                IN_DHT_HUMIDITY_SERIES_TAG,
-                plot_data(in_dht_humidity_data, sensor_data.in_dht_humidity_rh),
-            )
-            dpg.set_value(
-                OUT_DHT_HUMIDITY_SERIES_TAG,
-                plot_data(out_dht_humidity_data, sensor_data.out_dht_humidity_rh),
-            )
-            dpg.set_value(
-                IN_BME_HUMIDITY_SERIES_TAG,
-                plot_data(in_bme_humidity_data, sensor_data.in_bme_humidity_rh),
-            )
-            dpg.set_value(
-                OUT_BME_HUMIDITY_SERIES_TAG,
-                plot_data(out_bme_humidity_data, sensor_data.out_bme_humidity_rh),
-            )
-            dpg.fit_axis_data(HUMIDITY_TIME_TAG)
-            dpg.fit_axis_data(HUMIDITY_VALUE_TAG)
 
-            dpg.set_value(
-                IN_PRESSURE_SERIES_TAG,
-                plot_data(in_pressure_data, sensor_data.in_bme_pressure_hPa),
-            )
-            dpg.set_value(
-                OUT_PRESSURE_SERIES_TAG,
-                plot_data(out_pressure_data, sensor_data.out_bme_pressure_hPa),
-            )
-            dpg.fit_axis_data(PRESSURE_TIME_TAG)
-            dpg.fit_axis_data(PRESSURE_VALUE_TAG)
+def handle_state_change_response(resp: messages.StateChangeResponse):
+    logging.info(f"Received: {resp}")
 
-            dpg.set_value(
-                IN_CO2_SERIES_TAG,
-                plot_data(in_co2_data, sensor_data.in_sgp_eCO2),
-            )
-            dpg.set_value(
-                OUT_CO2_SERIES_TAG,
-                plot_data(out_co2_data, sensor_data.out_sgp_eCO2),
-            )
-            dpg.fit_axis_data(CO2_TIME_TAG)
-            dpg.fit_axis_data(CO2_VALUE_TAG)
 
-            dpg.set_value(
-                IN_TVOC_SERIES_TAG,
-                plot_data(in_tvoc_data, sensor_data.in_sgp_TVOC),
-            )
-            dpg.set_value(
-                OUT_TVOC_SERIES_TAG,
-                plot_data(out_tvoc_data, sensor_data.out_sgp_TVOC),
-            )
-            dpg.fit_axis_data(TVOC_TIME_TAG)
-            dpg.fit_axis_data(TVOC_VALUE_TAG)
-        else:
-            logging.error(f"Unhandled: {msg}")
-    except messages.MessageParseError as e:
-        logging.error(f"Failed to parse msg - {e}")
+def handle_sensor_reading(sensor_data: messages.SensorReading):
+    logging.info(f"GOT SENSOR: {sensor_data}")
+    global in_dht_temp_data, out_dht_temp_data, in_bme_temp_data, out_bme_temp_data, humidity_data
+    dpg.set_value(
+        IN_DHT_TEMP_SERIES_TAG,
+        plot_data(in_dht_temp_data, sensor_data.in_dht_temp_C),
+    )
+    dpg.set_value(
+        OUT_DHT_TEMP_SERIES_TAG,
+        plot_data(out_dht_temp_data, sensor_data.out_dht_temp_C),
+    )
+    dpg.set_value(
+        IN_BME_TEMP_SERIES_TAG,
+        plot_data(in_bme_temp_data, sensor_data.in_bme_temp_C),
+    )
+    dpg.set_value(
+        OUT_BME_TEMP_SERIES_TAG,
+        plot_data(out_bme_temp_data, sensor_data.out_bme_temp_C),
+    )
+    dpg.fit_axis_data(TEMPERATURE_TIME_TAG)
+    dpg.fit_axis_data(TEMPERATURE_VALUE_TAG)
+
+    dpg.set_value(
+        IN_DHT_HUMIDITY_SERIES_TAG,
+        plot_data(in_dht_humidity_data, sensor_data.in_dht_humidity_rh),
+    )
+    dpg.set_value(
+        OUT_DHT_HUMIDITY_SERIES_TAG,
+        plot_data(out_dht_humidity_data, sensor_data.out_dht_humidity_rh),
+    )
+    dpg.set_value(
+        IN_BME_HUMIDITY_SERIES_TAG,
+        plot_data(in_bme_humidity_data, sensor_data.in_bme_humidity_rh),
+    )
+    dpg.set_value(
+        OUT_BME_HUMIDITY_SERIES_TAG,
+        plot_data(out_bme_humidity_data, sensor_data.out_bme_humidity_rh),
+    )
+    dpg.fit_axis_data(HUMIDITY_TIME_TAG)
+    dpg.fit_axis_data(HUMIDITY_VALUE_TAG)
+
+    dpg.set_value(
+        IN_PRESSURE_SERIES_TAG,
+        plot_data(in_pressure_data, sensor_data.in_bme_pressure_hPa),
+    )
+    dpg.set_value(
+        OUT_PRESSURE_SERIES_TAG,
+        plot_data(out_pressure_data, sensor_data.out_bme_pressure_hPa),
+    )
+    dpg.fit_axis_data(PRESSURE_TIME_TAG)
+    dpg.fit_axis_data(PRESSURE_VALUE_TAG)
+
+    dpg.set_value(
+        IN_CO2_SERIES_TAG,
+        plot_data(in_co2_data, sensor_data.in_sgp_eCO2),
+    )
+    dpg.set_value(
+        OUT_CO2_SERIES_TAG,
+        plot_data(out_co2_data, sensor_data.out_sgp_eCO2),
+    )
+    dpg.fit_axis_data(CO2_TIME_TAG)
+    dpg.fit_axis_data(CO2_VALUE_TAG)
+
+    dpg.set_value(
+        IN_TVOC_SERIES_TAG,
+        plot_data(in_tvoc_data, sensor_data.in_sgp_TVOC),
+    )
+    dpg.set_value(
+        OUT_TVOC_SERIES_TAG,
+        plot_data(out_tvoc_data, sensor_data.out_sgp_TVOC),
+    )
+    dpg.fit_axis_data(TVOC_TIME_TAG)
+    dpg.fit_axis_data(TVOC_VALUE_TAG)
+
+
+def handle_sensor_reading_batch(batch: messages.SensorReadingBatch):
+    for reading in batch.readings:
+        handle_sensor_reading(reading)
+
+
+dispatcher = messages.Dispatcher()
+dispatcher.register(messages.VersionResponse, handle_version_response)
+dispatcher.register(messages.StateChangeResponse, handle_state_change_response)
+dispatcher.register(messages.SensorReading, handle_sensor_reading)
+dispatcher.register(messages.SensorReadingV2, handle_sensor_reading)
+dispatcher.register(messages.SensorReadingMasked, handle_sensor_reading)
+dispatcher.register(messages.SensorReadingStats, handle_sensor_reading)
+dispatcher.register(messages.SensorReadingBatch, handle_sensor_reading_batch)
 
 
 def main():
@@ -274,7 +284,7 @@ def main():
             close_serial()
         msg, _ = parser.parse()
         if msg:
-            received_msg(msg)
+            dispatcher.dispatch(msg)
 
     with dpg.window(label="Example Window", tag="Primary Window"):
         with dpg.group(horizontal=True):
@@ -0,0 +1,205 @@
+"""Stand-ins for the Klipper objects NevermoreMaxController uses.
+
+The serial port is replaced by ``FakeSerial``: frames the controller writes
+go into a pipe and are parsed back by ``Harness.sent()``, received bytes are
+queued with ``Harness.receive()``. Time only moves with ``Harness.advance()``,
+which runs the reactor timers that came due.
+"""
+
+import os
+import select
+
+import nevermoremax
+from nevermoremax.firmware import messagepacket
+from nevermoremax.firmware import messages
+
+
+class ConfigError(Exception):
+    pass
+
+
+class FakeConfig(object):
+    error = ConfigError
+
+    def __init__(self, printer, options):
+        self.printer = printer
+        self.options = options
+
+    def get_printer(self):
+        return self.printer
+
+    def get_name(self):
+        return "nevermoremax"
+
+    def get(self, name, default=None):
+        return self.options.get(name, default)
+
+    def getboolean(self, name, default=None):
+        return bool(self.options.get(name, default))
+
+    def getint(self, name, default=None, minval=None, maxval=None):
+        return self.options.get(name, default)
+
+    def getfloat(self, name, default=None, minval=None, maxval=None):
+        return self.options.get(name, default)
+
+    def getchoice(self, name, choices, default=None):
+        return choices[self.options.get(name, default)]
+
+
+class FakeTimer(object):
+    def __init__(self, callback, waketime):
+        self.callback = callback
+        self.waketime = waketime
+
+
+class FakeReactor(object):
+    NOW = 0.0
+    NEVER = 9999999999999999.0
+
+    def __init__(self):
+        self.now = 100.0
+        self.timers = []
+        self.write_wake = False
+
+    def monotonic(self):
+        return self.now
+
+    def register_timer(self, callback, waketime=NEVER):
+        timer = FakeTimer(callback, waketime)
+        self.timers.append(timer)
+        return timer
+
+    def update_timer(self, timer, waketime):
+        timer.waketime = waketime
+
+    def register_fd(self, fd, read_callback, write_callback=None):
+        return fd
+
+    def set_fd_wake(self, handle, is_readable=True, is_writeable=False):
+        self.write_wake = is_writeable
+
+    def run_due(self):
+        for timer in self.timers:
+            if timer.waketime <= self.now:
+                timer.waketime = timer.callback(self.now)
+
+
+class FakeGcode(object):
+    def __init__(self):
+        self.commands = {}
+        self.responses = []
+
+    def register_command(self, name, callback, desc=None):
+        self.commands[name] = callback
+
+    def respond_info(self, msg):
+        self.responses.append(msg)
+
+
+class CommandError(Exception):
+    pass
+
+
+class FakeGcmd(object):
+    error = CommandError
+
+    def __init__(self, gcode, params):
+        self.gcode = gcode
+        self.params = params
+
+    def get_int(self, name, default=None, minval=None, maxval=None):
+        return int(self.params.get(name, default))
+
+    def get_float(self, name, default=None, minval=None, maxval=None):
+        return float(self.params.get(name, default))
+
+    def respond_info(self, msg):
+        self.gcode.responses.append(msg)
+
+
+class FakeObject(object):
+    # any other printer object, every method does nothing
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class FakePrinter(object):
+    def __init__(self):
+        self.reactor = FakeReactor()
+        self.gcode = FakeGcode()
+        self.event_handlers = {}
+        self.objects = {"gcode": self.gcode}
+
+    def get_reactor(self):
+        return self.reactor
+
+    def lookup_object(self, name):
+        return self.objects.setdefault(name, FakeObject())
+
+    def register_event_handler(self, event, callback):
+        self.event_handlers.setdefault(event, []).append(callback)
+
+    def get_start_args(self):
+        return {}
+
+
+class FakeSerial(object):
+    def __init__(self, port, baud, timeout=None, write_timeout=None):
+        self.incoming = bytearray()
+        self.read_fd, self.write_fd = os.pipe()
+
+    @property
+    def in_waiting(self):
+        return len(self.incoming)
+
+    def read(self, size):
+        data = bytes(self.incoming[:size])
+        del self.incoming[:size]
+        return data
+
+    def fileno(self):
+        return self.write_fd
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+class Harness(object):
+    def __init__(self, monkeypatch, **options):
+        monkeypatch.setattr(nevermoremax.serial, "Serial", FakeSerial)
+        options.setdefault("serial", "/dev/null")
+        self.printer = FakePrinter()
+        self.reactor = self.printer.reactor
+        self.gcode = self.printer.gcode
+        self.controller = nevermoremax.NevermoreMaxController(
+            FakeConfig(self.printer, options)
+        )
+        self.serial = self.controller.serial
+        self._parser = messagepacket.MessageParser()
+
+    def advance(self, seconds):
+        self.reactor.now += seconds
+        self.reactor.run_due()
+
+    def command(self, name, **params):
+        self.gcode.commands[name](FakeGcmd(self.gcode, params))
+
+    def receive(self, *msgs):
+        """Deliver ``msgs`` in one serial wakeup."""
+        for msg in msgs:
+            self.serial.incoming += msg.serialize()
+        self.controller._serial_data_ready(self.reactor.now)
+
+    def sent(self):
+        """Messages written by the controller since the last call."""
+        while select.select([self.serial.read_fd], [], [], 0)[0]:
+            self._parser.append(os.read(self.serial.read_fd, 4096))
+        return [
+            messages.MESSAGE_TYPES[msg.msg_id].decode(msg.payload)
+            for msg in self._parser.parse_all()
+        ]
+
+    def close(self):
+        self.serial.close()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.binlog`."""
+
+import math
+
+import pytest
+
+from nevermoremax import binlog
+from nevermoremax.firmware import messages
+
+
+def make_reading():
+    reading = messages.SensorReading(*([None] * messages.SensorReading.ValueCount))
+    reading.in_bme_temp_C = 21.5
+    reading.out_bme_temp_C = 35.25
+    reading.in_sgp_TVOC = 120
+    return reading
+
+
+def write_log(path, records):
+    logger = binlog.BinaryLogger(path, max_age=0)
+    logger.start()
+    for record in records:
+        logger.log(record)
+    logger.stop()
+
+
+def test_record_layout():
+    record = binlog.encode_record(1000.5, make_reading())
+    assert len(record) == binlog.RECORD_STRUCT.size == 46
+    values = binlog.RECORD_STRUCT.unpack(record)
+    assert values[0] == 1000.5
+    mask = values[1]
+    assert mask == messages.field_mask(
+        ["in_bme_temp_C", "out_bme_temp_C", "in_sgp_TVOC"]
+    )
+
+
+def test_writer_appends_header_once(tmp_path):
+    path = str(tmp_path / "log.bin")
+    record = binlog.encode_record(1.0, make_reading())
+    write_log(path, [record])
+    write_log(path, [record, record])
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data.startswith(binlog.file_header())
+    assert data.count(binlog.MAGIC) == 1
+    assert len(data) == binlog.FILE_HEADER.size + 3 * len(record)
+
+
+def test_append_after_crash(tmp_path):
+    path = str(tmp_path / "log.bin")
+    first = binlog.encode_record(1.0, make_reading())
+    second = binlog.encode_record(2.0, make_reading())
+    write_log(path, [first])
+    # the writer died halfway through a record
+    with open(path, "ab") as f:
+        f.write(second[:10])
+    write_log(path, [second])
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data == binlog.file_header() + first + second
+
+
+def test_writer_sets_other_files_aside(tmp_path):
+    path = str(tmp_path / "log.bin")
+    with open(path, "wb") as f:
+        f.write(b"time,value\n1,2\n")
+    record = binlog.encode_record(1.0, make_reading())
+    write_log(path, [record])
+    with open(path, "rb") as f:
+        assert f.read() == binlog.file_header() + record
+    with open(path + ".bad", "rb") as f:
+        assert f.read() == b"time,value\n1,2\n"
+
+
+def test_reader_scales_and_masks(tmp_path):
+    np = pytest.importorskip("numpy")
+    path = str(tmp_path / "log.bin")
+    write_log(path, [binlog.encode_record(t, make_reading()) for t in (1.0, 2.0)])
+    # a record cut short by a crash is ignored
+    with open(path, "ab") as f:
+        f.write(b"\0" * 10)
+    records = binlog.read_log(path)
+    assert len(records) == 2
+    columns = binlog.scaled(records)
+    assert list(columns["time"]) == [1.0, 2.0]
+    assert np.allclose(columns["in_bme_temp_C"], 21.5)
+    assert np.allclose(columns["out_bme_temp_C"], 35.25)
+    assert np.allclose(columns["in_sgp_TVOC"], 120)
+    assert all(math.isnan(v) for v in columns["out_sgp_TVOC"])
+
+
+def test_reader_rejects_other_files(tmp_path):
+    pytest.importorskip("numpy")
+    path = tmp_path / "log.csv"
+    path.write_text("time,value\n1,2\n")
+    with pytest.raises(ValueError):
+        binlog.read_log(str(path))
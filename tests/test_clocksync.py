@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.clocksync`."""
+
+import pytest
+
+from nevermoremax.clocksync import ClockSync, DEVICE_MS_WRAP
+
+
+def ping(sync, device_s, offset, rate, rtt, rtt_split=0.5):
+    # the device reads its clock rtt_split of the way through the round trip
+    host = offset + device_s * rate
+    send_time = host - rtt * rtt_split
+    sync.add_sample(send_time, send_time + rtt, int(device_s * 1000) % DEVICE_MS_WRAP)
+
+
+def test_offset_and_drift():
+    sync = ClockSync()
+    assert not sync.is_synced()
+    for i in range(16):
+        ping(
+            sync,
+            100.0 + i * 10.0,
+            5000.0,
+            1.0001,
+            0.004,
+            rtt_split=0.25 + 0.05 * (i % 3),
+        )
+    assert sync.is_synced()
+    assert sync.drift_ppm() == pytest.approx(100.0, abs=10.0)
+    true_time = 5000.0 + 250.0 * 1.0001
+    assert abs(sync.host_time(250000) - true_time) <= sync.error
+    assert sync.error <= 0.004
+
+
+def test_slow_round_trips_ignored():
+    sync = ClockSync()
+    for i in range(8):
+        ping(sync, i * 1.0, 10.0, 1.0, 0.5 if i % 2 else 0.002, rtt_split=0.9)
+    assert sync.host_time(3500) == pytest.approx(13.5, abs=0.002)
+
+
+def test_wrap_and_restart():
+    sync = ClockSync()
+    start = (DEVICE_MS_WRAP - 2000) / 1000.0
+    for i in range(4):
+        ping(sync, start + i, 0.0, 1.0, 0.002)
+    # device time 1.0 s past the wrap
+    assert sync.host_time(1000) == pytest.approx(start + 3.0, abs=0.002)
+
+    # the device restarted, its clock is back near zero
+    sync.add_sample(100.0, 100.002, 500)
+    assert len(sync.samples) == 1
+    assert sync.host_time(1500) == pytest.approx(101.001)
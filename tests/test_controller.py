@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.NevermoreMaxController`."""
+
+import pytest
+
+from nevermoremax.firmware import messages
+from tests.fakeklippy import Harness
+
+
+@pytest.fixture
+def harness(monkeypatch):
+    harness = Harness(monkeypatch)
+    yield harness
+    harness.close()
+
+
+def sent_states(harness):
+    return [
+        msg.state
+        for msg in harness.sent()
+        if isinstance(msg, messages.StateChangeRequest)
+    ]
+
+
+def test_state_requests_coalesce(harness):
+    for state in (1, 2, 3):
+        harness.command("SET_NEVERMORE_MAX_STATE", STATE=state)
+    # the first state goes out at once, the others wait for its answer
+    assert sent_states(harness) == [1]
+    harness.receive(messages.StateChangeResponse(1))
+    harness.advance(0.05)
+    assert sent_states(harness) == []
+    # only the latest state once state_coalesce_time passed
+    harness.advance(0.05)
+    assert sent_states(harness) == [3]
+    harness.receive(messages.StateChangeResponse(3))
+    harness.advance(1.0)
+    assert sent_states(harness) == []
+    assert harness.controller.get_status(harness.reactor.now)["state"] == 3
+
+
+def test_state_ack_clears_pending(harness):
+    harness.command("SET_NEVERMORE_MAX_STATE", STATE=4)
+    assert sent_states(harness) == [4]
+    status = harness.controller.get_status(harness.reactor.now)
+    assert status["state"] is None and status["requested_state"] == 4
+    assert harness.controller.state_in_flight
+
+    harness.receive(messages.StateChangeResponse(4))
+    assert not harness.controller.state_in_flight
+    assert not harness.controller.pending.in_flight
+    assert harness.controller.get_status(harness.reactor.now)["state"] == 4
+    # the same state again is not sent
+    harness.command("SET_NEVERMORE_MAX_STATE", STATE=4)
+    harness.advance(1.0)
+    assert sent_states(harness) == []
+
+
+def test_state_retry_and_give_up(harness):
+    controller = harness.controller
+    harness.command("SET_NEVERMORE_MAX_STATE", STATE=5)
+    assert sent_states(harness) == [5]
+    for _ in range(controller.pending.retries):
+        harness.advance(controller.pending.timeout)
+        assert sent_states(harness) == [5]
+    harness.advance(controller.pending.timeout)
+    assert sent_states(harness) == []
+    assert not controller.state_in_flight and controller.sent_state is None
+    assert any("did not answer" in msg for msg in harness.gcode.responses)
+    # unknown if it arrived, so the same state is sent again
+    harness.command("SET_NEVERMORE_MAX_STATE", STATE=5)
+    assert sent_states(harness) == [5]
+
+
+def test_state_late_request_after_give_up(harness):
+    controller = harness.controller
+    harness.command("SET_NEVERMORE_MAX_STATE", STATE=5)
+    harness.command("SET_NEVERMORE_MAX_STATE", STATE=6)
+    for _ in range(controller.pending.retries + 1):
+        harness.advance(controller.pending.timeout)
+    # the newer state still goes out after the lost one
+    assert sent_states(harness) == [5, 5, 5, 5, 6]
+
+
+def make_reading(temp_C):
+    return messages.SensorReading(*[temp_C] * messages.SensorReading.ValueCount)
+
+
+def test_burst_keeps_every_reading(harness):
+    controller = harness.controller
+    temps = []
+    controller.setup_intake_temperature_callback(
+        lambda eventtime, measurement: temps.append(measurement["temperature"])
+    )
+    batch = messages.SensorReadingBatch(
+        0, [0, 500], [make_reading(23.0), make_reading(24.0)]
+    )
+    harness.receive(make_reading(20.0), make_reading(21.0), batch)
+    history = controller.history.query(["in_bme_temp_C"], resolution=0.0)
+    assert history["fields"]["in_bme_temp_C"] == [20.0, 21.0, 23.0, 24.0]
+    # the temperature callbacks only see the newest
+    assert temps == [24.0]
+    assert controller.get_status(harness.reactor.now)["intake"]["temp_C"] == 24.0
+
+    controller.latest_reading_only = False
+    harness.receive(make_reading(25.0), make_reading(26.0))
+    assert temps == [24.0, 25.0, 26.0]
+
+
+def sync_clock(harness, device_ms):
+    harness.advance(0.0)
+    sync = [m for m in harness.sent() if isinstance(m, messages.TimeSyncRequest)]
+    assert sync
+    harness.advance(0.01)
+    harness.receive(messages.TimeSyncResponse(sync[-1].seq, device_ms))
+
+
+def test_clock_jump_resets_fit(harness):
+    controller = harness.controller
+    harness.receive(messages.VersionResponse("0.0.10"))
+    sync_clock(harness, 50000)
+    now = harness.reactor.now
+    reading = make_reading(20.0)
+    reading.timestamp_ms = 50000
+    assert controller._sample_time(reading, now) == pytest.approx(now - 0.005)
+
+    # the device restarted, its clock went backwards
+    reading.timestamp_ms = 1000
+    assert controller._sample_time(reading, now) == now
+    assert not controller.clock_sync.is_synced()
+    sync_clock(harness, 1000)
+    now = harness.reactor.now
+    assert controller._sample_time(reading, now) == pytest.approx(now - 0.005)
+
+    # far ahead of the receive time
+    reading.timestamp_ms = 5000
+    assert controller._sample_time(reading, now) == now
+    assert not controller.clock_sync.is_synced()
+
+
+def test_status_scheduler_changes(harness):
+    controller = harness.controller
+    harness.receive(
+        messages.SchedulerDiagnostics([messages.TaskStats(0, 1, 0, 0, 5, 2)])
+    )
+    before = controller.get_status(harness.reactor.now)["scheduler"]
+    harness.receive(
+        messages.SchedulerDiagnostics([messages.TaskStats(0, 2, 0, 0, 7, 3)])
+    )
+    after = controller.get_status(harness.reactor.now)["scheduler"]
+    # Klipper only pushes status values that compare unequal to the last
+    assert before != after
+
+
+def test_sample_rate_above_sensor_refresh(harness):
+    harness.receive(messages.SampleRateResponse(1000))
+    assert harness.gcode.responses[-1] == "Nevermore Max Sample Rate: 1.000 Hz"
+    harness.receive(messages.SampleRateResponse(100))
+    assert "repeat" in harness.gcode.responses[-1]
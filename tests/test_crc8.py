@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.firmware.crc8`."""
+
+import os
+
+from nevermoremax.firmware import crc8
+from nevermoremax.firmware import messagepacket
+
+
+IMPLEMENTATIONS = [crc8.calc_crc8, crc8.calc_crc8_table]
+
+
+def test_known_value():
+    # CRC-8/SMBUS check value
+    for impl in IMPLEMENTATIONS:
+        assert impl(b"123456789") == 0xF4
+
+
+def test_matches_reference():
+    for data_len in range(0, 300):
+        data = bytearray(os.urandom(data_len))
+        expected = crc8.calc_crc8_reference(data)
+        for impl in IMPLEMENTATIONS:
+            assert impl(bytes(data)) == expected
+            assert impl(memoryview(data)) == expected
+
+
+def test_incremental():
+    data = bytearray(os.urandom(100))
+    expected = crc8.calc_crc8_reference(data)
+    for impl in IMPLEMENTATIONS:
+        crc = 0
+        for idx in range(0, len(data), 7):
+            crc = impl(data[idx : idx + 7], crc)
+        assert crc == expected
+
+    running = crc8.Crc8()
+    for idx in range(0, len(data), 33):
+        running.update(data[idx : idx + 33])
+    assert running.crc == expected
+
+
+def test_frame_crc_is_zero():
+    frame = messagepacket.MessagePacket(0x42, os.urandom(40)).serialize()
+    assert crc8.calc_crc8(frame) == 0
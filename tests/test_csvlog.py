@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.csvlog`."""
+
+import os
+
+from nevermoremax.csvlog import CsvLogger
+
+HEADER = ["time", "value"]
+
+
+def read_rows(path):
+    with open(path) as f:
+        return [line.strip() for line in f]
+
+
+def test_append_across_restarts(tmp_path):
+    path = str(tmp_path / "log.csv")
+    for run in range(2):
+        logger = CsvLogger(path, HEADER, max_age=0)
+        logger.start()
+        logger.log([1000.0 + run, run])
+        logger.stop()
+        assert logger.written_rows == 1
+    assert read_rows(path) == ["time,value", "1000.0,0", "1001.0,1"]
+
+
+def test_drop_oldest(tmp_path):
+    path = str(tmp_path / "log.csv")
+    logger = CsvLogger(path, HEADER, queue_size=3, batch_rows=100)
+    for idx in range(5):
+        logger.log([idx, idx])
+    assert logger.dropped_rows == 2
+    logger.start()
+    logger.stop()
+    assert read_rows(path)[1:] == ["2,2", "3,3", "4,4"]
+
+
+def test_rotate_by_size(tmp_path):
+    path = str(tmp_path / "log.csv")
+    logger = CsvLogger(path, HEADER, batch_rows=1, max_bytes=20, backup_count=2)
+    for idx in range(12):
+        logger.log([idx, "x" * 10])
+    logger.start()
+    logger.stop()
+    assert logger.rotations == 1
+    assert os.path.exists(path + ".1")
+    assert read_rows(path) == ["time,value"]
+
+
+def test_rotate_by_age(tmp_path):
+    path = str(tmp_path / "log.csv")
+    with open(path, "w") as f:
+        f.write("time,value\n100.0,1\n")
+    logger = CsvLogger(path, HEADER, max_age=3600.0)
+    logger.start()
+    logger.stop()
+    assert read_rows(path + ".1") == ["time,value", "100.0,1"]
+    assert read_rows(path) == ["time,value"]
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.history`."""
+
+import pytest
+
+from nevermoremax.firmware import messages
+from nevermoremax.history import History, HistorySubscription, FIELDS
+
+
+def make_reading(temp_C, cls=messages.SensorReading):
+    reading = cls(*([None] * messages.SensorReading.ValueCount))
+    reading.in_bme_temp_C = temp_C
+    return reading
+
+
+def test_raw_ring_keeps_latest():
+    history = History(tiers=((0.0, 4), (10.0, 4)))
+    for second in range(6):
+        history.add(float(second), make_reading(20.0 + second))
+    result = history.query(["in_bme_temp_C", "out_bme_temp_C"], resolution=0.0)
+    assert result["time"] == [2.0, 3.0, 4.0, 5.0]
+    assert result["fields"]["in_bme_temp_C"] == [22.0, 23.0, 24.0, 25.0]
+    assert result["fields"]["out_bme_temp_C"] == [None] * 4
+    assert history.query(["in_bme_temp_C"], 3.0, 5.0, resolution=0.0)["time"] == [
+        3.0,
+        4.0,
+    ]
+
+
+def test_buckets_min_mean_max():
+    history = History(tiers=((0.0, 4), (10.0, 4)))
+    for second, temp_C in ((1, 20.0), (5, 24.0), (9, 22.0), (12, 30.0)):
+        history.add(float(second), make_reading(temp_C))
+    result = history.query(["in_bme_temp_C"], resolution=10.0)
+    assert result["time"] == [0.0, 10.0]
+    assert result["count"] == [3, 1]
+    temp = result["fields"]["in_bme_temp_C"]
+    assert temp["min"] == [20.0, 30.0]
+    assert temp["mean"] == [22.0, 30.0]
+    assert temp["max"] == [24.0, 30.0]
+
+
+def test_stats_readings_weighted():
+    history = History(tiers=((0.0, 4), (10.0, 4)))
+    stats = messages.SensorReadingStats(
+        3, make_reading(18.0), make_reading(26.0), *([None] * 18)
+    )
+    stats.in_bme_temp_C = 20.0
+    history.add(1.0, stats)
+    history.add(2.0, make_reading(24.0))
+    temp = history.query(["in_bme_temp_C"], resolution=10.0)["fields"]["in_bme_temp_C"]
+    assert temp == {"min": [18.0], "mean": [21.0], "max": [26.0]}
+
+
+def test_select_tier():
+    history = History(tiers=((0.0, 100), (10.0, 100), (60.0, 100)))
+    for second in range(0, 600, 2):
+        history.add(float(second), make_reading(20.0))
+    # raw readings only reach back 200 s
+    assert history.query(start=450.0)["resolution"] == 0.0
+    assert history.query(start=300.0)["resolution"] == 10.0
+    assert history.query(start=300.0, max_points=10)["resolution"] == 60.0
+    assert history.query()["resolution"] == 60.0
+
+
+def test_bounded_memory():
+    history = History()
+    before = history.nbytes()
+    for second in range(0, 2 * 24 * 3600, 7):
+        history.add(float(second), make_reading(20.0))
+    assert history.nbytes() == before < 400 * 1024
+    day = history.query(["in_bme_temp_C"], start=24 * 3600.0)
+    assert day["resolution"] == 900.0
+    assert len(day["time"]) == 96
+
+
+def test_unknown_field():
+    history = History()
+    with pytest.raises(ValueError):
+        history.query(["nope"])
+    with pytest.raises(ValueError):
+        history.query(FIELDS, resolution=5.0)
+
+
+def test_subscription_raw_deltas():
+    history = History(tiers=((0.0, 8), (10.0, 4)))
+    history.add(1.0, make_reading(20.0))
+    sent = []
+    sub = HistorySubscription(history.tier(0.0), ["in_bme_temp_C"], sent.append)
+    assert sub.push(1.0) and not sent
+    history.add(2.0, make_reading(21.0))
+    # an out of order reading shares the time of the newest one
+    history.add(1.5, make_reading(22.0))
+    sub.push(2.0)
+    assert sent[-1]["time"] == [2.0, 2.0]
+    assert sent[-1]["fields"]["in_bme_temp_C"] == [21.0, 22.0]
+
+
+def test_subscription_bucket_deltas():
+    history = History(tiers=((0.0, 8), (10.0, 4)))
+    history.add(1.0, make_reading(20.0))
+    sent = []
+    sub = HistorySubscription(history.tier(10.0), ["in_bme_temp_C"], sent.append)
+    history.add(5.0, make_reading(30.0))
+    sub.push(5.0)
+    # the open bucket again, with its new mean
+    assert sent[-1]["time"] == [0.0]
+    assert sent[-1]["fields"]["in_bme_temp_C"]["mean"] == [25.0]
+    history.add(12.0, make_reading(40.0))
+    sub.push(12.0)
+    # at most one push per bucket period
+    assert len(sent) == 1
+    sub.push(15.0)
+    assert sent[-1]["time"] == [0.0, 10.0]
+
+
+def test_subscription_client_gone():
+    history = History(tiers=((0.0, 8),))
+    sub = HistorySubscription(history.tier(0.0), ["in_bme_temp_C"], lambda c: False)
+    history.add(1.0, make_reading(20.0))
+    assert not sub.push(1.0)
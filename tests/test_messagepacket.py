@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.firmware.messagepacket`."""
+
+import io
+
+from nevermoremax.firmware import messages
+from nevermoremax.firmware import messagepacket
+
+
+def state_frame(state):
+    return bytes(messages.StateChangeResponse(state).serialize())
+
+
+def parse_states(parser):
+    return [
+        messages.StateChangeResponse.from_message(msg).state
+        for msg in parser.parse_all()
+    ]
+
+
+def test_parse_all():
+    parser = messagepacket.MessageParser()
+    parser.append(state_frame(1))
+    parser.append(b"\x00\x01")
+    parser.append(state_frame(2))
+    parser.append(state_frame(3)[:3])
+    assert parse_states(parser) == [1, 2]
+
+    parser.append(state_frame(3)[3:])
+    assert parse_states(parser) == [3]
+
+
+def test_payload_is_view():
+    parser = messagepacket.MessageParser()
+    parser.append(messages.VersionResponse("1.2.3").serialize())
+    msg, _ = parser.parse()
+    assert isinstance(msg.payload, memoryview)
+    assert msg.payload.tobytes() == b"1.2.3"
+    assert messages.VersionResponse.from_message(msg).version == "1.2.3"
+
+
+def test_resync_after_garbage():
+    parser = messagepacket.MessageParser()
+    garbage = bytes(bytearray([messagepacket.START_BYTE, 0x05, 0x81, 0x00, 0x00]))
+    parser.append(b"\x00" * 1000 + garbage * 50 + state_frame(7))
+    assert parse_states(parser) == [7]
+    assert len(parser) == 0
+
+
+def test_split_frames_across_appends():
+    stream = b"".join(state_frame(i) for i in range(200))
+    parser = messagepacket.MessageParser(capacity=8)
+    states = []
+    for idx in range(0, len(stream), 3):
+        parser.append(stream[idx : idx + 3])
+        states.extend(parse_states(parser))
+    assert states == list(range(200))
+
+
+def test_large_append_grows_buffer():
+    stream = b"".join(state_frame(i) for i in range(100))
+    parser = messagepacket.MessageParser(capacity=16)
+    parser.append(stream)
+    assert parse_states(parser) == list(range(100))
+
+
+def test_readinto_fixed_buffer():
+    stream = io.BytesIO(b"".join(state_frame(i) for i in range(100)))
+    parser = messagepacket.MessageParser(capacity=16)
+    buf = parser._buf
+    states = []
+    while parser.readinto(stream, 7):
+        states.extend(parse_states(parser))
+    assert states == list(range(100))
+    # compacted in place, never reallocated
+    assert parser._buf is buf
+
+
+def test_frame_writer():
+    out = io.BytesIO()
+    writer = messagepacket.FrameWriter(out)
+    writer.write(messages.StateChangeResponse(1))
+    writer.write(messages.VersionResponse("1.2.3"))
+    writer.write(messages.StateChangeResponse(2))
+    assert out.getvalue() == (
+        state_frame(1) + messages.VersionResponse("1.2.3").serialize() + state_frame(2)
+    )
+
+
+def test_link_counters():
+    parser = messagepacket.MessageParser()
+    bad_crc = bytearray(state_frame(1))
+    bad_crc[-1] ^= 0xFF
+    bad_len = bytes(bytearray([messagepacket.START_BYTE, 0x02]))
+    data = b"xyz" + bytes(bad_crc) + bad_len + state_frame(2)
+    parser.append(data)
+    assert parse_states(parser) == [2]
+    assert parser.bytes_received == len(data)
+    assert parser.frames == 1
+    assert parser.crc_errors == 1
+    assert parser.length_errors == 1
+    # the garbage, the bad frames' start bytes and the rest of the bad crc frame
+    assert parser.discarded_bytes == 3 + len(bad_crc) + len(bad_len)
+    assert parser.resyncs == 3
+
+    dispatcher = messages.Dispatcher()
+    dispatcher.register(messages.StateChangeResponse, lambda msg: None)
+    parser.append(state_frame(3) + state_frame(4))
+    for msg in parser.parse_all():
+        dispatcher.dispatch(msg)
+    assert dispatcher.counts == {messages.StateChangeResponse.MsgId: 2}
+
+
+def test_frame_lengths_reject_early():
+    stray = bytes(bytearray([messagepacket.START_BYTE, 0xF0]))
+    # a stray start byte with a long length, before an unknown and a known id
+    for msg_id in (0x42, messages.StateChangeResponse.MsgId):
+        data = stray + bytes(bytearray([msg_id])) + state_frame(5)
+        parser = messagepacket.MessageParser()
+        parser.append(data)
+        # without lengths the parser waits for 240 bytes
+        assert parse_states(parser) == []
+
+        parser = messagepacket.MessageParser(frame_lengths=messages.FRAME_LENGTHS)
+        parser.append(data)
+        assert parse_states(parser) == [5]
+        assert parser.length_errors == 1
+
+    parser = messagepacket.MessageParser(frame_lengths=messages.FRAME_LENGTHS)
+    batch = messages.SensorReadingBatch(
+        0,
+        [0] * messages.SensorReadingBatch.MaxSamples,
+        [messages.SensorReading(*range(18))] * messages.SensorReadingBatch.MaxSamples,
+    )
+    parser.append(batch.serialize())
+    assert [msg.msg_id for msg in parser.parse_all()] == [batch.MsgId]
@@ -3,6 +3,8 @@
 """Tests for `nevermore_max_controller` package."""
 
 
+import struct
+
 import pytest
 
 
@@ -73,3 +75,560 @@ def test_sensor_reading():
     assert reading_in.out_bme_humidity_rh == reading_out.out_bme_humidity_rh
     assert reading_in.out_bme_pressure_hPa == reading_out.out_bme_pressure_hPa
     assert reading_in.out_bme_altitude_m == reading_out.out_bme_altitude_m
+
+
+def test_serialize_into():
+    reading = messages.SensorReading(*range(1, 19))
+    state = messages.StateChangeRequest(3)
+    version = messages.VersionResponse("1.0")
+
+    buffer = bytearray(256)
+    offset = 5
+    for msg in (reading, state, version):
+        frame_len = msg.serialize_into(buffer, offset)
+        assert frame_len == msg.frame_length()
+        assert bytes(buffer[offset : offset + frame_len]) == bytes(msg.serialize())
+        offset += frame_len
+
+    parser = messagepacket.MessageParser()
+    parser.append(buffer)
+    msgs = list(parser.parse_all())
+    assert [msg.msg_id for msg in msgs] == [
+        messages.SensorReading.MsgId,
+        messages.StateChangeRequest.MsgId,
+        messages.VersionResponse.MsgId,
+    ]
+    assert messages.SensorReading.from_message(msgs[0]).out_bme_altitude_m == 18
+
+
+def test_messages_have_no_dict():
+    reading = messages.SensorReading(*range(1, 19))
+    with pytest.raises(AttributeError):
+        reading.not_a_field = 1
+
+
+def test_message_types_registry():
+    for msg_cls in (
+        messages.VersionRequest,
+        messages.VersionResponse,
+        messages.StateChangeRequest,
+        messages.StateChangeResponse,
+        messages.SensorReading,
+    ):
+        assert messages.MESSAGE_TYPES[msg_cls.MsgId] is msg_cls
+
+
+def test_dispatcher():
+    received = []
+    dispatcher = messages.Dispatcher()
+    dispatcher.register(
+        messages.StateChangeResponse, lambda msg, tag: received.append((msg.state, tag))
+    )
+
+    decoded = dispatcher.dispatch(
+        parse_msg(messages.StateChangeResponse(7).serialize()), "a"
+    )
+    assert decoded.state == 7
+    assert received == [(7, "a")]
+
+    assert dispatcher.dispatch(parse_msg(messages.VersionRequest().serialize())) is None
+    assert dispatcher.unknown_count == 1
+
+    bad_length = messagepacket.MessagePacket(messages.StateChangeResponse.MsgId, b"")
+    assert dispatcher.dispatch(parse_msg(bad_length.serialize())) is None
+    assert dispatcher.decode_error_count == 1
+    assert len(received) == 1
+
+    # a valid frame whose payload the codec chokes on
+    dispatcher.register(messages.VersionResponse, received.append)
+    bad_version = messagepacket.MessagePacket(messages.VersionResponse.MsgId, b"\xff")
+    assert dispatcher.dispatch(parse_msg(bad_version.serialize())) is None
+    assert dispatcher.decode_error_count == 2
+
+    class Short(object):
+        MsgId = 0x42
+
+        @staticmethod
+        def decode(payload):
+            return struct.unpack_from("<I", payload)
+
+    dispatcher.register(Short, received.append)
+    short = messagepacket.MessagePacket(Short.MsgId, b"\x01")
+    assert dispatcher.dispatch(parse_msg(short.serialize())) is None
+    assert dispatcher.decode_error_count == 3
+    assert len(received) == 1
+
+
+def test_sensor_reading_batch():
+    readings = [
+        messages.SensorReading(
+            21.3 + idx,
+            45.1,
+            400,
+            12,
+            22.51,
+            123456,
+            43.27,
+            1001.5,
+            0,
+            -1,
+            -1,
+            410,
+            15,
+            23.07,
+            98765,
+            41.11,
+            998.24,
+            0,
+        )
+        for idx in range(messages.SensorReadingBatch.MaxSamples)
+    ]
+    offsets_ms = [100 * idx for idx in range(len(readings))]
+    batch_in = messages.SensorReadingBatch(123456789, offsets_ms, readings)
+    frame = batch_in.serialize()
+    assert len(frame) <= messagepacket.MAX_MSG_LEN
+
+    batch_out = messages.SensorReadingBatch.from_message(parse_msg(frame))
+    assert batch_out.timestamp_ms == 123456789
+    assert batch_out.offsets_ms == offsets_ms
+    for reading_in, reading_out in zip(readings, batch_out.readings):
+        assert reading_out.in_dht_temp_C == pytest.approx(reading_in.in_dht_temp_C)
+        assert reading_out.in_dht_humidity_rh == pytest.approx(45.1)
+        assert reading_out.in_sgp_eCO2 == 400
+        assert reading_out.in_sgp_TVOC == 12
+        assert reading_out.in_bme_temp_C == pytest.approx(22.51)
+        assert reading_out.in_bme_gas == 123456
+        assert reading_out.in_bme_humidity_rh == pytest.approx(43.27)
+        assert reading_out.in_bme_pressure_hPa == pytest.approx(1001.5)
+        assert reading_out.in_bme_altitude_m == pytest.approx(
+            messages.altitude_m(1001.5)
+        )
+        assert reading_out.out_dht_temp_C == -1
+        assert reading_out.out_dht_humidity_rh == -1
+        assert reading_out.out_bme_pressure_hPa == pytest.approx(998.24)
+
+
+def test_sensor_reading_batch_clamps_out_of_range():
+    reading = messages.SensorReading(*([1e9] * 18))
+    batch = messages.SensorReadingBatch(0, [0], [reading])
+    reading_out = messages.SensorReadingBatch.from_message(
+        parse_msg(batch.serialize())
+    ).readings[0]
+    assert reading_out.in_sgp_eCO2 == 65535
+
+
+def test_reading_batcher():
+    batcher = messages.ReadingBatcher(3)
+    reading = messages.SensorReading(*range(1, 19))
+    assert batcher.add(reading, 1000) is None
+    assert batcher.add(reading, 1100) is None
+    batch = batcher.add(reading, 1250)
+    assert batch.timestamp_ms == 1000
+    assert batch.offsets_ms == [0, 100, 250]
+    assert batcher.add(reading, 2000) is None
+    # a sparse batch goes out once its first reading waited long enough
+    assert batcher.poll(2999) is None
+    assert batcher.poll(3000).offsets_ms == [0]
+    assert batcher.poll(4000) is None
+
+
+def test_reading_batcher_span():
+    batcher = messages.ReadingBatcher(3, max_latency_ms=100000)
+    reading = messages.SensorReading(*range(1, 19))
+    # further apart than the uint16 offsets reach
+    assert batcher.add(reading, 0) is None
+    assert batcher.add(reading, 40000) is None
+    batch = batcher.add(reading, 80000)
+    assert batch.offsets_ms == [0, 40000]
+    parse_msg(batch.serialize())
+    batch = batcher.flush()
+    assert (batch.timestamp_ms, batch.offsets_ms) == (80000, [0])
+    assert batcher.flush() is None
+
+
+def test_batch_size():
+    assert messages.batch_size(1000) == 1
+    assert messages.batch_size(messages.BATCH_INTERVAL_MS) == 1
+    assert messages.batch_size(100) == messages.BATCH_INTERVAL_MS // 100
+    assert messages.batch_size(1) == messages.SensorReadingBatch.MaxSamples
+
+
+def test_sensor_reading_v2():
+    reading_in = messages.SensorReadingV2(
+        21.3,
+        45.1,
+        400,
+        12,
+        22.51,
+        123456,
+        43.27,
+        1001.5,
+        0,
+        22.4,
+        46.2,
+        410,
+        15,
+        23.07,
+        98765,
+        41.11,
+        998.24,
+        0,
+    )
+    frame = reading_in.serialize()
+    assert len(frame) < len(messages.SensorReading(*range(18)).serialize())
+
+    reading_out = messages.SensorReadingV2.from_message(parse_msg(frame))
+    assert isinstance(reading_out, messages.SensorReading)
+    assert reading_out.in_dht_temp_C == pytest.approx(21.3)
+    assert reading_out.in_bme_temp_C == pytest.approx(22.51)
+    assert reading_out.in_bme_gas == 123456
+    assert reading_out.out_dht_humidity_rh == pytest.approx(46.2)
+    assert reading_out.out_sgp_TVOC == 15
+    assert reading_out.out_bme_pressure_hPa == pytest.approx(998.24)
+    assert reading_out.out_bme_altitude_m == pytest.approx(messages.altitude_m(998.24))
+
+
+def test_reading_format_messages():
+    request = messages.ReadingFormatRequest.from_message(
+        parse_msg(messages.ReadingFormatRequest(messages.READING_FORMAT_V2).serialize())
+    )
+    assert request.reading_format == messages.READING_FORMAT_V2
+    response = messages.ReadingFormatResponse.from_message(
+        parse_msg(
+            messages.ReadingFormatResponse(messages.READING_FORMAT_V1).serialize()
+        )
+    )
+    assert response.reading_format == messages.READING_FORMAT_V1
+    assert (
+        messages.READING_FORMATS[messages.READING_FORMAT_V2] is messages.SensorReadingV2
+    )
+
+
+def test_version_tuple():
+    assert messages.version_tuple("0.0.3") == (0, 0, 3)
+    assert messages.version_tuple("0.0.3-sim") == (0, 0, 3)
+    assert messages.version_tuple("0.0.2") < messages.READING_FORMAT_MIN_VERSION
+    assert messages.version_tuple("1.x") == (1, 0)
+
+
+def test_field_mask():
+    assert messages.field_mask(["intake", "exhaust"]) == messages.FIELDS_ALL
+    assert messages.field_mask(["in_dht_temp_C"]) == 1
+    assert messages.field_mask(["out_bme_pressure_hPa"]) == 1 << 15
+    with pytest.raises(ValueError):
+        messages.field_mask(["in_bme_altitude_m"])
+
+    request = messages.FieldMaskRequest.from_message(
+        parse_msg(messages.FieldMaskRequest(0x1234).serialize())
+    )
+    assert request.field_mask == 0x1234
+    response = messages.FieldMaskResponse.from_message(
+        parse_msg(messages.FieldMaskResponse(0xFFFF).serialize())
+    )
+    assert response.field_mask == 0xFFFF
+
+
+def test_sensor_reading_masked():
+    mask = messages.field_mask(
+        ["in_bme_temp_C", "in_sgp_TVOC", "out_bme_temp_C", "out_bme_pressure_hPa"]
+    )
+    reading_in = messages.SensorReadingMasked(
+        mask,
+        21.3,
+        45.1,
+        400,
+        12,
+        22.51,
+        123456,
+        43.27,
+        1001.5,
+        0,
+        22.4,
+        46.2,
+        410,
+        15,
+        23.07,
+        98765,
+        41.11,
+        998.24,
+        0,
+    )
+    frame = reading_in.serialize()
+    assert len(frame) == messagepacket.META_LEN + 2 + 2 + 2 + 2 + 2
+
+    reading_out = messages.SensorReadingMasked.from_message(parse_msg(frame))
+    assert reading_out.field_mask == mask
+    assert reading_out.in_bme_temp_C == pytest.approx(22.51)
+    assert reading_out.in_sgp_TVOC == 12
+    assert reading_out.out_bme_temp_C == pytest.approx(23.07)
+    assert reading_out.out_bme_pressure_hPa == pytest.approx(998.24)
+    assert reading_out.out_bme_altitude_m == pytest.approx(messages.altitude_m(998.24))
+    assert reading_out.in_dht_temp_C is None
+    assert reading_out.in_bme_altitude_m is None
+    assert reading_out.out_sgp_TVOC is None
+
+
+def test_sensor_reading_masked_all_fields_matches_v2():
+    values = (
+        21.3,
+        45.1,
+        400,
+        12,
+        22.51,
+        123456,
+        43.27,
+        1001.5,
+        0,
+        22.4,
+        46.2,
+        410,
+        15,
+        23.07,
+        98765,
+        41.11,
+        998.24,
+        0,
+    )
+    masked = messages.SensorReadingMasked.from_message(
+        parse_msg(
+            messages.SensorReadingMasked(messages.FIELDS_ALL, *values).serialize()
+        )
+    )
+    v2 = messages.SensorReadingV2.from_message(
+        parse_msg(messages.SensorReadingV2(*values).serialize())
+    )
+    for name, _, _ in messages.SENSOR_FIELDS:
+        assert getattr(masked, name) == pytest.approx(getattr(v2, name))
+    assert masked.timestamp_ms is None and v2.timestamp_ms is None
+
+
+def test_report_policy_messages():
+    deadbands = messages.report_deadbands({"bme_temp_C": 0.5, "out_sgp_TVOC": 20})
+    assert len(deadbands) == len(messages.SENSOR_FIELDS)
+    names = [name for name, _, _ in messages.SENSOR_FIELDS]
+    assert deadbands[names.index("in_bme_temp_C")] == 50
+    assert deadbands[names.index("out_bme_temp_C")] == 50
+    assert deadbands[names.index("in_sgp_TVOC")] == 5
+    assert deadbands[names.index("out_sgp_TVOC")] == 20
+    with pytest.raises(ValueError):
+        messages.report_deadbands({"bogus": 1})
+
+    request = messages.ReportPolicyRequest.from_message(
+        parse_msg(messages.ReportPolicyRequest(30000, deadbands).serialize())
+    )
+    assert request.max_silence_ms == 30000
+    assert request.deadbands == deadbands
+    response = messages.ReportPolicyResponse.from_message(
+        parse_msg(messages.ReportPolicyResponse(30000, deadbands).serialize())
+    )
+    assert response.deadbands == deadbands
+
+
+def test_report_filter():
+    values = [
+        21.3,
+        45.1,
+        400,
+        12,
+        22.51,
+        123456,
+        43.27,
+        1001.5,
+        0,
+        22.4,
+        46.2,
+        410,
+        15,
+        23.07,
+        98765,
+        41.11,
+        998.24,
+        0,
+    ]
+    report_filter = messages.ReportFilter()
+    assert report_filter.should_report(messages.SensorReading(*values), 0)
+    assert report_filter.should_report(messages.SensorReading(*values), 0)
+
+    report_filter.set_policy(
+        messages.ReportPolicyRequest(10000, messages.report_deadbands())
+    )
+    assert report_filter.should_report(messages.SensorReading(*values), 0)
+    assert not report_filter.should_report(messages.SensorReading(*values), 1000)
+
+    # inside the 0.1 C deadband
+    values[4] = 22.58
+    assert not report_filter.should_report(messages.SensorReading(*values), 2000)
+    # outside of it
+    values[4] = 22.70
+    assert report_filter.should_report(messages.SensorReading(*values), 3000)
+    assert not report_filter.should_report(messages.SensorReading(*values), 12999)
+    # heartbeat
+    assert report_filter.should_report(messages.SensorReading(*values), 13000)
+
+
+def test_sample_rate_messages():
+    assert messages.sample_period_ms(1.0) == 1000
+    assert messages.sample_period_ms(10.0) == 100
+    assert messages.sample_period_ms(1000.0) == messages.MIN_SAMPLE_PERIOD_MS
+    assert messages.sample_period_ms(0.0001) == messages.MAX_SAMPLE_PERIOD_MS
+
+    request = messages.SampleRateRequest.from_message(
+        parse_msg(messages.SampleRateRequest(250).serialize())
+    )
+    assert request.period_ms == 250
+    response = messages.SampleRateResponse.from_message(
+        parse_msg(messages.SampleRateResponse(60000).serialize())
+    )
+    assert response.period_ms == 60000
+
+
+def test_scheduler_diagnostics():
+    tasks = [
+        messages.TaskStats(0, 1000, 3, 5, 120, 2),
+        messages.TaskStats(1, 2000, 0, 0, 70000, 1),
+    ]
+    diagnostics = messages.SchedulerDiagnostics.from_message(
+        parse_msg(messages.SchedulerDiagnostics(tasks).serialize())
+    )
+    assert diagnostics.tasks[0] == tasks[0]
+    assert diagnostics.tasks[1].late_max_ms == 65535
+
+
+def test_reading_aggregator():
+    aggregator = messages.ReadingAggregator()
+    assert aggregator.take() is None
+    for tvoc, temp in ((10, 20.0), (40, 22.0), (25, 21.5)):
+        values = list(range(1, 19))
+        values[3] = tvoc
+        values[4] = temp
+        aggregator.add(messages.SensorReading(*values))
+    stats = aggregator.take()
+    assert aggregator.take() is None
+
+    stats = messages.SensorReadingStats.from_message(parse_msg(stats.serialize()))
+    assert stats.count == 3
+    assert stats.in_sgp_TVOC == 25
+    assert stats.minimum.in_sgp_TVOC == 10
+    assert stats.maximum.in_sgp_TVOC == 40
+    assert stats.in_bme_temp_C == pytest.approx(21.17)
+    assert stats.minimum.in_bme_temp_C == pytest.approx(20.0)
+    assert stats.maximum.in_bme_temp_C == pytest.approx(22.0)
+    assert stats.out_sgp_TVOC == 13
+    assert (
+        messages.READING_FORMATS[messages.READING_FORMAT_STATS]
+        is messages.SensorReadingStats
+    )
+
+
+def test_reading_aggregator_fresh_fields():
+    aggregator = messages.ReadingAggregator()
+    in_bme = messages.field_mask(["in_bme_temp_C"])
+    in_sgp = messages.field_mask(["in_sgp_TVOC"])
+    for tvoc, temp, fields in ((10, 20.0, in_bme | in_sgp), (99, 22.0, in_bme)):
+        values = list(range(1, 19))
+        values[3] = tvoc
+        values[4] = temp
+        aggregator.add(messages.SensorReading(*values), fields)
+    stats = aggregator.take()
+    # TVOC was only read once
+    assert stats.count == 1
+    assert stats.in_bme_temp_C == pytest.approx(21.0)
+    # the second TVOC value was only repeated from the cache
+    assert stats.in_sgp_TVOC == stats.maximum.in_sgp_TVOC == 10
+
+    aggregator.add(messages.SensorReading(*range(1, 19)), in_sgp)
+    stats = aggregator.take()
+    assert stats.count == 1
+    assert stats.in_sgp_TVOC == 4
+    # fields without a fresh value repeat the last one
+    assert stats.in_bme_temp_C == stats.minimum.in_bme_temp_C == pytest.approx(22.0)
+    assert stats.out_sgp_TVOC == 0
+
+
+def test_reading_aggregator_peek():
+    aggregator = messages.ReadingAggregator()
+    in_bme = messages.field_mask(["in_bme_temp_C"])
+    for temp in (20.0, 30.0):
+        values = list(range(1, 19))
+        values[4] = temp
+        aggregator.add(messages.SensorReading(*values), in_bme)
+        # a report that is not sent keeps its values for the next one
+        assert aggregator.peek().maximum.in_bme_temp_C == pytest.approx(temp)
+    stats = aggregator.peek()
+    assert stats.count == 2
+    assert stats.minimum.in_bme_temp_C == pytest.approx(20.0)
+    aggregator.clear()
+    assert aggregator.peek() is None
+
+
+def test_reading_timestamp():
+    reading = messages.SensorReadingV2(*range(1, 19))
+    assert (
+        messages.SensorReadingV2.from_message(
+            parse_msg(reading.serialize())
+        ).timestamp_ms
+        is None
+    )
+
+    reading.timestamp_ms = 123456
+    frame = reading.serialize()
+    assert len(frame) == reading.PayloadLength + 4 + messagepacket.META_LEN
+    reading = messages.SensorReadingV2.from_message(parse_msg(frame))
+    assert reading.timestamp_ms == 123456
+
+    masked = messages.SensorReadingMasked(messages.FIELDS_INTAKE, *range(1, 19))
+    masked.timestamp_ms = 42
+    assert (
+        messages.SensorReadingMasked.from_message(
+            parse_msg(masked.serialize())
+        ).timestamp_ms
+        == 42
+    )
+
+    batch = messages.SensorReadingBatch(0xFFFFFFF0, [0, 32], [reading, reading])
+    batch = messages.SensorReadingBatch.from_message(parse_msg(batch.serialize()))
+    assert [r.timestamp_ms for r in batch.readings] == [0xFFFFFFF0, 16]
+
+
+def test_time_sync():
+    request = messages.TimeSyncRequest.from_message(
+        parse_msg(messages.TimeSyncRequest(7).serialize())
+    )
+    assert request.seq == 7
+    response = messages.TimeSyncResponse.from_message(
+        parse_msg(messages.TimeSyncResponse(7, 0x123456789).serialize())
+    )
+    assert (response.seq, response.device_ms) == (7, 0x23456789)
+
+
+def test_sequence_number():
+    frame = messages.StateChangeRequest(3).serialize()
+    assert messages.StateChangeRequest.from_message(parse_msg(frame)).seq is None
+
+    frame = messages.ReportPolicyRequest(1000, [1] * 16, seq=200).serialize()
+    request = messages.ReportPolicyRequest.from_message(parse_msg(frame))
+    assert request.seq == 200
+    assert request.max_silence_ms == 1000
+
+    frame = messages.SampleRateResponse(500, seq=request.seq).serialize()
+    assert messages.SampleRateResponse.from_message(parse_msg(frame)).seq == 200
+
+
+def test_frame_lengths():
+    values = [1] * messages.SensorReading.ValueCount
+    longest = [
+        messages.VersionResponse("x" * messages.VersionResponse.MaxPayloadLength),
+        messages.StateChangeRequest(1, seq=2),
+        messages.SensorReadingV2(*values),
+        messages.SensorReadingMasked(messages.FIELDS_ALL, *values),
+        messages.SensorReadingStats(
+            2, messages.SensorReading(*values), messages.SensorReading(*values), *values
+        ),
+        messages.TimeSyncResponse(1, 2),
+    ]
+    for msg in longest:
+        if isinstance(msg, messages.SensorReading):
+            msg.timestamp_ms = 1234
+        assert len(msg.serialize()) == messages.FRAME_LENGTHS[msg.MsgId]
+    assert messages.FRAME_LENGTHS[0x42] == 0
+    assert max(messages.FRAME_LENGTHS) <= messagepacket.MAX_MSG_LEN
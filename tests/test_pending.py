@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.pending`."""
+
+from nevermoremax.firmware import messages
+from nevermoremax.pending import PendingRequests
+
+
+def make_pending(**kwargs):
+    sent = []
+    done = []
+    pending = PendingRequests(lambda frame, key: sent.append(frame), **kwargs)
+    pending.use_seq = True
+    return pending, sent, lambda request, response: done.append(response), done
+
+
+def test_out_of_order_responses():
+    pending, sent, callback, done = make_pending()
+    pending.submit(messages.StateChangeRequest(1), 0.0, callback)
+    pending.submit(messages.StateChangeRequest(2), 0.0, callback)
+    first, second = [entry.request.seq for entry in pending.in_flight]
+    assert first != second
+    assert len(sent) == 2
+
+    pending.complete(messages.StateChangeResponse(2, seq=second), 0.1)
+    pending.complete(messages.StateChangeResponse(1, seq=first), 0.1)
+    assert [r.state for r in done] == [2, 1]
+    assert pending.next_deadline() is None
+    # duplicate answer to a retried request
+    assert pending.complete(messages.StateChangeResponse(1, seq=first), 0.1) is None
+
+
+def test_retry_then_timeout():
+    pending, sent, callback, done = make_pending(timeout=0.25, retries=2)
+    pending.submit(messages.SampleRateRequest(1000), 0.0, callback)
+    assert pending.check_timeouts(0.1) == 0.25
+    assert pending.check_timeouts(0.25) == 0.5
+    assert pending.check_timeouts(0.5) == 0.75
+    assert len(sent) == 3 and sent[0] == sent[2]
+    assert pending.check_timeouts(0.75) is None
+    assert done == [None]
+    assert (pending.retry_count, pending.timeout_count) == (2, 1)
+
+
+def test_backlog_and_unsequenced():
+    pending, sent, callback, done = make_pending(max_in_flight=1)
+    pending.use_seq = False
+    pending.submit(messages.VersionRequest(), 0.0, callback)
+    pending.submit(messages.FieldMaskRequest(3), 0.0, callback)
+    assert len(sent) == 1
+    assert pending.in_flight[0].request.MsgId == messages.VersionRequest.MsgId
+
+    # matched by response type, the backlog is sent once a slot frees up
+    pending.complete(messages.VersionResponse("0.0.9"), 0.1)
+    assert len(sent) == 2
+    assert pending.in_flight[0].request.seq is None
+    pending.complete(messages.FieldMaskResponse(3), 0.2)
+    assert [type(r) for r in done] == [
+        messages.VersionResponse,
+        messages.FieldMaskResponse,
+    ]
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.firmware.scheduler`."""
+
+import pytest
+
+from nevermoremax.firmware import scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def run(self, sched, cycles):
+        for _ in range(cycles):
+            wait_ms = sched.run_pending()
+            self.now += wait_ms
+
+
+def test_deadlines_do_not_drift():
+    clock = FakeClock()
+    sched = scheduler.Scheduler(clock)
+    runs = []
+
+    def work():
+        runs.append(clock.now)
+        clock.now += 30  # time spent in the task
+
+    sched.add(work, 100)
+    clock.run(sched, 5)
+    assert runs == [0, 100, 200, 300, 400]
+    assert sched.tasks[0].overruns == 0
+
+
+def test_overrun_skip():
+    clock = FakeClock()
+    sched = scheduler.Scheduler(clock)
+    runs = []
+
+    def work():
+        runs.append(clock.now)
+        clock.now += 250 if len(runs) == 1 else 10
+
+    task = sched.add(work, 100, policy=scheduler.SKIP)
+    clock.run(sched, 3)
+    # 100 and 200 are skipped, the grid is kept
+    assert runs == [0, 300, 400]
+    assert task.overruns == 1
+    assert task.missed == 2
+
+
+def test_overrun_coalesce():
+    clock = FakeClock()
+    sched = scheduler.Scheduler(clock)
+    runs = []
+
+    def work():
+        runs.append(clock.now)
+        clock.now += 250 if len(runs) == 1 else 10
+
+    task = sched.add(work, 100, policy=scheduler.COALESCE)
+    clock.run(sched, 3)
+    # one catch-up run for 100 and 200, then back on the grid
+    assert runs == [0, 250, 300]
+    assert task.overruns == 1
+    assert task.missed == 1
+
+
+def test_priority_order_and_stats():
+    clock = FakeClock()
+    sched = scheduler.Scheduler(clock)
+    order = []
+
+    def low():
+        order.append("low")
+        clock.now += 5
+
+    def high():
+        order.append("high")
+        clock.now += 5
+
+    low_task = sched.add(low, 100, priority=0)
+    sched.add(high, 100, priority=1)
+    assert sched.run_pending() == 90
+    assert order == ["high", "low"]
+
+    stats = low_task.take_stats()
+    assert stats == (low_task.task_id, 1, 0, 0, 5, 5)
+    assert low_task.take_stats()[4:] == (0, 0)
+
+
+def test_period_change():
+    clock = FakeClock()
+    sched = scheduler.Scheduler(clock)
+    runs = []
+    task = sched.add(lambda: runs.append(clock.now), 1000)
+    assert sched.run_pending() == 1000
+    clock.now = 300
+    task.set_period(100, clock.now)
+    clock.run(sched, 4)
+    # the next run is pulled in from 1000
+    assert runs == [0, 400, 500, 600]
+    # a longer period keeps the armed deadline
+    task.set_period(1000, clock.now)
+    clock.run(sched, 2)
+    assert runs == [0, 400, 500, 600, 700, 1700]
+
+
+def test_staggered_start_one_task_per_pass():
+    clock = FakeClock()
+    sched = scheduler.Scheduler(clock)
+    runs = []
+    sched.add(lambda: runs.append(("a", clock.now)), 1000)
+    sched.add(lambda: runs.append(("b", clock.now)), 1000, start_ms=500)
+    sched.add(lambda: runs.append(("c", clock.now)), 1000)
+
+    # a and c are both due, only one runs per pass
+    assert sched.run_pending(1) == 0
+    assert sched.run_pending(1) == 500
+    clock.now += 500
+    sched.run_pending(1)
+    assert runs == [("a", 0), ("c", 0), ("b", 500)]
+
+
+def test_add_arguments():
+    clock = FakeClock()
+    sched = scheduler.Scheduler(clock)
+    runs = []
+    task = sched.add(runs.append, 100, "x", priority=3, policy=scheduler.COALESCE)
+    assert (task.priority, task.policy) == (3, scheduler.COALESCE)
+    sched.run_pending()
+    assert runs == ["x"]
+    with pytest.raises(TypeError):
+        sched.add(runs.append, 100, "x", prio=3)
+
+
+def test_backoff():
+    backoff = scheduler.Backoff(1, 16)
+    assert [backoff.next() for _ in range(7)] == [1, 2, 4, 8, 16, 16, 16]
+    backoff.reset()
+    assert backoff.next() == 1
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.serialwriter`."""
+
+import errno
+
+from nevermoremax.serialwriter import SerialWriter
+
+
+class FakePort:
+    def __init__(self, room):
+        self.room = room
+        self.data = bytearray()
+        self.error = None
+
+    def write(self, data):
+        if self.error is not None:
+            raise OSError(self.error, "write failed")
+        if not self.room:
+            raise OSError(errno.EAGAIN, "would block")
+        written = min(self.room, len(data))
+        self.data += data[:written]
+        self.room -= written
+        return written
+
+
+def test_partial_writes_keep_frames_whole():
+    port = FakePort(5)
+    writer = SerialWriter(port.write)
+    wakes = []
+    writer.wants_write = wakes.append
+    assert writer.send(b"AAAA")
+    assert not writer.send(b"BBBB")
+    assert port.data == b"AAAAB"
+    assert wakes[-1] is True
+
+    port.room = 100
+    assert writer.flush()
+    assert port.data == b"AAAABBBB"
+    assert wakes[-1] is False
+    assert writer.frames_sent == 2
+    assert writer.partial_writes == 1
+
+
+def test_merge_and_drop():
+    port = FakePort(2)
+    writer = SerialWriter(port.write, max_frames=3)
+    writer.send(b"head")
+    writer.send(b"old ping", key="ping")
+    writer.send(b"new ping", key="ping")
+    assert writer.frames_merged == 1
+    writer.send(b"1111")
+    writer.send(b"2222")
+    # the partly written head stays, the oldest waiting frame goes
+    assert writer.frames_dropped == 1
+    port.room = 100
+    writer.flush()
+    assert port.data == b"head11112222"
+
+
+def test_merge_skips_partly_written_head():
+    port = FakePort(2)
+    writer = SerialWriter(port.write)
+    writer.send(b"ping", key="ping")
+    writer.send(b"PING", key="ping")
+    port.room = 100
+    writer.flush()
+    assert port.data == b"pingPING"
+
+
+def test_write_error_parks_queue():
+    port = FakePort(2)
+    writer = SerialWriter(port.write)
+    wakes = []
+    errors = []
+    writer.wants_write = wakes.append
+    writer.link_lost = errors.append
+    writer.send(b"AAAA")
+    port.error = errno.EIO
+    assert not writer.send(b"BBBB")
+    # the failed frame is dropped, no writable wakeups for a dead port
+    assert wakes[-1] is False
+    assert writer.link_down
+    assert writer.frames_dropped == 1
+    assert len(writer) == 1
+    writer.send(b"CCCC")
+    assert len(errors) == 1
+    assert writer.write_errors == 2
+
+    port.error = None
+    port.room = 100
+    assert writer.send(b"DDDD")
+    assert not writer.link_down
+    assert port.data == b"AACCCCDDDD"
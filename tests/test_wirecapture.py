@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""Tests for `nevermoremax.wirecapture`."""
+
+import math
+
+import pytest
+
+from nevermoremax import wirecapture
+from nevermoremax.firmware import messagepacket
+from nevermoremax.firmware import messages
+
+
+def make_reading(cls=messages.SensorReadingV2):
+    return cls(*[float(idx + 20) for idx in range(messages.SensorReading.ValueCount)])
+
+
+def write_capture(path, chunks):
+    capture = wirecapture.WireCapture(path, max_age=0)
+    capture.start()
+    for wall_time, data in chunks:
+        capture.capture(wall_time, data)
+    capture.stop()
+
+
+def parser_frames(data):
+    parser = messagepacket.MessageParser()
+    parser.append(data)
+    return [(msg.msg_id, msg.payload.tobytes()) for msg in parser.parse_all()]
+
+
+def test_chunks_round_trip(tmp_path):
+    path = str(tmp_path / "wire.cap")
+    chunks = [(1.5, b"\xa5\x01"), (2.5, b"abc")]
+    write_capture(path, chunks)
+    # a chunk cut short by a crash is ignored
+    with open(path, "ab") as f:
+        f.write(wirecapture.CHUNK_HEADER.pack(3.5, 10) + b"x")
+    assert list(wirecapture.iter_chunks(path)) == chunks
+
+
+def test_append_after_crash(tmp_path):
+    path = str(tmp_path / "wire.cap")
+    write_capture(path, [(1.5, b"abc")])
+    with open(path, "ab") as f:
+        f.write(wirecapture.CHUNK_HEADER.pack(2.5, 10) + b"x")
+    write_capture(path, [(3.5, b"def")])
+    assert list(wirecapture.iter_chunks(path)) == [(1.5, b"abc"), (3.5, b"def")]
+
+
+def test_find_frames_matches_parser():
+    np = pytest.importorskip("numpy")
+    frame = bytes(make_reading().serialize())
+    inner = bytes(messages.VersionRequest().serialize())
+    # a frame carrying a valid frame in its payload, a damaged one that
+    # does, noise and a frame cut off at the end
+    outer = bytes(messagepacket.MessagePacket(0x42, inner).serialize())
+    damaged = bytearray(outer)
+    damaged[-1] ^= 0xFF
+    stream = frame + outer + b"\xa5\x07\x00" + bytes(damaged) + frame + frame[:-3]
+
+    data = np.frombuffer(stream, dtype=np.uint8)
+    starts, lengths = wirecapture.find_frames(data)
+    found = [
+        (stream[start + 2], stream[start + 3 : start + length - 1])
+        for start, length in zip(starts.tolist(), lengths.tolist())
+    ]
+    assert found == parser_frames(stream)
+    assert [msg_id for msg_id, _ in found] == [
+        messages.SensorReadingV2.MsgId,
+        0x42,
+        messages.VersionRequest.MsgId,
+        messages.SensorReadingV2.MsgId,
+    ]
+
+
+def test_decode_capture(tmp_path):
+    np = pytest.importorskip("numpy")
+    v1 = make_reading(messages.SensorReading)
+    v2 = make_reading()
+    v2.timestamp_ms = 1234
+    masked = messages.SensorReadingMasked(
+        messages.field_mask(["intake"]), *[25.0] * messages.SensorReading.ValueCount
+    )
+    batch = messages.SensorReadingBatch(
+        1000, [0, 500], [make_reading(messages.SensorReading)] * 2
+    )
+    stream = b"".join(
+        bytes(msg.serialize())
+        for msg in (v1, messages.VersionRequest(), v2, masked, batch)
+    )
+    path = str(tmp_path / "wire.cap")
+    split = v1.frame_length()
+    write_capture(path, [(10.0, stream[:split]), (11.0, stream[split:])])
+
+    columns = wirecapture.decode_capture(path)
+    assert columns["frame"].tolist() == [0, 2, 3, 4, 4]
+    assert columns["msg_id"].tolist() == [
+        messages.SensorReading.MsgId,
+        messages.SensorReadingV2.MsgId,
+        messages.SensorReadingMasked.MsgId,
+        messages.SensorReadingBatch.MsgId,
+        messages.SensorReadingBatch.MsgId,
+    ]
+    assert columns["time"].tolist() == [10.0, 11.0, 11.0, 11.0, 11.0]
+    timestamps = columns["timestamp_ms"].tolist()
+    assert math.isnan(timestamps[0]) and math.isnan(timestamps[2])
+    assert [timestamps[1]] + timestamps[3:] == [1234, 1000, 1500]
+    assert np.allclose(columns["in_bme_temp_C"], [24.0, 24.0, 25.0, 24.0, 24.0])
+    assert math.isnan(columns["out_bme_temp_C"][2])
+
+
+def test_decode_short_payloads():
+    np = pytest.importorskip("numpy")
+    frame = bytes(make_reading().serialize())
+    # valid frames too short for the batch header or the field mask, last
+    # in the stream so reading past their payload leaves the data
+    for cls in (messages.SensorReadingBatch, messages.SensorReadingMasked):
+        short = bytes(messagepacket.MessagePacket(cls.MsgId, b"\x01").serialize())
+        data = np.frombuffer(frame + short, dtype=np.uint8)
+        starts, lengths = wirecapture.find_frames(data)
+        assert len(starts) == 2
+        columns = wirecapture.decode_readings(data, starts, lengths)
+        assert columns["msg_id"].tolist() == [messages.SensorReadingV2.MsgId]